@@ -0,0 +1,381 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Measures the client's own overhead on each `OpenTreeService` endpoint by
+calling it repeatedly against a local
+`pyopentree.mockserver.MockOpenTreeServer` that serves synthetic responses
+of realistic sizes (a 100,000-tip `tol_subtree`, a 200,000-tip
+`taxonomy_subtree`, a 5,000-OTU study, 1,000-name TNRS batches, ...).
+Reports, per endpoint, the throughput and p50/p99 latency of the calls, the
+CPU time spent decoding the JSON of one response, and the peak memory
+allocated by one call (with `tracemalloc`, where available), as JSON on
+standard output (or to `--output`) and as a table on standard error. With `--baseline`, compares the p50 latencies to those of a
+previous run and exits with status 1 if any endpoint got slower by more
+than `--tolerance`.
+"""
+
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import argparse
+import io
+import json
+import platform
+import random
+import sys
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+import pyopentree
+import pyopentree.mockserver
+from bench_label_parsing import random_tree_newick
+
+_clock = getattr(time, "perf_counter", time.time)
+_cpu_clock = getattr(time, "process_time", getattr(time, "clock", None))
+
+def random_nexson(study_id, num_otus, num_trees, rng):
+    """
+    Returns the NexSON of a synthetic study with `num_otus` OTUs and
+    `num_trees` random trees on all of them.
+    """
+    otus = {}
+    for i in range(num_otus):
+        otus["otu{}".format(i)] = {
+                "^ot:originalLabel": "Genus{} species{}".format(i // 7, i),
+                "^ot:ottId": 1000000 + i,
+                "^ot:ottTaxonName": "Genus{} species{}".format(i // 7, i),
+                }
+    trees = {}
+    for t in range(num_trees):
+        nodes = {}
+        edges = {}
+        subtrees = []
+        for i in range(num_otus):
+            node_id = "node{}".format(i)
+            nodes[node_id] = {"@otu": "otu{}".format(i)}
+            subtrees.append(node_id)
+        next_id = num_otus
+        while len(subtrees) > 1:
+            rng.shuffle(subtrees)
+            paired = []
+            for i in range(0, len(subtrees) - 1, 2):
+                node_id = "node{}".format(next_id)
+                next_id += 1
+                nodes[node_id] = {}
+                edges[node_id] = dict(
+                        ("edge{}".format(child), {
+                            "@source": node_id,
+                            "@target": child,
+                            "@length": round(rng.random(), 4),
+                            })
+                        for child in (subtrees[i], subtrees[i + 1]))
+                paired.append(node_id)
+            if len(subtrees) % 2:
+                paired.append(subtrees[-1])
+            subtrees = paired
+        nodes[subtrees[0]]["@root"] = True
+        trees["tree{}".format(t + 1)] = {
+                "^ot:rootNodeId": subtrees[0],
+                "nodeById": nodes,
+                "edgeBySourceId": edges,
+                }
+    return {"nexml": {
+        "^ot:studyId": study_id,
+        "^ot:studyPublicationReference": "Synthetic study {}".format(study_id),
+        "otusById": {"otus1": {"otuById": otus}},
+        "treesById": {"trees1": {"@otus": "otus1", "treeById": trees}},
+        }}
+
+def study_meta(nexson):
+    """
+    Returns the metadata of the study `nexson`, as served by
+    `get_study_meta`: the NexSON without the OTUs and the bodies of the
+    trees.
+    """
+    nexml = dict(nexson["nexml"])
+    nexml["otusById"] = dict((otus_id, dict(otus, otuById={})) for otus_id, otus in nexml["otusById"].items())
+    nexml["treesById"] = dict(
+            (trees_id, dict(trees, treeById=dict((tree_id, {}) for tree_id in trees["treeById"])))
+            for trees_id, trees in nexml["treesById"].items())
+    return {"nexml": nexml}
+
+def lineage(depth):
+    return [{"ot:ottId": 100 + i, "ot:ottTaxonName": "Taxon{}".format(i), "rank": "no rank"} for i in range(depth)]
+
+def study_record(i):
+    return {
+            "ot:studyId": "pg_{}".format(i),
+            "ot:studyPublicationReference": "Author {0}, et al. {1}. Title of study {0}. Journal {2}: {3}.".format(i, 1990 + i % 25, i % 40, i),
+            "ot:studyPublication": "http://dx.doi.org/10.1000/{}".format(i),
+            "ot:curatorName": "Curator {}".format(i % 30),
+            "ot:studyYear": 1990 + i % 25,
+            "ot:focalClade": 1000 + i % 500,
+            "ot:focalCladeOTTTaxonName": "Clade{}".format(i % 500),
+            "ot:dataDeposit": "http://datadryad.org/{}".format(i),
+            "ot:tag": ["tag{}".format(i % 7)],
+            }
+
+def endpoint_cases(scale, rng):
+    """
+    Returns a list of `(name, kwargs, response)` for each endpoint.
+    """
+    def n(size):
+        return max(2, int(size * scale))
+    names = ["Genus{} species{}".format(i // 7, i) for i in range(n(1000))]
+    ott_ids = list(range(1000000, 1000000 + n(1000)))
+    match_results = [{
+        "id": name,
+        "matches": [{
+            "matched_name": name,
+            "search_string": name.lower(),
+            "score": 1.0,
+            "is_approximate_match": False,
+            "is_synonym": False,
+            "ot:ottId": ott_id,
+            "ot:ottTaxonName": name,
+            "unique_name": name,
+            "flags": [],
+            "synonyms": ["Synonym {}".format(ott_id)],
+            } for ott_id in (1000000 + i, 2000000 + i)],
+        } for i, name in enumerate(names)]
+    study = random_nexson("pg_1", n(5000), 2, rng)
+    otus = study["nexml"]["otusById"]["otus1"]["otuById"]
+    return [
+        ("tol_about", {"study_list": True}, {
+            "tree_id": "opentree4.1",
+            "root_ott_id": 93302,
+            "num_tips": 2424255,
+            "num_source_studies": n(2000),
+            "study_list": [{"study_id": "pg_{}".format(i), "tree_id": "tree{}".format(i), "git_sha": "{:040x}".format(i)} for i in range(n(2000))],
+            }),
+        ("tol_mrca", {"ott_ids": ott_ids[:20]}, {
+            "mrca_node_id": 3599390,
+            "nearest_taxon_mrca_ott_id": 770309,
+            "nearest_taxon_mrca_name": "Hominidae",
+            "ott_ids_not_in_tree": [],
+            "node_ids_not_in_tree": [],
+            }),
+        ("tol_subtree", {"ott_id": 691846}, {"newick": random_tree_newick(n(100000), rng)}),
+        ("tol_induced_subtree", {"ott_ids": ott_ids}, {
+            "subtree": random_tree_newick(len(ott_ids), rng),
+            "ott_ids_not_in_tree": [],
+            "node_ids_not_in_tree": [],
+            }),
+        ("gol_about", {}, {"graph_num_tips": 2424255, "graph_num_source_trees": 484, "graph_taxonomy_version": "2.8"}),
+        ("gol_source_tree", {"study_id": "pg_420", "tree_id": "522", "git_sha": "a2c48df995ddc9fd208986c3d4225112550c8452"},
+            {"newick": random_tree_newick(n(5000), rng)}),
+        ("gol_node_info", {"ott_id": 810751, "include_lineage": True}, {
+            "node_id": 3599390,
+            "ott_id": 810751,
+            "name": "Catarrhini",
+            "num_tips": 369,
+            "draft_tree_lineage": lineage(40),
+            "synth_sources": [{"study_id": "pg_{}".format(i), "tree_id": "tree{}".format(i), "git_sha": "{:040x}".format(i)} for i in range(50)],
+            }),
+        ("tnrs_match_names", {"names": names}, {
+            "context": "All life",
+            "matched_name_ids": names,
+            "unmatched_name_ids": [],
+            "results": match_results,
+            }),
+        ("tnrs_contexts", {}, {"PLANTS": ["Land plants", "Seed plants", "Flowering plants"], "ANIMALS": ["Animals", "Birds", "Tetrapods"]}),
+        ("tnrs_infer_context", {"names": names}, {"context_name": "All life", "context_ott_id": 805080, "ambiguous_names": []}),
+        ("taxonomy_about", {}, {"author": "open tree of life project", "source": "ott2.8draft5", "weburl": "https://tree.opentreeoflife.org/about/taxonomy-version/ott2.8"}),
+        ("taxonomy_lica", {"ott_ids": ott_ids[:100], "include_lineage": True}, {
+            "lica": {"ot:ottId": 770309, "ot:ottTaxonName": "Hominidae", "taxonomic_lineage": lineage(40)},
+            "ott_ids_not_found": [],
+            }),
+        ("taxonomy_subtree", {"ott_id": 515698}, {"subtree": random_tree_newick(n(200000), rng)}),
+        ("taxonomy_taxon", {"ott_id": 515698, "include_lineage": True}, {
+            "ot:ottId": 515698,
+            "ot:ottTaxonName": "Barnadesia",
+            "rank": "genus",
+            "node_id": 3626442,
+            "synonyms": ["Barnadesia synonym {}".format(i) for i in range(10)],
+            "taxonomic_lineage": lineage(40),
+            }),
+        ("studies_find_studies", {"verbose": True}, {"matched_studies": [study_record(i) for i in range(n(3000))]}),
+        ("studies_find_trees", {"property_name": "ot:ottTaxonName", "property_value": "Aves"}, {"matched_studies": [
+            dict(study_record(i), matched_trees=[{"nexson_id": "tree{}".format(j), "oti_tree_id": "pg_{}_tree{}".format(i, j)} for j in range(3)])
+            for i in range(n(1000))]}),
+        ("studies_properties", {}, {
+            "study_properties": ["ot:studyId", "ot:studyPublication", "ot:curatorName", "ot:studyYear", "ot:focalClade", "ot:tag"],
+            "tree_properties": ["ot:treeId", "ot:ottTaxonName", "ot:ottId", "ot:branchLengthMode", "ot:inferenceMethod"],
+            }),
+        ("get_study", {"study_id": "pg_1"}, study),
+        ("get_study_meta", {"study_id": "pg_1"}, study_meta(study)),
+        ("get_study_tree", {"study_id": "pg_1", "tree_id": "tree1", "schema": "newick"}, random_tree_newick(n(5000), rng)),
+        ("get_study_subtree", {"study_id": "pg_1", "tree_id": "tree1", "subtree_id": "node{}".format(n(5000)), "schema": "newick"},
+            random_tree_newick(n(2500), rng)),
+        ("get_study_otu", {"study_id": "pg_1", "otu_name": "otu1"}, {"otu1": otus["otu1"]}),
+        ("get_study_otus", {"study_id": "pg_1"}, {"otus1": {"otuById": otus}}),
+        ("get_study_otumap", {"study_id": "pg_1"}, dict(
+            (otu["^ot:originalLabel"], {"^ot:ottId": otu["^ot:ottId"], "otu": otu_id}) for otu_id, otu in otus.items())),
+        ]
+
+def percentile(sorted_values, fraction):
+    """
+    Returns the nearest-rank percentile of the sorted list `sorted_values`.
+    """
+    rank = max(1, int(fraction * len(sorted_values) + 0.999999))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+def decode_seconds(body, repeat):
+    """
+    Returns the mean CPU time taken to decode the JSON response `body`, or
+    `None` if it is not JSON.
+    """
+    text = body.decode("utf-8")
+    try:
+        json.loads(text)
+    except ValueError:
+        return None
+    start = _cpu_clock()
+    for i in range(repeat):
+        json.loads(text)
+    return (_cpu_clock() - start) / repeat
+
+def peak_memory(fn):
+    """
+    Returns the peak memory allocated (in bytes) while calling `fn`, or
+    `None` if `tracemalloc` is not available.
+    """
+    if tracemalloc is None:
+        return None
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def run_endpoint(service, server, name, kwargs, body, repeat):
+    key = server.add_call_response(name, kwargs, body)
+    if key is None:
+        raise ValueError("Endpoint '{}' does not issue a request".format(name))
+    response_bytes = len(server.responses[key][2])
+    method = getattr(service, name)
+    call = lambda: method(**kwargs)
+    call()
+    latencies = []
+    for i in range(repeat):
+        start = _clock()
+        call()
+        latencies.append(_clock() - start)
+    latencies.sort()
+    return {
+            "calls": repeat,
+            "response_bytes": response_bytes,
+            "throughput": repeat / sum(latencies),
+            "p50_seconds": percentile(latencies, 0.50),
+            "p99_seconds": percentile(latencies, 0.99),
+            "json_decode_cpu_seconds": decode_seconds(server.responses[key][2], repeat),
+            "peak_memory_bytes": peak_memory(call),
+            }
+
+def compare(results, baseline, tolerance):
+    """
+    Prints the change of the p50 latency of each endpoint since `baseline`
+    to standard error, and returns the names of the endpoints slower by more
+    than `tolerance` (a fraction).
+    """
+    regressions = []
+    for name, result in sorted(results["endpoints"].items()):
+        previous = baseline["endpoints"].get(name, None)
+        if previous is None:
+            continue
+        ratio = result["p50_seconds"] / previous["p50_seconds"]
+        flag = ""
+        if ratio > 1 + tolerance:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        sys.stderr.write("{:24} p50 {:8.2f}ms -> {:8.2f}ms ({:+.0%}){}\n".format(
+            name,
+            previous["p50_seconds"] * 1000,
+            result["p50_seconds"] * 1000,
+            ratio - 1,
+            flag))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("endpoints",
+            nargs="*",
+            help="Endpoints to run (default: all).")
+    parser.add_argument("-r", "--repeat",
+            type=int,
+            default=20,
+            help="Number of timed calls per endpoint (default: %(default)s).")
+    parser.add_argument("-s", "--scale",
+            type=float,
+            default=1.0,
+            help="Multiplier of the sizes of the responses (default: %(default)s).")
+    parser.add_argument("--latency",
+            type=float,
+            default=0.0,
+            help="Latency added by the server to each response, in seconds (default: %(default)s).")
+    parser.add_argument("--seed",
+            type=int,
+            default=1,
+            help="Random seed (default: %(default)s).")
+    parser.add_argument("-o", "--output",
+            default=None,
+            help="Path to write the results to (default: standard output).")
+    parser.add_argument("--baseline",
+            default=None,
+            help="Results of a previous run to compare with.")
+    parser.add_argument("--tolerance",
+            type=float,
+            default=0.2,
+            help="Slow-down of the p50 latency reported as a regression (default: %(default)s).")
+    args = parser.parse_args()
+
+    cases = endpoint_cases(args.scale, random.Random(args.seed))
+    if args.endpoints:
+        unknown = set(args.endpoints) - set(case[0] for case in cases)
+        if unknown:
+            parser.error("Unknown endpoints: {}".format(", ".join(sorted(unknown))))
+        cases = [case for case in cases if case[0] in args.endpoints]
+    results = {
+            "pyopentree_version": pyopentree.__version__,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "parameters": {"repeat": args.repeat, "scale": args.scale, "latency": args.latency, "seed": args.seed},
+            "endpoints": {},
+            }
+    sys.stderr.write("{:24} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10}\n".format(
+        "endpoint", "KB", "calls/s", "p50 ms", "p99 ms", "decode ms", "peak MB"))
+    with pyopentree.mockserver.MockOpenTreeServer(latency=args.latency) as server:
+        service = pyopentree.OpenTreeService(base_url=server.base_url)
+        for name, kwargs, body in cases:
+            result = run_endpoint(service, server, name, kwargs, body, args.repeat)
+            results["endpoints"][name] = result
+            sys.stderr.write("{:24} {:10.1f} {:10.1f} {:10.2f} {:10.2f} {:>10} {:>10}\n".format(
+                name,
+                result["response_bytes"] / 1024.0,
+                result["throughput"],
+                result["p50_seconds"] * 1000,
+                result["p99_seconds"] * 1000,
+                "-" if result["json_decode_cpu_seconds"] is None else "{:.2f}".format(result["json_decode_cpu_seconds"] * 1000),
+                "-" if result["peak_memory_bytes"] is None else "{:.1f}".format(result["peak_memory_bytes"] / 1048576.0)))
+
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if args.output is None:
+        print(text)
+    else:
+        with io.open(args.output, "w", encoding="utf-8") as dest:
+            dest.write(text + "\n")
+    if args.baseline is not None:
+        with io.open(args.baseline, "r", encoding="utf-8") as src:
+            baseline = json.load(src)
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Times the parsing of OpenTree taxon labels ("Genus_species_ott12345") into
+taxon names and ott ids, one label at a time as the nexss example used to,
+and in bulk with `pyopentree.parse_ott_labels`, on the labels of a random
+tree with the given number of tips (all labels carry an ott id, or none).
+"""
+
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import argparse
+import random
+import time
+
+import pyopentree
+
+def random_tree_newick(num_tips, rng):
+    """
+    Returns a random binary tree with `num_tips` tips and labelled internal
+    nodes, in NEWICK format (built bottom-up, without recursion).
+    """
+    subtrees = ["Genus{}_species{}_ott{}".format(i // 7, i, 1000000 + i) for i in range(num_tips)]
+    next_id = 1000000 + num_tips
+    while len(subtrees) > 1:
+        rng.shuffle(subtrees)
+        paired = []
+        for i in range(0, len(subtrees) - 1, 2):
+            # about one internal node in four is a named taxon
+            if rng.random() < 0.25:
+                label = "Clade{}_ott{}".format(next_id, next_id)
+            else:
+                label = ""
+            next_id += 1
+            paired.append("({},{}){}".format(subtrees[i], subtrees[i + 1], label))
+        if len(subtrees) % 2:
+            paired.append(subtrees[-1])
+        subtrees = paired
+    return subtrees[0] + ";"
+
+def parse_one_at_a_time(labels):
+    # as the nexss example did: a list and a dictionary per label
+    names = []
+    ott_ids = []
+    for label in labels:
+        if not label:
+            names.append("")
+            ott_ids.append(-1)
+            continue
+        taxon_label_split = label.split("_")
+        parsed_label = {
+                "taxon_name_parts": taxon_label_split[0:-1],
+                "ott_id": taxon_label_split[-1].strip("ott"),
+                }
+        names.append("_".join(parsed_label["taxon_name_parts"]))
+        if parsed_label["ott_id"].isdigit():
+            ott_ids.append(int(parsed_label["ott_id"]))
+        else:
+            ott_ids.append(-1)
+    return names, ott_ids
+
+def time_call(fn, *args):
+    start = time.time()
+    result = fn(*args)
+    return time.time() - start, result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", "--num-tips",
+            type=int,
+            default=1000000,
+            help="Number of tips of the tree (default: %(default)s).")
+    parser.add_argument("--seed",
+            type=int,
+            default=1,
+            help="Random seed (default: %(default)s).")
+    args = parser.parse_args()
+    newick = random_tree_newick(args.num_tips, random.Random(args.seed))
+    elapsed, tree = time_call(pyopentree.CompactTree.from_newick, newick)
+    print("tree: {} nodes, parsed in {:.2f}s".format(len(tree), elapsed))
+    labels = tree.labels
+    elapsed_single, (names_single, ott_ids_single) = time_call(parse_one_at_a_time, labels)
+    elapsed_bulk, (names_bulk, ott_ids_bulk) = time_call(pyopentree.parse_ott_labels, labels)
+    assert names_single == names_bulk
+    assert list(ott_ids_single) == list(ott_ids_bulk)
+    print("one label at a time: {:.3f}s".format(elapsed_single))
+    print("bulk:                {:.3f}s ({:.1f}x)".format(elapsed_bulk, elapsed_single / elapsed_bulk))
+
+if __name__ == "__main__":
+    main()
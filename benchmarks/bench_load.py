@@ -0,0 +1,256 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Drives a mixed workload of endpoint calls from an increasing number of
+concurrent callers (1, 8, 64 and 256 threads by default) sharing one
+`OpenTreeService` (or, with `--global-service`, the module-level functions
+and `GLOBAL_OPEN_TREE_SERVICE`), against a local
+`pyopentree.mockserver.MockOpenTreeServer`. For each level of concurrency,
+reports the throughput, the p50/p95/p99/max latency, the error rate (by
+exception type), the responses that differ from those of a single caller
+(which would point to thread-safety issues), the connections opened (in all
+and at most at once) and the memory used, as JSON on standard output (or to
+`--output`) and as a table on standard error.
+"""
+
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import argparse
+import io
+import json
+import platform
+import random
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+import pyopentree
+import pyopentree.mockserver
+from bench_endpoints import endpoint_cases
+from bench_endpoints import percentile
+
+_clock = getattr(time, "perf_counter", time.time)
+
+def max_rss_bytes():
+    """
+    Returns the peak resident set size of the process so far, or `None`
+    where it is not available.
+    """
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    if sys.platform == "darwin":
+        return max_rss
+    return max_rss * 1024
+
+def run_level(calls, expected, concurrency, requests_per_caller, seed):
+    """
+    Runs `concurrency` callers, each making `requests_per_caller` calls
+    picked at random from `calls` (a list of `(name, fn)`), and returns the
+    latencies, the counts of errors by exception type, and the number of
+    responses that differ from `expected`.
+    """
+    latencies = []
+    errors = {}
+    mismatches = [0]
+    lock = threading.Lock()
+    start_event = threading.Event()
+    def caller(index):
+        rng = random.Random(seed + index)
+        caller_latencies = []
+        caller_errors = {}
+        caller_mismatches = 0
+        start_event.wait()
+        for i in range(requests_per_caller):
+            name, fn = calls[rng.randrange(len(calls))]
+            start = _clock()
+            try:
+                response = fn()
+            except Exception as e:
+                error = type(e).__name__
+                caller_errors[error] = caller_errors.get(error, 0) + 1
+            else:
+                if response != expected[name]:
+                    caller_mismatches += 1
+            caller_latencies.append(_clock() - start)
+        with lock:
+            latencies.extend(caller_latencies)
+            for error, count in caller_errors.items():
+                errors[error] = errors.get(error, 0) + count
+            mismatches[0] += caller_mismatches
+    threads = [threading.Thread(target=caller, args=(index,)) for index in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    start = _clock()
+    start_event.set()
+    for thread in threads:
+        thread.join()
+    elapsed = _clock() - start
+    return elapsed, latencies, errors, mismatches[0]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-c", "--concurrency",
+            type=int,
+            nargs="+",
+            default=[1, 8, 64, 256],
+            help="Numbers of concurrent callers (default: %(default)s).")
+    parser.add_argument("-n", "--requests",
+            type=int,
+            default=2000,
+            help="Number of calls per level of concurrency, shared among the callers (default: %(default)s).")
+    parser.add_argument("-e", "--endpoints",
+            nargs="+",
+            default=None,
+            help="Endpoints in the workload (default: all).")
+    parser.add_argument("-s", "--scale",
+            type=float,
+            default=0.05,
+            help="Multiplier of the sizes of the responses, as in bench_endpoints.py (default: %(default)s).")
+    parser.add_argument("--latency",
+            type=float,
+            default=0.01,
+            help="Latency added by the server to each response, in seconds (default: %(default)s).")
+    parser.add_argument("--jitter",
+            type=float,
+            default=0.0,
+            help="Maximum random latency added on top of --latency, in seconds (default: %(default)s).")
+    parser.add_argument("--error-rate",
+            type=float,
+            default=0.0,
+            help="Fraction of the requests failed by the server (default: %(default)s).")
+    parser.add_argument("--global-service",
+            action="store_true",
+            default=False,
+            help="Call the module-level functions, which share GLOBAL_OPEN_TREE_SERVICE.")
+    parser.add_argument("--trace-memory",
+            action="store_true",
+            default=False,
+            help="Also report the peak memory allocated by Python during each level, with tracemalloc (slower).")
+    parser.add_argument("--seed",
+            type=int,
+            default=1,
+            help="Random seed (default: %(default)s).")
+    parser.add_argument("-o", "--output",
+            default=None,
+            help="Path to write the results to (default: standard output).")
+    args = parser.parse_args()
+    if args.trace_memory and tracemalloc is None:
+        parser.error("tracemalloc is not available")
+
+    cases = endpoint_cases(args.scale, random.Random(args.seed))
+    if args.endpoints:
+        unknown = set(args.endpoints) - set(case[0] for case in cases)
+        if unknown:
+            parser.error("Unknown endpoints: {}".format(", ".join(sorted(unknown))))
+        cases = [case for case in cases if case[0] in args.endpoints]
+    results = {
+            "pyopentree_version": pyopentree.__version__,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "parameters": {
+                "requests": args.requests,
+                "endpoints": sorted(case[0] for case in cases),
+                "scale": args.scale,
+                "latency": args.latency,
+                "jitter": args.jitter,
+                "error_rate": args.error_rate,
+                "global_service": args.global_service,
+                "seed": args.seed,
+                },
+            "levels": [],
+            }
+    sys.stderr.write("{:>6} {:>10} {:>9} {:>9} {:>9} {:>9} {:>8} {:>8} {:>8} {:>8} {:>9}\n".format(
+        "conc", "calls/s", "p50 ms", "p95 ms", "p99 ms", "max ms", "errors", "wrong", "conns", "peak", "rss MB"))
+    with pyopentree.mockserver.MockOpenTreeServer(seed=args.seed) as server:
+        if args.global_service:
+            service = pyopentree.GLOBAL_OPEN_TREE_SERVICE
+            service.base_url = server.base_url
+            target = pyopentree
+        else:
+            service = pyopentree.OpenTreeService(base_url=server.base_url)
+            target = service
+        calls = []
+        expected = {}
+        for name, kwargs, body in cases:
+            server.add_call_response(name, kwargs, body)
+            fn = (lambda method, kwargs: lambda: method(**kwargs))(getattr(target, name), kwargs)
+            expected[name] = fn()
+            calls.append((name, fn))
+        # set after the reference calls, which must not fail
+        server.latency = args.latency
+        server.jitter = args.jitter
+        server.error_rate = args.error_rate
+        for concurrency in args.concurrency:
+            server.reset_stats()
+            if args.trace_memory:
+                tracemalloc.start()
+            requests_per_caller = max(1, args.requests // concurrency)
+            elapsed, latencies, errors, mismatches = run_level(
+                    calls,
+                    expected,
+                    concurrency,
+                    requests_per_caller,
+                    args.seed)
+            peak_traced = None
+            if args.trace_memory:
+                peak_traced = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            latencies.sort()
+            num_errors = sum(errors.values())
+            level = {
+                    "concurrency": concurrency,
+                    "calls": len(latencies),
+                    "seconds": elapsed,
+                    "throughput": len(latencies) / elapsed,
+                    "p50_seconds": percentile(latencies, 0.50),
+                    "p95_seconds": percentile(latencies, 0.95),
+                    "p99_seconds": percentile(latencies, 0.99),
+                    "max_seconds": latencies[-1],
+                    "errors": errors,
+                    "error_rate": num_errors / float(len(latencies)),
+                    "mismatched_responses": mismatches,
+                    "connections": server.stats["connections"],
+                    "peak_connections": server.stats["peak_connections"],
+                    "server_requests": server.stats["requests"],
+                    "errors_injected": server.stats["errors_injected"],
+                    "max_rss_bytes": max_rss_bytes(),
+                    "peak_traced_memory_bytes": peak_traced,
+                    "id_index_size": len(service.id_index),
+                    }
+            results["levels"].append(level)
+            sys.stderr.write("{:6d} {:10.1f} {:9.2f} {:9.2f} {:9.2f} {:9.2f} {:8d} {:8d} {:8d} {:8d} {:>9}\n".format(
+                concurrency,
+                level["throughput"],
+                level["p50_seconds"] * 1000,
+                level["p95_seconds"] * 1000,
+                level["p99_seconds"] * 1000,
+                level["max_seconds"] * 1000,
+                num_errors,
+                mismatches,
+                level["connections"],
+                level["peak_connections"],
+                "-" if level["max_rss_bytes"] is None else "{:.1f}".format(level["max_rss_bytes"] / 1048576.0)))
+
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if args.output is None:
+        print(text)
+    else:
+        with io.open(args.output, "w", encoding="utf-8") as dest:
+            dest.write(text + "\n")
+
+if __name__ == "__main__":
+    main()
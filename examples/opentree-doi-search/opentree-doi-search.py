@@ -27,8 +27,11 @@ import sys
 import os
 import argparse
 import collections
+import json
+import multiprocessing
 import pyopentree
 import dendropy
+from multiprocessing.pool import ThreadPool
 
 __prog__ = os.path.basename(__file__)
 __version__ = "1.0.0"
@@ -43,6 +46,55 @@ _DEBUG_LOG = pprint.PrettyPrinter(
         depth=None,
         stream=None)
 
+def normalize_doi(doi):
+    """
+    Returns the DOI without resolver prefix, in lower case (DOIs are
+    case-insensitive).
+    """
+    doi = doi.strip()
+    for prefix in ("http://dx.doi.org/", "https://dx.doi.org/", "http://doi.org/", "https://doi.org/", "doi:"):
+        if doi.lower().startswith(prefix):
+            doi = doi[len(prefix):]
+            break
+    return doi.lower()
+
+class DoiIndex(object):
+    """
+    Persistent index of the DOI and citation of each study, and of the
+    studies published under each DOI, saved as JSON to `path`.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.studies = {}
+        self.study_ids_by_doi = {}
+        if path is not None and os.path.exists(path):
+            with open(path, "r") as src:
+                for study_id, (doi, citation) in json.load(src).items():
+                    self.add(study_id, doi, citation)
+
+    def __len__(self):
+        return len(self.studies)
+
+    def __contains__(self, study_id):
+        return study_id in self.studies
+
+    def add(self, study_id, doi, citation):
+        self.studies[study_id] = (doi, citation)
+        if doi is not None:
+            study_ids = self.study_ids_by_doi.setdefault(normalize_doi(doi), [])
+            if study_id not in study_ids:
+                study_ids.append(study_id)
+
+    def lookup_doi(self, doi):
+        return list(self.study_ids_by_doi.get(normalize_doi(doi), []))
+
+    def save(self):
+        if self.path is None:
+            return
+        data = json.dumps(self.studies, sort_keys=True, indent=0)
+        pyopentree.atomic_write(self.path, data.encode("utf-8"))
+
 class OpenTreeDoiSearcher(pyopentree.OpenTreeService):
 
     StudyInfo = collections.namedtuple("StudyInfo", ["study_id", "doi", "citation"])
@@ -50,71 +102,165 @@ class OpenTreeDoiSearcher(pyopentree.OpenTreeService):
     def __init__(self, *args, **kwargs):
         self.cache_path = kwargs.pop("cache_path",
                 ".opentree.cache.yaml")
+        doi_index_path = kwargs.pop("doi_index_path",
+                ".opentree-doi-index.json")
         pyopentree.OpenTreeService.__init__(self, *args, **kwargs)
+        self.doi_index = DoiIndex(doi_index_path)
 
-    def slice_from(self, slice_from, slice_limit):
+    def fetch_study_info(self, study_id):
         """
-        - slice_from: 1-based index of where to start slice; defaults to None (=first)
-        - slice_limit: number of items to get; defaults to None (=all)
+        Returns the StudyInfo of the study, from its metadata on the server.
         """
-        if slice_from is not None:
-            slice_start = slice_from - 1
-        else:
-            slice_start = None
-        if slice_limit is not None:
-            if slice_start is None:
-                slice_to = slice_limit
-            else:
-                slice_to = slice_start + slice_limit + 1
+        study_dict = self.get_study_meta(study_id)["nexml"]
+        citation = study_dict.get("^ot:studyPublicationReference", None)
+        doi_dict = study_dict.get("^ot:studyPublication", None)
+        if doi_dict is not None:
+            doi = doi_dict["@href"]
         else:
-            slice_to = None
-        slice_result = slice(slice_from, slice_to)
-        return slice_result
+            doi = None
+        return OpenTreeDoiSearcher.StudyInfo(
+                study_id=study_id,
+                doi=doi,
+                citation=citation)
+
+    def study_info(self, study_id):
+        """
+        Returns the StudyInfo of the study, from the DOI index if possible.
+        """
+        if study_id in self.doi_index:
+            doi, citation = self.doi_index.studies[study_id]
+            return OpenTreeDoiSearcher.StudyInfo(
+                    study_id=study_id,
+                    doi=doi,
+                    citation=citation)
+        s = self.fetch_study_info(study_id)
+        self.doi_index.add(s.study_id, s.doi, s.citation)
+        return s
+
+    def build_doi_index(self, max_workers=None):
+        """
+        Adds every study not yet in the DOI index to it, fetching the
+        metadata of the studies concurrently, and saves the index. Returns
+        the number of studies added.
+        """
+        study_ids = [study_dict["ot:studyId"] for study_dict in self.iter_studies_find_studies()]
+        to_fetch = [study_id for study_id in study_ids if study_id not in self.doi_index]
+        for start in range(0, len(to_fetch), 100):
+            for s in self.map_concurrently(
+                    self.fetch_study_info,
+                    to_fetch[start:start + 100],
+                    max_workers=max_workers):
+                self.doi_index.add(s.study_id, s.doi, s.citation)
+            self.doi_index.save()
+        return len(to_fetch)
 
     def yield_studies(
             self,
             list_from=None,
-            max_studies=None):
-        studies_dict = self.studies_find_studies()
-        study_list = []
-        study_slice = self.slice_from(list_from, max_studies)
-        for study_dict in studies_dict["matched_studies"][study_slice]:
-            study_id = study_dict["ot:studyId"]
-            study_dict = self.get_study_meta(study_id)["nexml"]
-            citation = study_dict.get("^ot:studyPublicationReference", None)
-            doi_dict = study_dict.get("^ot:studyPublication", None)
-            if doi_dict is not None:
-                doi = doi_dict["@href"]
+            max_studies=None,
+            window_size=32,
+            max_workers=None):
+        """
+        - list_from: 1-based index of the first study to list; defaults to None (=first)
+        - max_studies: number of studies to list; defaults to None (=all)
+        - window_size: number of upcoming studies whose metadata is prefetched
+        - max_workers: number of concurrent requests; defaults to `self.max_workers`
+        """
+        if list_from is not None:
+            start = list_from - 1
+        else:
+            start = 0
+        if max_workers is None:
+            max_workers = self.max_workers
+        study_ids = (study_dict["ot:studyId"] for study_dict in self.iter_studies_find_studies(
+                start=start,
+                limit=max_studies))
+        # The window holds, in order, the StudyInfo of the upcoming studies:
+        # those in the index directly, the others as pending fetches.
+        pool = ThreadPool(max(1, max_workers))
+        window = collections.deque()
+        is_completed = False
+        try:
+            while True:
+                while len(window) < window_size:
+                    study_id = next(study_ids, None)
+                    if study_id is None:
+                        break
+                    if study_id in self.doi_index:
+                        window.append(self.study_info(study_id))
+                    else:
+                        window.append(pool.apply_async(self.fetch_study_info, (study_id,)))
+                if not window:
+                    break
+                s = window.popleft()
+                if not isinstance(s, OpenTreeDoiSearcher.StudyInfo):
+                    s = s.get()
+                    self.doi_index.add(s.study_id, s.doi, s.citation)
+                if s.doi:
+                    yield s
+            is_completed = True
+        finally:
+            if is_completed:
+                pool.close()
             else:
-                doi = None
-            if doi is not None:
-                s = OpenTreeDoiSearcher.StudyInfo(
-                        study_id=study_id,
-                        doi=doi,
-                        citation=citation)
-                yield s
-
-    def get_trees(self, doi):
-        study_query = self.studies_find_studies(
-                property_name="ot:studyPublication",
-                property_value=doi,
-                exact=True,
-                verbose=False)
-        matched_studies = study_query["matched_studies"]
-        if not matched_studies:
+                pool.terminate()
+            pool.join()
+            self.doi_index.save()
+
+    def get_trees(self,
+            doi,
+            as_compact_trees=False,
+            max_workers=None,
+            num_processes=None):
+        """
+        Returns the trees of the study with the given DOI, as a DendroPy
+        TreeList or, if `as_compact_trees` is True, as a list of
+        pyopentree.CompactTree objects; None if there is no such study.
+
+        The trees are downloaded concurrently (up to `max_workers` at a
+        time). Compact trees are parsed one tree per task in a pool of
+        `num_processes` processes (defaults to the number of CPUs), which
+        send back the flat arrays of each tree, cheap to pickle whatever
+        the depth of the tree; DendroPy trees are parsed in this process.
+        (The "get-trees" command uses the pool with `--compact`.)
+        """
+        study_ids = self.doi_index.lookup_doi(doi)
+        if not study_ids:
+            study_query = self.studies_find_studies(
+                    property_name="ot:studyPublication",
+                    property_value=doi,
+                    exact=True,
+                    verbose=False)
+            study_ids = [study_dict["ot:studyId"] for study_dict in study_query["matched_studies"]]
+        if not study_ids:
             return None
-        study_id = matched_studies[0]["ot:studyId"]
+        study_id = study_ids[0]
         study_trees = self.get_study_meta(study_id)["nexml"]["treesById"]
         tree_ids = []
         for tree_group in study_trees.values():
             tree_ids.extend(tree_group["treeById"].keys())
-        tree_strings = []
-        for tree_id in tree_ids:
+        def fetch(tree_id):
             s = self.get_study_tree(study_id=study_id, tree_id=tree_id, schema="newick")
-            tree_strings.append(s)
-        tree_str = "\n".join(tree_strings)
-        trees = dendropy.TreeList.get_from_string(tree_str, "newick")
-        return trees
+            return s.strip()
+        tree_strings = self.map_concurrently(fetch, tree_ids, max_workers=max_workers)
+        if not as_compact_trees:
+            return dendropy.TreeList.get_from_string("\n".join(tree_strings), "newick")
+        if num_processes is None:
+            num_processes = multiprocessing.cpu_count()
+        num_processes = min(num_processes, len(tree_strings))
+        if num_processes <= 1:
+            return [pyopentree.CompactTree.from_newick(s) for s in tree_strings]
+        pool = multiprocessing.Pool(num_processes)
+        try:
+            tree_arrays = pool.map(_parse_compact_tree_arrays, tree_strings, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+        return [pyopentree.CompactTree(*arrays) for arrays in tree_arrays]
+
+def _parse_compact_tree_arrays(newick):
+    tree = pyopentree.CompactTree.from_newick(newick)
+    return tree.parents, tree.labels, tree.edge_lengths
 
 def main():
     """
@@ -138,11 +284,22 @@ def main():
             type=int,
             default=None,
             help="Maximum number of studies to list.")
+    list_studies_parser.add_argument("--max-workers",
+            type=int,
+            default=None,
+            help="Maximum number of concurrent requests.")
     list_studies_parser.add_argument("--as-table",
             action="store_true",
             default=False,
             help="Format as (tab-delimited) rows.")
 
+    # index DOIs
+    index_dois_parser = subparsers.add_parser("index-dois", help="Build (or update) the local DOI index")
+    index_dois_parser.add_argument("--max-workers",
+            type=int,
+            default=None,
+            help="Maximum number of concurrent requests.")
+
     # get trees
     get_trees_parser = subparsers.add_parser("get-trees", help="Retrieve trees")
     get_trees_parser.add_argument("doi",
@@ -150,8 +307,20 @@ def main():
     get_trees_parser.add_argument("-f", "--format",
             dest="schema",
             choices=["nexus", "newick", "nexml"],
-            default="nexml",
-            help="DOI of the study containing the trees to retrieve (default: '%(default)s').")
+            default=None,
+            help="Format of the trees (default: 'nexml', or 'newick' with --compact).")
+    get_trees_parser.add_argument("--max-workers",
+            type=int,
+            default=None,
+            help="Maximum number of concurrent requests.")
+    get_trees_parser.add_argument("--compact",
+            action="store_true",
+            default=False,
+            help="Parse the trees into compact trees, in a pool of processes, instead of with DendroPy (NEWICK output only).")
+    get_trees_parser.add_argument("--processes",
+            type=int,
+            default=None,
+            help="With --compact: number of processes parsing the trees (default: the number of CPUs).")
 
     # # A delete command
     # delete_parser = subparsers.add_parser('delete', help='Remove a directory')
@@ -162,13 +331,19 @@ def main():
     # ots = pyopentree.OpenTreeService()
 
     args = parser.parse_args()
+    if args.subparser_name == "get-trees":
+        if args.schema is None:
+            args.schema = "newick" if args.compact else "nexml"
+        elif args.compact and args.schema != "newick":
+            parser.error("--compact trees can only be written as NEWICK")
 
     ots = OpenTreeDoiSearcher()
     if args.subparser_name == "list-studies":
         out = sys.stdout
         for study in ots.yield_studies(
                 list_from=args.list_from,
-                max_studies=args.max_studies):
+                max_studies=args.max_studies,
+                max_workers=args.max_workers):
             if args.as_table:
                 out.write("{}\t{}\n".format(
                     study.doi,
@@ -177,12 +352,23 @@ def main():
                 out.write("[{}]\n{}\n\n".format(
                     study.doi,
                     study.citation))
+    elif args.subparser_name == "index-dois":
+        num_added = ots.build_doi_index(max_workers=args.max_workers)
+        sys.stderr.write("{} studies added to the DOI index ({} studies)\n".format(num_added, len(ots.doi_index)))
     elif args.subparser_name == "get-trees":
         # http://dx.doi.org/10.1111/j.1365-294X.2012.05606.x
-        trees = ots.get_trees(doi=args.doi)
+        trees = ots.get_trees(
+                doi=args.doi,
+                as_compact_trees=args.compact,
+                max_workers=args.max_workers,
+                num_processes=args.processes)
         if trees is None:
             sys.exit("No studies found with DOI: '{}'".format(args.doi))
-        print(trees.as_string(args.schema))
+        if args.compact:
+            for tree in trees:
+                print(tree.as_newick())
+        else:
+            print(trees.as_string(args.schema))
     else:
         parser.print_usage(sys.stderr)
         sys.exit(1)
@@ -3,32 +3,70 @@
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import collections
+import io
+
 import dendropy
 import pyopentree
 
 # NEXSS sugar ------------------------------------------------------------------
 
 class NEXSS(object):
+    """
+    Builds a NEXSS stylesheet together with the node annotations it selects
+    on.
+
+    Each distinct (tag, content) pair gives one rule, kept in insertion
+    order and found by hashing its selector. The declarations of the rules
+    are interned, so that identical styles are stored only once however
+    many rules use them. Annotating a node therefore costs the same
+    whatever the size of the stylesheet.
+    """
 
     def __init__(self):
         self.datatype_hint = 'xsd:string'
         self.name_prefix = 'nexss'
         self.namespace = 'http://phylotastic.org/nexss#'
-        self.styles = list()
-
-    def style_id_index(self, style_id):
-        for i, style in enumerate(self.styles):
-            if style[0] == style_id:
-                return i
-                break
-        return -1
-
-    def write_to_path(self, path):
-        with open(path, 'w') as nexss_file:
-            for style in self.styles:
-                nexss_file.write(style[1] + '\n\n')
+        # selector -> declarations
+        self.rules = collections.OrderedDict()
+        self._interned_styles = dict()
+
+    def __len__(self):
+        return len(self.rules)
+
+    def style_id(self, tag, content):
+        return 'node[' + self.name_prefix + ':' + tag + '=' + content + ']'
+
+    def intern_style(self, style):
+        """
+        Returns the shared, read-only copy of the declarations `style` (a
+        dictionary of property names and values).
+        """
+        key = frozenset(style.items())
+        interned = self._interned_styles.get(key)
+        if interned is None:
+            interned = self._interned_styles[key] = dict(style)
+        return interned
+
+    def set_style(self, tag, content, style, mode='overwrite'):
+        """
+        Sets the declarations of the rule selecting nodes annotated with
+        `tag` = `content`: with mode 'overwrite', `style` replaces the
+        existing rule (which moves to the end of the stylesheet); with mode
+        'append', its declarations are added to those of the existing rule.
+        """
+        style_id = self.style_id(tag, content)
+        if mode == 'overwrite':
+            self.rules.pop(style_id, None)
+            self.rules[style_id] = self.intern_style(style)
+        elif mode == 'append':
+            merged = dict(self.rules.get(style_id, ()))
+            merged.update(style)
+            self.rules[style_id] = self.intern_style(merged)
+        else:
+            raise ValueError("Style mode '{}' is not supported".format(mode))
 
-    def annotate_node(self, node, tag, content, style, mode='overwrite'):
+    def add_annotation(self, node, tag, content):
 
         node.annotations.drop(name=tag)
 
@@ -43,32 +81,84 @@ class NEXSS(object):
             annotate_as_reference=False,
             is_hidden=False)
 
-        style_id = 'node[' + self.name_prefix + ':' + tag + '=' + content + ']'
-
-        sid_idx = self.style_id_index(style_id)
-        if sid_idx >= 0:
-            if mode == 'overwrite':
-                self.styles.pop(sid_idx)
-            elif mode == 'append':
-                for k in style:
-                    self.styles[sid_idx][2][k] = style[k]
-                style = self.styles[sid_idx][2]
+    def annotate_node(self, node, tag, content, style, mode='overwrite'):
+        self.add_annotation(node, tag, content)
+        self.set_style(tag, content, style, mode=mode)
+
+    def annotate_nodes(self, nodes, tag, content, style, mode='overwrite'):
+        """
+        Annotates all of `nodes` with `tag`. `content` is either a string
+        shared by all the nodes (so that a single rule styles them all) or a
+        function returning the content for a node; `style` is either a
+        dictionary or a function returning the style for a content string.
+        """
+        styled = set()
+        for node in nodes:
+            if callable(content):
+                node_content = content(node)
             else:
-                raise NotImplementedError()
+                node_content = content
+            self.add_annotation(node, tag, node_content)
+            if node_content not in styled:
+                styled.add(node_content)
+                if callable(style):
+                    node_style = style(node_content)
+                else:
+                    node_style = style
+                self.set_style(tag, node_content, node_style, mode=mode)
+
+    def annotate_clade(self, node, tag, content, style, mode='overwrite'):
+        """
+        Annotates `node` and all of its descendants with `tag` = `content`,
+        styled by a single rule.
+        """
+        self.annotate_nodes(node.preorder_iter(), tag, content, style, mode=mode)
+
+    def annotate_where(self, tree, predicate, tag, content, style, mode='overwrite'):
+        """
+        Annotates the nodes of `tree` for which `predicate(node)` is true.
+        """
+        self.annotate_nodes(tree.preorder_node_iter(filter_fn=predicate), tag, content, style, mode=mode)
+
+    def annotate_by_rank(self, tree, ranks, styles, tag='rank', mode='overwrite'):
+        """
+        Annotates the nodes of `tree` whose taxon label has a rank in
+        `ranks` (a dictionary mapping taxon labels to ranks, e.g. built
+        from `pyopentree.taxonomy_taxon` results) with their rank, and
+        styles them with one rule per rank, taken from `styles` (a
+        dictionary mapping ranks to styles). Nodes whose rank has no style
+        are left alone.
+        """
+        def rank(node):
+            if node.taxon is None:
+                return None
+            return ranks.get(node.taxon.label)
+        self.annotate_where(
+                tree,
+                lambda node: rank(node) in styles,
+                tag,
+                rank,
+                lambda node_rank: styles[node_rank],
+                mode=mode)
+
+    def iter_rules(self):
+        """
+        Yields the text of each rule of the stylesheet, in order.
+        """
+        for style_id, style in self.rules.items():
+            parts = [style_id, ' {\n']
+            for k in style:
+                parts.extend(('\t', k, ': ', style[k], ';\n'))
+            parts.append('}')
+            yield ''.join(parts)
+
+    def write(self, dest):
+        for rule in self.iter_rules():
+            dest.write(rule + '\n\n')
 
-        style_str_left = style_id + ' {\n'
-        style_str_right = '}'
-        style_str = style_str_left
-
-        for k in style:
-            style_str = style_str + '\t' + k + ': ' + style[k] + ';\n'
-
-        style_str = style_str + style_str_right
-
-        if mode == 'overwrite':
-            self.styles.append([style_id, style_str, style])
-        elif mode == 'append':
-            self.styles[sid_idx][1] = style_str
+    def write_to_path(self, path):
+        with io.open(path, 'w', encoding='utf-8') as nexss_file:
+            self.write(nexss_file)
 
 # Utility functions ------------------------------------------------------------
 
@@ -82,22 +172,28 @@ def parse_opentree_taxon_label(taxon_label):
     return {'taxon_name_parts': taxon_name_parts, 'ott_id': ott_id}
 
 def parse_opentree_taxon_labels_in_dendropy_tree(tree, keep_taxon_name=True, keep_ott_id=True):
-
-    node_iterator = tree.preorder_node_iter(filter_fn=None)
-
-    for node in node_iterator:
-        if node.taxon is not None:
-            parsed_label = parse_opentree_taxon_label(taxon_label=node.taxon.label)
-
+    """
+    Relabels the taxa of `tree` that have OpenTree labels (e.g.,
+    "Homo_sapiens_ott770315"), keeping the taxon name and/or the ott id.
+    Labels without an ott id (e.g., "Homo_sapiens") are left as they are,
+    rather than split at their last underscore as if they had one.
+    """
+
+    taxa = [node.taxon for node in tree.preorder_node_iter(filter_fn=None) if node.taxon is not None]
+    names, ott_ids = pyopentree.parse_ott_labels([taxon.label for taxon in taxa])
+
+    for taxon, name, ott_id in zip(taxa, names, ott_ids):
+        if ott_id == -1:
+            continue
+        if keep_taxon_name and keep_ott_id:
+            new_label = name + '_ott' + str(ott_id)
+        elif keep_taxon_name:
+            new_label = name
+        elif keep_ott_id:
+            new_label = 'ott' + str(ott_id)
+        else:
             new_label = ''
-            if keep_taxon_name:
-                new_label = '_'.join(parsed_label['taxon_name_parts'])
-            if keep_ott_id:
-                if keep_taxon_name:
-                    new_label = new_label + '_'
-                new_label = new_label + 'ott' + parsed_label['ott_id']
-
-            node.taxon.label = new_label
+        taxon.label = new_label
 
     return tree
 
@@ -3,3 +3,13 @@
 __version__ = "0.1.0"
 
 from pyopentree.opentreeservice import *
+from pyopentree.compacttree import *
+from pyopentree.cache import *
+from pyopentree.nodeinfo import *
+from pyopentree.mirror import *
+from pyopentree.crawler import *
+from pyopentree.nexson import *
+from pyopentree.jsonstream import *
+from pyopentree.export import *
+from pyopentree.treestore import *
+from pyopentree.recording import *
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import gzip
+import hashlib
+import io
+import json
+import os
+import tempfile
+import threading
+
+__all__ = [str(name) for name in (
+        "BlobStore",
+        "SourceTreeCache",
+        "atomic_write",
+        )]
+
+class BlobStore(object):
+    """
+    A content-addressed store of compressed blobs on disk.
+
+    Each blob is stored (gzip-compressed) once under the SHA-256 digest of
+    its contents, so storing the same contents again costs nothing. Writes
+    are atomic, so a store is never left with a partially written blob.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        if not os.path.isdir(root):
+            os.makedirs(root)
+
+    def path(self, digest):
+        return os.path.join(self.root, digest[:2], digest + ".gz")
+
+    def __contains__(self, digest):
+        return os.path.exists(self.path(digest))
+
+    def put(self, data):
+        """
+        Store the bytes `data`, and return their digest.
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.path(digest)
+        if os.path.exists(path):
+            return digest
+        dirname = os.path.dirname(path)
+        if not os.path.isdir(dirname):
+            try:
+                os.makedirs(dirname)
+            except OSError:
+                if not os.path.isdir(dirname):
+                    raise
+        compressed = io.BytesIO()
+        with gzip.GzipFile(fileobj=compressed, mode="wb", mtime=0) as dest:
+            dest.write(data)
+        atomic_write(path, compressed.getvalue())
+        return digest
+
+    def get(self, digest):
+        """
+        Return the bytes stored under `digest`, or `None` if there are none.
+        """
+        try:
+            with gzip.open(self.path(digest), "rb") as src:
+                return src.read()
+        except IOError:
+            return None
+
+    def size(self, digest):
+        """
+        Return the size on disk (compressed) of the blob stored under `digest`.
+        """
+        return os.path.getsize(self.path(digest))
+
+class SourceTreeCache(object):
+    """
+    A permanent cache of the results of `gol_source_tree`.
+
+    A source tree pinned to a git SHA can never change, so entries never
+    expire. Entries are keyed by study id, tree id, git SHA and schema; their
+    contents are kept in a :class:`BlobStore`, so identical trees are stored
+    only once however many keys refer to them. The keys are kept in an
+    append-only index file, "source_trees.jsonl", under `root`.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.blobs = BlobStore(os.path.join(root, "blobs"))
+        self.index_path = os.path.join(root, "source_trees.jsonl")
+        self.digests = {}
+        self._lock = threading.Lock()
+        if os.path.exists(self.index_path):
+            with io.open(self.index_path, "r", encoding="utf-8") as src:
+                for line in src:
+                    if not line.strip():
+                        continue
+                    entry = json.loads(line)
+                    key = SourceTreeCache.key(
+                            entry["study_id"],
+                            entry["tree_id"],
+                            entry["git_sha"],
+                            entry["schema"])
+                    self.digests[key] = entry["digest"]
+
+    @staticmethod
+    def key(study_id, tree_id, git_sha, schema=None):
+        return (study_id, tree_id, git_sha, schema)
+
+    def __len__(self):
+        return len(self.digests)
+
+    def __contains__(self, key):
+        return key in self.digests
+
+    def get(self, study_id, tree_id, git_sha, schema=None):
+        """
+        Return the cached result for the given source tree, or `None` if it
+        has not been cached.
+        """
+        digest = self.digests.get(SourceTreeCache.key(study_id, tree_id, git_sha, schema), None)
+        if digest is None:
+            return None
+        data = self.blobs.get(digest)
+        if data is None:
+            return None
+        return json.loads(data.decode("utf-8"))
+
+    def put(self, study_id, tree_id, git_sha, schema, result):
+        """
+        Store `result`, the parsed result of `gol_source_tree`, for the given
+        source tree.
+        """
+        data = json.dumps(result, sort_keys=True).encode("utf-8")
+        digest = self.blobs.put(data)
+        key = SourceTreeCache.key(study_id, tree_id, git_sha, schema)
+        entry = json.dumps({
+            "study_id": study_id,
+            "tree_id": tree_id,
+            "git_sha": git_sha,
+            "schema": schema,
+            "digest": digest,
+            })
+        with self._lock:
+            if self.digests.get(key, None) == digest:
+                return
+            with io.open(self.index_path, "a", encoding="utf-8") as dest:
+                dest.write(entry + "\n")
+            self.digests[key] = digest
+
+def atomic_write(path, data):
+    """
+    Write the bytes `data` to `path` so that readers see either the old file
+    or the complete new one, never a partial write.
+    """
+    handle, temp_path = tempfile.mkstemp(
+            dir=os.path.dirname(path) or ".",
+            prefix=".tmp-")
+    try:
+        with os.fdopen(handle, "wb") as dest:
+            dest.write(data)
+        if hasattr(os, "replace"):
+            os.replace(temp_path, path)
+        else:
+            os.rename(temp_path, path)
+    except:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
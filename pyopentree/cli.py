@@ -0,0 +1,502 @@
+# -*- coding: utf-8 -*-
+
+"""
+Command-line access to the Open Tree of Life services.
+
+Every service is available as a subcommand. Subcommands that take ids,
+names or other items read them from the command line, from files given
+with `--input` ("-" for standard input), one per line, and apply the
+service to each (concurrently, with up to `--workers` requests in flight).
+Results are written to standard output as JSON lines, in input order: one
+object per item, with the item as "input" and either the "result" or the
+"error". Commands that search or list stream one object per record.
+"""
+
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import argparse
+import io
+import itertools
+import json
+import os
+import re
+import sys
+
+if sys.hexversion < 0x03000000:
+    from urllib2 import HTTPError
+else:
+    from urllib.error import HTTPError
+
+try:
+    from pyopentree.opentreeservice import OpenTreeService
+    from pyopentree.opentreeservice import IdIndex
+    from pyopentree.crawler import CorpusSync
+    from pyopentree.crawler import StudyCrawler
+except ImportError:
+    from opentreeservice import OpenTreeService
+    from opentreeservice import IdIndex
+    from crawler import CorpusSync
+    from crawler import StudyCrawler
+
+# errors reported per item rather than ending the command
+ITEM_ERRORS = (OpenTreeService.OpenTreeError, HTTPError, IOError, KeyError, ValueError)
+
+def text_stream(stream, mode):
+    """
+    Return the standard stream `stream` for reading or writing text: under
+    Python 2, it is reopened to decode or encode UTF-8, unless it has been
+    replaced by an object without a file descriptor.
+    """
+    if sys.hexversion < 0x03000000:
+        try:
+            return io.open(stream.fileno(), mode, encoding="utf-8", closefd=False)
+        except (AttributeError, io.UnsupportedOperation):
+            pass
+    return stream
+
+def read_items(args):
+    """
+    Yield the items given on the command line, then those in the input
+    files, skipping blank lines.
+    """
+    for item in args.items:
+        yield item
+    for path in args.input or ():
+        if path == "-":
+            for line in text_stream(sys.stdin, "r"):
+                if line.strip():
+                    yield line.strip()
+        else:
+            with io.open(path, "r", encoding="utf-8") as src:
+                for line in src:
+                    if line.strip():
+                        yield line.strip()
+
+def split_item(item):
+    return [field for field in re.split(r"[\s,]+", item) if field]
+
+def parse_ids(item):
+    return [int(field) for field in split_item(item)]
+
+def positive_int(text):
+    value = int(text)
+    if value < 1:
+        raise argparse.ArgumentTypeError("must be at least 1: '{}'".format(text))
+    return value
+
+def map_items(service, args, fn):
+    """
+    Yield a record for each item of the input: `fn(item)` is evaluated for
+    a window of items at a time, concurrently.
+    """
+    items = read_items(args)
+    window_size = 64 * args.workers
+    def apply_fn(item):
+        try:
+            return {"input": item, "result": fn(item)}
+        except ITEM_ERRORS as e:
+            return {"input": item, "error": "{}".format(e)}
+    while True:
+        window = list(itertools.islice(items, window_size))
+        if not window:
+            break
+        for record in service.map_concurrently(apply_fn, window, max_workers=args.workers):
+            yield record
+
+def all_items(args):
+    return [field for item in read_items(args) for field in split_item(item)]
+
+###############################################################################
+# Subcommands: each returns an iterable of the records to write.
+
+def tol_about(service, args):
+    return [service.tol_about(study_list=args.study_list)]
+
+def tol_mrca(service, args):
+    # one set of ott ids per item
+    items = read_items(args)
+    window_size = 64 * args.workers
+    while True:
+        window = list(itertools.islice(items, window_size))
+        if not window:
+            break
+        id_sets = []
+        for item in window:
+            try:
+                id_sets.append(parse_ids(item))
+            except ValueError:
+                id_sets.append(None)
+        valid_id_sets = [id_set for id_set in id_sets if id_set]
+        try:
+            valid_results = iter(service.tol_mrca_many(valid_id_sets, max_workers=args.workers))
+        except ITEM_ERRORS as e:
+            valid_results = itertools.repeat({"error": "{}".format(e)})
+        for item, id_set in zip(window, id_sets):
+            if id_set is None:
+                yield {"input": item, "error": "Not a set of integer ids"}
+                continue
+            if not id_set:
+                yield {"input": item, "error": "No ids"}
+                continue
+            result = next(valid_results)
+            if "error" in result:
+                yield {"input": item, "error": result["error"]}
+            else:
+                yield {"input": item, "result": result}
+
+def tol_subtree(service, args):
+    return map_items(service, args, lambda item: service.tol_subtree(ott_id=int(item)))
+
+def tol_induced_subtree(service, args):
+    return [service.tol_induced_subtree(ott_ids=[int(ott_id) for ott_id in all_items(args)])]
+
+def gol_about(service, args):
+    return [service.gol_about()]
+
+def gol_source_tree(service, args):
+    def fetch(item):
+        study_id, tree_id, git_sha = split_item(item)
+        return service.gol_source_tree(study_id=study_id, tree_id=tree_id, git_sha=git_sha, schema=args.schema)
+    return map_items(service, args, fetch)
+
+def gol_node_info(service, args):
+    if args.node_ids:
+        fn = lambda item: service.gol_node_info(node_id=int(item), include_lineage=args.include_lineage)
+    else:
+        fn = lambda item: service.gol_node_info(ott_id=int(item), include_lineage=args.include_lineage)
+    return map_items(service, args, fn)
+
+def ott_ids_to_node_ids(service, args):
+    return _convert_ids(service, args, service.ott_ids_to_node_ids)
+
+def node_ids_to_ott_ids(service, args):
+    return _convert_ids(service, args, service.node_ids_to_ott_ids)
+
+def _convert_ids(service, args, convert):
+    items = read_items(args)
+    window_size = 64 * args.workers
+    while True:
+        window = list(itertools.islice(items, window_size))
+        if not window:
+            break
+        ids = []
+        for item in window:
+            try:
+                ids.append(int(item))
+            except ValueError:
+                ids.append(None)
+        converted = convert([i for i in ids if i is not None], max_workers=args.workers)
+        for item, i in zip(window, ids):
+            if i is None:
+                yield {"input": item, "error": "Not an integer id"}
+            else:
+                yield {"input": item, "result": converted.get(i, None)}
+
+def tnrs_match_names(service, args):
+    # names are matched in batches, one request per batch
+    items = read_items(args)
+    def match(names):
+        try:
+            return service.tnrs_match_names(
+                    names=names,
+                    context_name=args.context_name,
+                    do_approximate_matching=not args.exact)
+        except ITEM_ERRORS as e:
+            return {"error": "{}".format(e)}
+    while True:
+        batches = []
+        for _ in range(args.workers):
+            batch = list(itertools.islice(items, args.batch_size))
+            if not batch:
+                break
+            batches.append(batch)
+        if not batches:
+            break
+        for names, response in zip(batches, service.map_concurrently(match, batches, max_workers=args.workers)):
+            if "error" in response:
+                for name in names:
+                    yield {"input": name, "error": response["error"]}
+                continue
+            results = dict((result["id"], result) for result in response.get("results", []))
+            for name in names:
+                result = results.get(name, None)
+                if result is None:
+                    yield {"input": name, "result": {"id": name, "matches": []}}
+                else:
+                    yield {"input": name, "result": result}
+
+def tnrs_contexts(service, args):
+    return [service.tnrs_contexts()]
+
+def tnrs_infer_context(service, args):
+    return [service.tnrs_infer_context(names=list(read_items(args)))]
+
+def taxonomy_about(service, args):
+    return [service.taxonomy_about()]
+
+def taxonomy_lica(service, args):
+    return [service.taxonomy_lica(
+        ott_ids=[int(ott_id) for ott_id in all_items(args)],
+        include_lineage=args.include_lineage)]
+
+def taxonomy_subtree(service, args):
+    return map_items(service, args, lambda item: service.taxonomy_subtree(ott_id=int(item)))
+
+def taxonomy_taxon(service, args):
+    return map_items(service, args, lambda item: service.taxonomy_taxon(ott_id=int(item), include_lineage=args.include_lineage))
+
+def studies_find_studies(service, args):
+    return service.iter_studies_find_studies(
+            property_name=args.property,
+            property_value=args.value,
+            exact=args.exact,
+            verbose=args.verbose,
+            fields=args.fields,
+            start=args.start,
+            limit=args.limit)
+
+def studies_find_trees(service, args):
+    return service.iter_studies_find_trees(
+            property_name=args.property,
+            property_value=args.value,
+            exact=args.exact,
+            verbose=args.verbose,
+            fields=args.fields,
+            start=args.start,
+            limit=args.limit)
+
+def studies_properties(service, args):
+    return [service.studies_properties()]
+
+def get_study(service, args):
+    return map_items(service, args, lambda item: service.get_study(item))
+
+def get_study_meta(service, args):
+    return map_items(service, args, lambda item: service.get_study_meta(item))
+
+def get_study_otu(service, args):
+    def fetch(item):
+        study_id, otu_id = split_item(item)
+        return service.get_study_otu(study_id, otu_id)
+    return map_items(service, args, fetch)
+
+def get_study_otus(service, args):
+    return map_items(service, args, lambda item: service.get_study_otus(item))
+
+def get_study_otumap(service, args):
+    return map_items(service, args, lambda item: service.get_study_otumap(item))
+
+def get_study_tree(service, args):
+    def fetch(item):
+        fields = split_item(item)
+        if len(fields) == 3:
+            return service.get_study_subtree(*fields, schema=args.schema)
+        study_id, tree_id = fields
+        return service.get_study_tree(study_id, tree_id, schema=args.schema)
+    return map_items(service, args, fetch)
+
+def crawl(service, args):
+    study_ids = all_items(args) or None
+    crawler = StudyCrawler(service, args.root, max_workers=args.workers)
+    return [crawler.crawl(study_ids=study_ids, resume=not args.restart)]
+
+def sync(service, args):
+    return [CorpusSync(service, args.root, max_workers=args.workers).sync()]
+
+###############################################################################
+# Command-line parsing
+
+def _add_items_arguments(parser, help):
+    parser.add_argument("items",
+            nargs="*",
+            metavar="ITEM",
+            help=help)
+    parser.add_argument("-i", "--input",
+            action="append",
+            metavar="FILE",
+            help="Read items from FILE, one per line ('-' for standard input). May be repeated.")
+
+def _add_search_arguments(parser, property_required):
+    parser.add_argument("--property",
+            required=property_required,
+            help="Property to search on.")
+    parser.add_argument("--value",
+            required=property_required,
+            help="Value to search for.")
+    parser.add_argument("--exact",
+            action="store_true",
+            default=False,
+            help="Exact matching only.")
+    parser.add_argument("--verbose",
+            action="store_true",
+            default=False,
+            help="Include all metadata.")
+    parser.add_argument("--fields",
+            nargs="+",
+            default=None,
+            help="Only retain these properties of each record.")
+    parser.add_argument("--start",
+            type=int,
+            default=0,
+            help="Skip this many records (default: %(default)s).")
+    parser.add_argument("--limit",
+            type=int,
+            default=None,
+            help="Maximum number of records (default: all).")
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+            prog="pyopentree",
+            description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url",
+            default=None,
+            help="Base URL of the services (default: the public API).")
+    parser.add_argument("-w", "--workers",
+            type=positive_int,
+            default=OpenTreeService.DEFAULT_MAX_WORKERS,
+            help="Maximum number of concurrent requests (default: %(default)s).")
+    parser.add_argument("--study-cache",
+            metavar="DIR",
+            default=None,
+            help="Keep downloaded studies in DIR, and render study trees locally from them.")
+    parser.add_argument("--source-tree-cache",
+            metavar="DIR",
+            default=None,
+            help="Keep source trees in DIR.")
+    parser.add_argument("--study-mirror",
+            metavar="FILE",
+            default=None,
+            help="Search studies and trees in the local mirror database FILE (which must have been synced; see --sync-study-mirror).")
+    parser.add_argument("--sync-study-mirror",
+            action="store_true",
+            default=False,
+            help="With --study-mirror: bring the mirror up to date with the server first (creating it if needed).")
+    parser.add_argument("--mirror-otus",
+            action="store_true",
+            default=False,
+            help="With --sync-study-mirror: also index the taxa in each tree, which requires downloading complete studies.")
+    parser.add_argument("--recordings",
+            metavar="DIR",
+            default=None,
+            help="Record responses to, or replay them from, the recording store DIR (see --recording-mode).")
+    parser.add_argument("--recording-mode",
+            choices=("replay", "record", "auto"),
+            default="auto",
+            help="With --recordings: serve recorded responses only ('replay'), record every response ('record'), or replay recorded responses and record the others ('auto', the default).")
+    parser.add_argument("--id-index",
+            metavar="FILE",
+            default=None,
+            help="Load the node id/ott id index from FILE (if it exists), and save it back on completion.")
+    subparsers = parser.add_subparsers(dest="command", metavar="COMMAND")
+
+    def add(name, handler, help, items_help=None):
+        subparser = subparsers.add_parser(name, help=help, description=help)
+        subparser.set_defaults(handler=handler)
+        if items_help is not None:
+            _add_items_arguments(subparser, items_help)
+        return subparser
+
+    subparser = add("tol-about", tol_about, "Information about the draft tree.")
+    subparser.add_argument("--study-list", action="store_true", default=False, help="Include the list of source studies.")
+    add("tol-mrca", tol_mrca, "MRCA in the draft tree of each set of ott ids.", "A set of ott ids, separated by spaces or commas.")
+    add("tol-subtree", tol_subtree, "Subtree of the draft tree below each ott id.", "An ott id.")
+    add("tol-induced-subtree", tol_induced_subtree, "Induced subtree of the draft tree on all the ott ids.", "Ott ids.")
+    add("gol-about", gol_about, "Information about the graph of life.")
+    subparser = add("gol-source-tree", gol_source_tree, "Source trees.", "A study id, tree id and git SHA.")
+    subparser.add_argument("--schema", default=None, help="Format of the trees.")
+    subparser = add("gol-node-info", gol_node_info, "Information about graph nodes.", "An ott id (or node id, with --node-ids).")
+    subparser.add_argument("--node-ids", action="store_true", default=False, help="Items are node ids rather than ott ids.")
+    subparser.add_argument("--include-lineage", action="store_true", default=False, help="Include the lineage of each node.")
+    add("ott-ids-to-node-ids", ott_ids_to_node_ids, "Node ids of ott ids.", "An ott id.")
+    add("node-ids-to-ott-ids", node_ids_to_ott_ids, "Ott ids of node ids.", "A node id.")
+    subparser = add("tnrs-match-names", tnrs_match_names, "Match taxonomic names to OTT.", "A taxonomic name.")
+    subparser.add_argument("--context-name", default=None, help="Taxonomic context to match names in.")
+    subparser.add_argument("--exact", action="store_true", default=False, help="No approximate matching.")
+    subparser.add_argument("--batch-size", type=positive_int, default=250, help="Number of names per request (default: %(default)s).")
+    add("tnrs-contexts", tnrs_contexts, "Taxonomic contexts available for name matching.")
+    add("tnrs-infer-context", tnrs_infer_context, "Taxonomic context of all the names.", "A taxonomic name.")
+    add("taxonomy-about", taxonomy_about, "Information about the taxonomy.")
+    subparser = add("taxonomy-lica", taxonomy_lica, "Least inclusive common ancestor of all the ott ids.", "Ott ids.")
+    subparser.add_argument("--include-lineage", action="store_true", default=False, help="Include the lineage of the LICA.")
+    add("taxonomy-subtree", taxonomy_subtree, "Taxonomy below each ott id.", "An ott id.")
+    subparser = add("taxonomy-taxon", taxonomy_taxon, "Information about each taxon.", "An ott id.")
+    subparser.add_argument("--include-lineage", action="store_true", default=False, help="Include the lineage of each taxon.")
+    _add_search_arguments(add("studies-find-studies", studies_find_studies, "Search for studies (all studies, without --property)."), False)
+    _add_search_arguments(add("studies-find-trees", studies_find_trees, "Search for trees."), True)
+    add("studies-properties", studies_properties, "Searchable study and tree properties.")
+    add("get-study", get_study, "NexSON of each study.", "A study id.")
+    add("get-study-meta", get_study_meta, "Metadata of each study.", "A study id.")
+    add("get-study-otu", get_study_otu, "OTUs of studies.", "A study id and OTU id.")
+    add("get-study-otus", get_study_otus, "OTUs of each study.", "A study id.")
+    add("get-study-otumap", get_study_otumap, "OTU map of each study.", "A study id.")
+    subparser = add("get-study-tree", get_study_tree, "Trees (or subtrees) of studies.", "A study id and tree id, and optionally a subtree (node) id.")
+    subparser.add_argument("--schema",
+            default="nexson",
+            choices=sorted(OpenTreeService.TREE_SCHEMA_EXTENSION_MAP),
+            help="Format of the trees (default: %(default)s).")
+    subparser = add("crawl", crawl, "Download studies into a local store (all studies, without ids), and print a report.", "A study id.")
+    subparser.add_argument("--root",
+            required=True,
+            metavar="DIR",
+            help="Directory of the study store and of the journal of the crawl.")
+    subparser.add_argument("--restart",
+            action="store_true",
+            default=False,
+            help="Do not resume an interrupted crawl, but fetch (or revalidate) every study again.")
+    subparser = add("sync", sync, "Bring a local copy of the source studies and source trees of the draft tree up to date, and print a report.")
+    subparser.add_argument("--root",
+            required=True,
+            metavar="DIR",
+            help="Directory of the local copy (source trees are kept in DIR/source_trees, unless --source-tree-cache is given).")
+    return parser
+
+def main(argv=None, service=None):
+    """
+    Main CLI handler. `service` replaces the :class:`OpenTreeService` that
+    is otherwise created from the command-line options.
+    """
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if getattr(args, "handler", None) is None:
+        parser.print_usage(sys.stderr)
+        return 1
+    if service is None:
+        service = OpenTreeService(base_url=args.base_url, max_workers=args.workers)
+    if args.id_index is not None and os.path.exists(args.id_index):
+        service.id_index = IdIndex.load(args.id_index)
+    if args.study_cache is not None:
+        service.use_study_cache(args.study_cache)
+    if args.source_tree_cache is not None:
+        service.use_source_tree_cache(args.source_tree_cache)
+    if args.recordings is not None:
+        service.use_recording_store(args.recordings, mode=args.recording_mode)
+    out = text_stream(sys.stdout, "w")
+    num_errors = 0
+    try:
+        if args.study_mirror is not None:
+            mirror = service.use_study_mirror(args.study_mirror)
+            if args.sync_study_mirror:
+                mirror.sync(service, include_otus=args.mirror_otus, max_workers=args.workers)
+            elif mirror.last_synced is None:
+                parser.error("the study mirror '{}' has never been synced (use --sync-study-mirror)".format(args.study_mirror))
+        for record in args.handler(service, args):
+            if "error" in record and "input" in record:
+                num_errors += 1
+            out.write(json.dumps(record, sort_keys=True) + "\n")
+    except ITEM_ERRORS as e:
+        # a failure of the command as a whole, rather than of one item
+        sys.stderr.write("pyopentree: error: {}\n".format(e))
+        return 1
+    finally:
+        out.flush()
+        if args.id_index is not None:
+            service.id_index.save(args.id_index)
+    if num_errors:
+        sys.stderr.write("pyopentree: {} item(s) failed\n".format(num_errors))
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
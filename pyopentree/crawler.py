@@ -0,0 +1,348 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import gzip
+import io
+import json
+import os
+import struct
+import sys
+import threading
+
+if sys.hexversion < 0x03000000:
+    from urllib2 import HTTPError
+else:
+    from urllib.error import HTTPError
+
+try:
+    from pyopentree.cache import atomic_write
+except ImportError:
+    from cache import atomic_write
+
+__all__ = [str(name) for name in (
+        "StudyStore",
+        "CrawlJournal",
+        "StudyCrawler",
+        "CorpusSync",
+        )]
+
+class StudyStore(object):
+    """
+    A directory of NexSON studies, one gzip-compressed JSON file per study,
+    as downloaded by :class:`StudyCrawler`.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        if not os.path.isdir(root):
+            os.makedirs(root)
+
+    def path(self, study_id):
+        return os.path.join(self.root, "{}.json.gz".format(study_id))
+
+    def __contains__(self, study_id):
+        return os.path.exists(self.path(study_id))
+
+    def study_ids(self):
+        return sorted(name[:-len(".json.gz")] for name in os.listdir(self.root) if name.endswith(".json.gz"))
+
+    def size(self, study_id):
+        """
+        Return the size on disk (compressed) of the stored study.
+        """
+        return os.path.getsize(self.path(study_id))
+
+    def uncompressed_size(self, study_id):
+        """
+        Return the size of the raw NexSON of the stored study (as recorded in
+        the gzip trailer, so without decompressing it).
+        """
+        with open(self.path(study_id), "rb") as src:
+            src.seek(-4, os.SEEK_END)
+            return struct.unpack("<I", src.read(4))[0]
+
+    def get_bytes(self, study_id):
+        """
+        Return the raw (uncompressed) NexSON of the study, or `None` if it is
+        not in the store.
+        """
+        try:
+            with gzip.open(self.path(study_id), "rb") as src:
+                return src.read()
+        except IOError:
+            return None
+
+    def get(self, study_id):
+        """
+        Return the parsed NexSON of the study, or `None` if it is not in the
+        store.
+        """
+        data = self.get_bytes(study_id)
+        if data is None:
+            return None
+        return json.loads(data.decode("utf-8"))
+
+    def put(self, study_id, data):
+        """
+        Store `data`, the raw NexSON of the study.
+        """
+        compressed = io.BytesIO()
+        with gzip.GzipFile(fileobj=compressed, mode="wb", mtime=0) as dest:
+            dest.write(data)
+        atomic_write(self.path(study_id), compressed.getvalue())
+
+    def remove(self, study_id):
+        if study_id in self:
+            os.remove(self.path(study_id))
+
+class CrawlJournal(object):
+    """
+    An append-only log of the progress of a crawl, used to resume an
+    interrupted crawl and to remember the validators (ETag and Last-Modified
+    headers) of each stored study for conditional requests.
+
+    Each line is a JSON object with an "event" field: "start" and "finish"
+    bracket a crawl, and "fetched", "not_modified" and "failed" record the
+    outcome for a study.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.validators = {}
+        self.completed = set()
+        self.is_crawl_in_progress = False
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with io.open(path, "r", encoding="utf-8") as src:
+                for line in src:
+                    if line.strip():
+                        self._replay(json.loads(line))
+
+    def _replay(self, entry):
+        event = entry["event"]
+        if event == "start":
+            self.is_crawl_in_progress = True
+            self.completed = set()
+        elif event == "finish":
+            self.is_crawl_in_progress = False
+            self.completed = set()
+        elif event in ("fetched", "not_modified", "validators"):
+            self.validators[entry["study_id"]] = (entry.get("etag", None), entry.get("last_modified", None))
+            if event != "validators":
+                self.completed.add(entry["study_id"])
+        elif event == "failed":
+            self.completed.discard(entry["study_id"])
+
+    def record(self, event, **kwargs):
+        entry = dict(kwargs)
+        entry["event"] = event
+        line = json.dumps(entry, sort_keys=True)
+        with self._lock:
+            self._replay(entry)
+            with io.open(self.path, "a", encoding="utf-8") as dest:
+                dest.write(line + "\n")
+
+    def start(self):
+        """
+        Begin a new crawl, first compacting the journal down to the
+        validators of the stored studies.
+        """
+        with self._lock:
+            lines = [json.dumps({"event": "validators", "study_id": study_id, "etag": etag, "last_modified": last_modified}, sort_keys=True)
+                    for study_id, (etag, last_modified) in sorted(self.validators.items())]
+            atomic_write(self.path, "".join(line + "\n" for line in lines).encode("utf-8"))
+        self.record("start")
+
+    def finish(self):
+        self.record("finish")
+
+class StudyCrawler(object):
+    """
+    Downloads the NexSON of every study (or a given list of studies) into a
+    :class:`StudyStore`, using a bounded pool of concurrent requests.
+
+    Progress is recorded in a :class:`CrawlJournal` (in "journal.jsonl" under
+    `root`), so that an interrupted crawl resumes where it left off. Studies
+    already in the store are requested conditionally, so those that have not
+    changed since they were stored cost only a "304 Not Modified" response.
+    """
+
+    def __init__(self, service, root, max_workers=None):
+        self.service = service
+        self.store = StudyStore(os.path.join(root, "studies"))
+        self.journal = CrawlJournal(os.path.join(root, "journal.jsonl"))
+        self.max_workers = max_workers
+
+    def list_study_ids(self):
+        return [study["ot:studyId"] for study in self.service.studies_find_studies()["matched_studies"]]
+
+    def fetch_study(self, study_id):
+        """
+        Fetch (or revalidate) a single study, and return one of "fetched",
+        "not_modified" or "failed", and the number of bytes downloaded.
+        """
+        if study_id in self.store:
+            etag, last_modified = self.journal.validators.get(study_id, (None, None))
+        else:
+            etag, last_modified = None, None
+        try:
+            data, etag, last_modified = self.service.request_conditionally(
+                    '/study/{STUDY_ID}'.format(STUDY_ID=study_id),
+                    etag=etag,
+                    last_modified=last_modified)
+        except (HTTPError, IOError) as e:
+            self.journal.record("failed", study_id=study_id, error=str(e))
+            return "failed", 0
+        if data is None:
+            self.journal.record("not_modified", study_id=study_id, etag=etag, last_modified=last_modified)
+            return "not_modified", 0
+        self.store.put(study_id, data)
+        self.journal.record("fetched", study_id=study_id, etag=etag, last_modified=last_modified, size=len(data))
+        return "fetched", len(data)
+
+    def crawl(self, study_ids=None, resume=True):
+        """
+        Fetch the given studies (by default, all studies listed by
+        `studies_find_studies`). If `resume` is `True` and the previous crawl
+        was interrupted, the studies it completed are skipped.
+
+        Returns
+        -------
+        d : dict
+            A python dictionary with the following fields:
+
+                "fetched"
+                "not_modified"
+                "failed"
+                "skipped"
+                "bytes_downloaded"
+                "outcomes"
+
+            where "outcomes" maps the id of each study requested to
+            "fetched", "not_modified" or "failed".
+        """
+        if study_ids is None:
+            study_ids = self.list_study_ids()
+        if resume and self.journal.is_crawl_in_progress:
+            completed = set(self.journal.completed)
+        else:
+            completed = set()
+            self.journal.start()
+        to_fetch = [study_id for study_id in study_ids if study_id not in completed]
+        outcomes = self.service.map_concurrently(
+                self.fetch_study,
+                to_fetch,
+                max_workers=self.max_workers)
+        report = {
+                "fetched": 0,
+                "not_modified": 0,
+                "failed": 0,
+                "skipped": len(study_ids) - len(to_fetch),
+                "bytes_downloaded": 0,
+                "outcomes": dict((study_id, outcome) for study_id, (outcome, num_bytes) in zip(to_fetch, outcomes)),
+                }
+        for outcome, num_bytes in outcomes:
+            report[outcome] += 1
+            report["bytes_downloaded"] += num_bytes
+        if report["failed"] == 0:
+            self.journal.finish()
+        return report
+
+class CorpusSync(object):
+    """
+    Keeps a local copy of the source studies and source trees of the
+    current draft tree up to date.
+
+    The study list of `tol_about` (the source trees, each with the git SHA
+    of its study) is stored under `root` after each sync, and compared with
+    the current one at the next: only the studies that were added or whose
+    source trees changed are refetched (into a :class:`StudyCrawler` store
+    under `root`, conditionally), together with those of their source trees
+    that are not yet in the source tree cache of the service (one is set up
+    under `root` if the service has none). Studies that are no longer
+    sources are removed from the study store.
+    """
+
+    def __init__(self, service, root, max_workers=None):
+        self.service = service
+        self.root = root
+        self.crawler = StudyCrawler(service, root, max_workers=max_workers)
+        self.max_workers = max_workers
+        self.study_list_path = os.path.join(root, "study_list.json")
+        if service.source_tree_cache is None:
+            service.use_source_tree_cache(os.path.join(root, "source_trees"))
+
+    def stored_study_list(self):
+        """
+        Return the study list saved by the last successful sync (empty if
+        there has been none).
+        """
+        if not os.path.exists(self.study_list_path):
+            return []
+        with io.open(self.study_list_path, "r", encoding="utf-8") as src:
+            return json.load(src)
+
+    def sync(self, study_list=None):
+        """
+        Bring the local copy up to date with `study_list` (by default, the
+        study list of the current draft tree, from `tol_about`).
+
+        Returns
+        -------
+        d : dict
+            A python dictionary with the following fields:
+
+                "added"
+                "changed"
+                "removed"
+                "unchanged"
+                "studies_fetched"
+                "studies_not_modified"
+                "source_trees_fetched"
+                "failed"
+                "bytes_downloaded"
+                "bytes_saved"
+        """
+        if study_list is None:
+            study_list = self.service.tol_about(study_list=True)["study_list"]
+        previous = _source_trees_by_study(self.stored_study_list())
+        current = _source_trees_by_study(study_list)
+        added = sorted(study_id for study_id in current if study_id not in previous)
+        changed = sorted(study_id for study_id in current if study_id in previous and current[study_id] != previous[study_id])
+        removed = sorted(study_id for study_id in previous if study_id not in current)
+        unchanged = [study_id for study_id in current if study_id in previous and current[study_id] == previous[study_id]]
+        to_fetch = added + changed
+        crawl_report = self.crawler.crawl(study_ids=to_fetch, resume=False)
+        to_fetch = set(to_fetch)
+        source_tree_report = self.service.prefetch_source_trees(
+                study_list=[source for source in study_list if source["study_id"] in to_fetch],
+                max_workers=self.max_workers)
+        for study_id in removed:
+            self.crawler.store.remove(study_id)
+        # the studies known to be unchanged, and those the server reported as
+        # not modified, did not have to be downloaded again
+        not_downloaded = [study_id for study_id in unchanged if study_id in self.crawler.store]
+        not_downloaded.extend(study_id for study_id, outcome in crawl_report["outcomes"].items() if outcome == "not_modified")
+        report = {
+                "added": len(added),
+                "changed": len(changed),
+                "removed": len(removed),
+                "unchanged": len(unchanged),
+                "studies_fetched": crawl_report["fetched"],
+                "studies_not_modified": crawl_report["not_modified"],
+                "source_trees_fetched": source_tree_report["num_fetched"],
+                "failed": crawl_report["failed"] + len(source_tree_report["failed"]),
+                "bytes_downloaded": crawl_report["bytes_downloaded"],
+                "bytes_saved": sum(self.crawler.store.uncompressed_size(study_id) for study_id in not_downloaded),
+                }
+        if report["failed"] == 0:
+            atomic_write(self.study_list_path, json.dumps(study_list, sort_keys=True).encode("utf-8"))
+        return report
+
+def _source_trees_by_study(study_list):
+    trees = {}
+    for source in study_list:
+        trees.setdefault(source["study_id"], set()).add((source["tree_id"], source.get("git_sha", None)))
+    return trees
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import gzip
+import io
+import itertools
+import json
+import sys
+import time
+import zlib
+
+if sys.hexversion < 0x03000000:
+    from urllib2 import HTTPError
+else:
+    from urllib.error import HTTPError
+
+try:
+    from pyopentree.compacttree import quote_newick_label
+except ImportError:
+    from compacttree import quote_newick_label
+
+__all__ = [str(name) for name in (
+        "TreeExporter",
+        "load_export_index",
+        "read_exported_tree",
+        )]
+
+class TreeExporter(object):
+    """
+    Exports many trees of the phylesystem into a single compressed file.
+
+    The trees are fetched concurrently (with `get_study_tree`, so the study
+    cache of the service is used, if any) a window at a time, and written
+    in order, one tree per line (NEWICK) or one TREE statement per line in a
+    single TREES block (NEXUS). Each tree is compressed as a separate gzip
+    member, so the file as a whole is an ordinary gzip file while any single
+    tree can be read back without decompressing the others: the offset and
+    length of the member holding each tree are written to a sidecar index,
+    one JSON object per line, at the path of the file plus ".index.jsonl".
+    """
+
+    SCHEMAS = ("newick", "nexus")
+    INDEX_SUFFIX = ".index.jsonl"
+
+    def __init__(self, service, max_workers=None, window_size=None):
+        self.service = service
+        self.max_workers = max_workers
+        if window_size is None:
+            window_size = 4 * (max_workers or service.max_workers)
+        self.window_size = window_size
+
+    def export_query(self,
+            path,
+            property_name,
+            property_value,
+            exact=False,
+            schema="newick"):
+        """
+        Export every tree matched by `studies_find_trees` for the given
+        property to `path`. See :meth:`export()`.
+        """
+        trees = (
+                (study["ot:studyId"], tree["nexson_id"])
+                for study in self.service.iter_studies_find_trees(
+                    property_name=property_name,
+                    property_value=property_value,
+                    exact=exact)
+                for tree in study["matched_trees"])
+        return self.export(path, trees, schema=schema)
+
+    def fetch_newick(self, tree):
+        study_id, tree_id = tree
+        try:
+            newick = self.service.get_study_tree(
+                    study_id=study_id,
+                    tree_id=tree_id,
+                    schema="newick")
+        except (HTTPError, IOError, KeyError, ValueError, self.service.OpenTreeError):
+            return None
+        return newick.strip()
+
+    def export(self, path, trees, schema="newick"):
+        """
+        Export the trees identified by the `(study_id, tree_id)` pairs in the
+        iterable `trees` to `path`, in the given schema ("newick" or "nexus").
+
+        Returns
+        -------
+        d : dict
+            A python dictionary with the following fields:
+
+                "num_trees"
+                "failed"
+                "uncompressed_bytes"
+                "compressed_bytes"
+                "seconds"
+                "trees_per_second"
+        """
+        schema = schema.lower()
+        if schema not in TreeExporter.SCHEMAS:
+            raise ValueError("Export schema '{}' is not supported".format(schema))
+        stats = {
+                "num_trees": 0,
+                "failed": [],
+                "uncompressed_bytes": 0,
+                "compressed_bytes": 0,
+                }
+        start_time = time.time()
+        trees = iter(trees)
+        with open(path, "wb") as dest, io.open(path + TreeExporter.INDEX_SUFFIX, "w", encoding="utf-8") as index:
+            def write_member(text):
+                data = text.encode("utf-8")
+                member = _gzip_member(data)
+                offset = dest.tell()
+                dest.write(member)
+                stats["uncompressed_bytes"] += len(data)
+                stats["compressed_bytes"] += len(member)
+                return offset, len(member)
+            if schema == "nexus":
+                write_member("#NEXUS\n\nBEGIN TREES;\n")
+            while True:
+                window = list(itertools.islice(trees, self.window_size))
+                if not window:
+                    break
+                newicks = self.service.map_concurrently(
+                        self.fetch_newick,
+                        window,
+                        max_workers=self.max_workers)
+                for (study_id, tree_id), newick in zip(window, newicks):
+                    if newick is None:
+                        stats["failed"].append((study_id, tree_id))
+                        continue
+                    if schema == "nexus":
+                        text = "    TREE {} = [&R] {}\n".format(
+                                quote_newick_label("{}_{}".format(study_id, tree_id)),
+                                newick)
+                    else:
+                        text = newick + "\n"
+                    offset, length = write_member(text)
+                    index.write(json.dumps({
+                        "study_id": study_id,
+                        "tree_id": tree_id,
+                        "offset": offset,
+                        "length": length,
+                        }, sort_keys=True) + "\n")
+                    stats["num_trees"] += 1
+            if schema == "nexus":
+                write_member("END;\n")
+        stats["seconds"] = time.time() - start_time
+        if stats["seconds"] > 0:
+            stats["trees_per_second"] = stats["num_trees"] / stats["seconds"]
+        else:
+            stats["trees_per_second"] = None
+        return stats
+
+def load_export_index(path):
+    """
+    Return the sidecar index of a file written by :class:`TreeExporter`, as
+    a dictionary mapping `(study_id, tree_id)` to `(offset, length)`.
+    """
+    entries = {}
+    with io.open(path + TreeExporter.INDEX_SUFFIX, "r", encoding="utf-8") as src:
+        for line in src:
+            if line.strip():
+                entry = json.loads(line)
+                entries[(entry["study_id"], entry["tree_id"])] = (entry["offset"], entry["length"])
+    return entries
+
+def read_exported_tree(path, offset, length):
+    """
+    Return the text of the tree stored at `offset` (with compressed length
+    `length`) in a file written by :class:`TreeExporter`, reading and
+    decompressing only that tree.
+    """
+    with open(path, "rb") as src:
+        src.seek(offset)
+        member = src.read(length)
+    return zlib.decompress(member, 16 + zlib.MAX_WBITS).decode("utf-8")
+
+def _gzip_member(data):
+    compressed = io.BytesIO()
+    with gzip.GzipFile(fileobj=compressed, mode="wb", mtime=0) as dest:
+        dest.write(data)
+    return compressed.getvalue()
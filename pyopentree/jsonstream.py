@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import codecs
+import json
+import re
+
+__all__ = [str(name) for name in ("iter_array_items", "project_fields")]
+
+DEFAULT_CHUNK_SIZE = 1 << 16
+
+_DECODER = json.JSONDecoder()
+_WHITESPACE = " \t\n\r"
+# characters that change the state of the scan of a string or container
+_STRING_SPECIALS = re.compile(r'["\\]')
+_STRUCTURAL_SPECIALS = re.compile(r'["\[\]{}]')
+# characters that may follow a number or a literal
+_SCALAR_END = re.compile(r'[,\]}\s]')
+
+class _ValueScanner(object):
+    """
+    Finds the end of a JSON value that may be split across chunks, one chunk
+    at a time: the state of the scan (nesting depth, inside a string or
+    after a backslash) is kept between chunks, so each character is looked at
+    once.
+    """
+
+    def __init__(self, first_char):
+        self.is_scalar = first_char not in "\"[{"
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+
+    def find_end(self, text, pos):
+        """
+        Scan `text` from `pos` and return the position just past the end of
+        the value, or -1 if the value does not end in `text`.
+        """
+        if self.is_scalar:
+            match = _SCALAR_END.search(text, pos)
+            return -1 if match is None else match.start()
+        while pos < len(text):
+            if self.escape:
+                self.escape = False
+                pos += 1
+            elif self.in_string:
+                match = _STRING_SPECIALS.search(text, pos)
+                if match is None:
+                    return -1
+                pos = match.end()
+                if match.group() == "\\":
+                    self.escape = True
+                else:
+                    self.in_string = False
+                    if self.depth == 0:
+                        return pos
+            else:
+                match = _STRUCTURAL_SPECIALS.search(text, pos)
+                if match is None:
+                    return -1
+                pos = match.end()
+                char = match.group()
+                if char == '"':
+                    self.in_string = True
+                elif char in "[{":
+                    self.depth += 1
+                else:
+                    self.depth -= 1
+                    if self.depth == 0:
+                        return pos
+        return -1
+
+class _ChunkBuffer(object):
+    """
+    The not yet consumed text of a stream of UTF-8 encoded JSON, read a chunk
+    at a time.
+    """
+
+    def __init__(self, stream, chunk_size):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.decoder = codecs.getincrementaldecoder("utf-8")()
+        self.text = ""
+        self.pos = 0
+        self.is_exhausted = False
+
+    def read_chunk(self):
+        """
+        Return the text of the next chunk of the stream, or `None` if the
+        stream is exhausted.
+        """
+        if self.is_exhausted:
+            return None
+        data = self.stream.read(self.chunk_size)
+        if not data:
+            self.is_exhausted = True
+            return self.decoder.decode(b"", True)
+        return self.decoder.decode(data)
+
+    def read_more(self):
+        """
+        Append the next chunk of the stream to the buffer, dropping the text
+        already consumed. Returns `False` if the stream is exhausted.
+        """
+        chunk = self.read_chunk()
+        if chunk is None:
+            return False
+        self.text = self.text[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def next_char(self):
+        """
+        Skip whitespace and return the next character (without consuming
+        it), or `None` at the end of the stream.
+        """
+        while True:
+            text = self.text
+            pos = self.pos
+            while pos < len(text) and text[pos] in _WHITESPACE:
+                pos += 1
+            self.pos = pos
+            if pos < len(text):
+                return text[pos]
+            if not self.read_more():
+                return None
+
+    def expect(self, chars):
+        char = self.next_char()
+        if char is None or char not in chars:
+            raise ValueError("Expecting one of '{}' at position {} of buffer, found {!r}".format(chars, self.pos, char))
+        self.pos += 1
+        return char
+
+    def decode_value(self):
+        """
+        Consume and return the next JSON value. The chunks holding the value
+        are scanned once each to find its end, and only then joined and
+        decoded, so that a value spanning many chunks costs time linear in
+        its size. A number or literal is only accepted once the character
+        following it has been read, so that it is not decoded in part.
+        """
+        char = self.next_char()
+        if char is None:
+            raise ValueError("Expecting a value, found the end of the stream")
+        scanner = _ValueScanner(char)
+        if scanner.find_end(self.text, self.pos) < 0:
+            pieces = [self.text[self.pos:]]
+            while True:
+                chunk = self.read_chunk()
+                if chunk is None:
+                    break
+                pieces.append(chunk)
+                if scanner.find_end(chunk, 0) >= 0:
+                    break
+            self.text = "".join(pieces)
+            self.pos = 0
+        value, end = _DECODER.raw_decode(self.text, self.pos)
+        self.pos = end
+        return value
+
+def iter_array_items(stream, key, chunk_size=DEFAULT_CHUNK_SIZE, other_members=None):
+    """
+    Yield, one at a time, the items of the array that is the value of `key`
+    in the top-level JSON object read from the binary file-like object
+    `stream`, without reading the whole document into memory. Nothing is
+    yielded if there is no such member. Other members of the object are
+    skipped, or, if `other_members` is a dictionary, stored in it.
+    """
+    buf = _ChunkBuffer(stream, chunk_size)
+    buf.expect("{")
+    if buf.next_char() == "}":
+        return
+    while True:
+        name = buf.decode_value()
+        buf.expect(":")
+        if name == key and buf.next_char() == "[":
+            buf.expect("[")
+            if buf.next_char() == "]":
+                buf.pos += 1
+            else:
+                while True:
+                    yield buf.decode_value()
+                    if buf.expect(",]") == "]":
+                        break
+        else:
+            value = buf.decode_value()
+            if other_members is not None:
+                other_members[name] = value
+        if buf.expect(",}") == "}":
+            return
+
+def project_fields(record, fields, keep=()):
+    """
+    Return a copy of the dictionary `record` with only the keys in `fields`
+    and `keep`, or `record` itself if `fields` is `None`.
+    """
+    if fields is None:
+        return record
+    return dict((k, v) for k, v in record.items() if k in fields or k in keep)
@@ -0,0 +1,403 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+__all__ = [str(name) for name in ("StudyMirror",)]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sync_log (
+    synced_at REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS searchable_property (
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL,
+    PRIMARY KEY (kind, name));
+CREATE TABLE IF NOT EXISTS study (
+    study_id TEXT PRIMARY KEY,
+    fingerprint TEXT NOT NULL,
+    record TEXT NOT NULL,
+    etag TEXT,
+    last_modified TEXT);
+CREATE TABLE IF NOT EXISTS tree (
+    study_id TEXT NOT NULL,
+    tree_id TEXT NOT NULL,
+    record TEXT NOT NULL,
+    PRIMARY KEY (study_id, tree_id));
+CREATE TABLE IF NOT EXISTS property (
+    kind TEXT NOT NULL,
+    study_id TEXT NOT NULL,
+    tree_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    value TEXT NOT NULL,
+    folded_value TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS property_value ON property (kind, name, value);
+CREATE INDEX IF NOT EXISTS property_folded_value ON property (kind, name, folded_value);
+CREATE INDEX IF NOT EXISTS property_study ON property (study_id);
+"""
+
+_FULL_TEXT_SCHEMAS = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS property_text USING fts5(kind UNINDEXED, study_id UNINDEXED, tree_id UNINDEXED, name UNINDEXED, value)",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS property_text USING fts4(kind, study_id, tree_id, name, value)",
+    )
+
+class StudyMirror(object):
+    """
+    A local, searchable copy of the study and tree metadata of the phylesystem,
+    kept in an SQLite database.
+
+    The mirror is brought up to date with :meth:`sync()`, which revalidates
+    the metadata of every study with a conditional request, and only
+    re-indexes the studies that are new or have changed since the last
+    sync.
+    Every searchable property is indexed (both exactly and case-folded), and,
+    if the SQLite library supports it, all property values are also entered
+    into a full-text index used for fuzzy matching and for :meth:`search()`.
+    :meth:`find_studies()` and :meth:`find_trees()` return the same results
+    as `studies_find_studies` and `studies_find_trees`, and
+    :meth:`properties()` as `studies_properties`; see
+    :meth:`OpenTreeService.use_study_mirror()`.
+    """
+
+    STUDY = "study"
+    TREE = "tree"
+    OTU_PROPERTY_FIELDS = ("^ot:ottTaxonName", "^ot:ottId", "^ot:originalLabel")
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.executescript(_SCHEMA)
+        self.has_full_text_index = False
+        for full_text_schema in _FULL_TEXT_SCHEMAS:
+            try:
+                self.connection.execute(full_text_schema)
+            except sqlite3.OperationalError:
+                continue
+            self.has_full_text_index = True
+            break
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def __len__(self):
+        with self._lock:
+            return self.connection.execute("SELECT COUNT(*) FROM study").fetchone()[0]
+
+    @property
+    def last_synced(self):
+        """
+        The time (in seconds since the epoch) at which the last sync of the
+        mirror completed, or `None` if it has never been synced.
+        """
+        with self._lock:
+            return self.connection.execute("SELECT MAX(synced_at) FROM sync_log").fetchone()[0]
+
+    def _check_synced(self):
+        if self.last_synced is None:
+            raise ValueError("The study mirror '{}' has never been synced".format(self.path))
+
+    def sync(self, service, include_otus=False, max_workers=None):
+        """
+        Bring the mirror up to date with the server behind `service`.
+
+        The metadata of every study in the verbose listing of all studies is
+        fetched concurrently with a conditional request (revalidating the
+        copy from the last sync by its ETag or Last-Modified date), from
+        "/study/{STUDY_ID}/meta" (or the complete study, if `include_otus` is
+        `True`, so that trees can also be searched by the taxa they contain).
+        A study is re-indexed if its listing record or its metadata (e.g.,
+        that of one of its trees) has changed; studies that are no longer
+        listed are removed.
+
+        Returns
+        -------
+        d : dict
+            A python dictionary with the following fields:
+
+                "added"
+                "changed"
+                "removed"
+                "unchanged"
+        """
+        properties = service.request('/studies/properties')
+        listing = service.request(
+                '/studies/find_studies',
+                payload={"exact": False, "verbose": True})["matched_studies"]
+        with self._lock:
+            stored = dict((row[0], row[1:]) for row in self.connection.execute(
+                "SELECT study_id, fingerprint, etag, last_modified FROM study"))
+            self.connection.execute("DELETE FROM searchable_property")
+            self.connection.executemany(
+                    "INSERT INTO searchable_property VALUES (?, ?)",
+                    [(StudyMirror.STUDY, name) for name in properties.get("study_properties", [])]
+                    + [(StudyMirror.TREE, name) for name in properties.get("tree_properties", [])])
+            self.connection.commit()
+        if include_otus:
+            sub_url_format = '/study/{STUDY_ID}'
+        else:
+            sub_url_format = '/study/{STUDY_ID}/meta'
+        def fetch(record):
+            study_id = record["ot:studyId"]
+            record_text = json.dumps(record, sort_keys=True)
+            fingerprint, etag, last_modified = stored.get(study_id, (None, None, None))
+            data, etag, last_modified = service.request_conditionally(
+                    sub_url_format.format(STUDY_ID=study_id),
+                    etag=etag,
+                    last_modified=last_modified)
+            if data is None:
+                # not modified: only the listing record may have changed
+                study = None
+                new_fingerprint = _fingerprint(record_text, fingerprint.split(":")[1])
+            else:
+                study = json.loads(data.decode("utf-8"))
+                if "error" in study:
+                    raise service.OpenTreeError(study["error"])
+                new_fingerprint = _fingerprint(record_text, hashlib.sha1(data).hexdigest())
+            return study_id, new_fingerprint, etag, last_modified, record, study
+        report = {"added": 0, "changed": 0, "removed": 0, "unchanged": 0}
+        for start in range(0, len(listing), 100):
+            results = service.map_concurrently(fetch, listing[start:start + 100], max_workers=max_workers)
+            with self._lock:
+                for study_id, fingerprint, etag, last_modified, record, study in results:
+                    if study_id not in stored:
+                        report["added"] += 1
+                    elif stored[study_id][0] != fingerprint:
+                        report["changed"] += 1
+                    else:
+                        report["unchanged"] += 1
+                        self.connection.execute(
+                                "UPDATE study SET etag = ?, last_modified = ? WHERE study_id = ?",
+                                (etag, last_modified, study_id))
+                        continue
+                    if study is None:
+                        # the listing record changed, but the stored metadata did not
+                        self._update_study_record(study_id, fingerprint, record)
+                    else:
+                        self._store_study(study_id, fingerprint, etag, last_modified, record, study.get("nexml", study))
+                self.connection.commit()
+        listed = set(record["ot:studyId"] for record in listing)
+        removed = [study_id for study_id in stored if study_id not in listed]
+        with self._lock:
+            for study_id in removed:
+                self._delete_study(study_id)
+            self.connection.execute("INSERT INTO sync_log VALUES (?)", (time.time(),))
+            self.connection.commit()
+        report["removed"] = len(removed)
+        return report
+
+    def _delete_study(self, study_id):
+        for table in ("study", "tree", "property"):
+            self.connection.execute("DELETE FROM {} WHERE study_id = ?".format(table), (study_id,))
+        if self.has_full_text_index:
+            self.connection.execute("DELETE FROM property_text WHERE study_id = ?", (study_id,))
+
+    def _update_study_record(self, study_id, fingerprint, record):
+        self.connection.execute(
+                "UPDATE study SET fingerprint = ?, record = ? WHERE study_id = ?",
+                (fingerprint, json.dumps(record), study_id))
+        self.connection.execute(
+                "DELETE FROM property WHERE kind = ? AND study_id = ?",
+                (StudyMirror.STUDY, study_id))
+        if self.has_full_text_index:
+            self.connection.execute(
+                    "DELETE FROM property_text WHERE kind = ? AND study_id = ?",
+                    (StudyMirror.STUDY, study_id))
+        self._insert_property_rows(_study_property_rows(study_id, record))
+
+    def _store_study(self, study_id, fingerprint, etag, last_modified, record, nexml):
+        self._delete_study(study_id)
+        rows = _study_property_rows(study_id, record)
+        self.connection.execute(
+                "INSERT INTO study VALUES (?, ?, ?, ?, ?)",
+                (study_id, fingerprint, json.dumps(record), etag, last_modified))
+        otus = {}
+        for otus_group in (nexml.get("otusById", None) or {}).values():
+            otus.update(otus_group.get("otuById", {}))
+        for trees_group in (nexml.get("treesById", None) or {}).values():
+            for tree_id, tree in trees_group.get("treeById", {}).items():
+                tree_record = {"ot:studyId": study_id, "nexson_id": tree_id, "oti_tree_id": "{}_{}".format(study_id, tree_id)}
+                for key, value in tree.items():
+                    if key.startswith("^"):
+                        tree_record[key[1:]] = value
+                    elif key == "@label":
+                        tree_record["ot:treeLabel"] = value
+                self.connection.execute(
+                        "INSERT INTO tree VALUES (?, ?, ?)",
+                        (study_id, tree_id, json.dumps(tree_record)))
+                for name, value in tree_record.items():
+                    rows.extend(_property_rows(StudyMirror.TREE, study_id, tree_id, name, value))
+                otu_ids = set(node["@otu"] for node in (tree.get("nodeById", None) or {}).values() if "@otu" in node)
+                for field in StudyMirror.OTU_PROPERTY_FIELDS:
+                    values = set(otus[otu_id][field] for otu_id in otu_ids if otu_id in otus and field in otus[otu_id])
+                    for value in values:
+                        rows.extend(_property_rows(StudyMirror.TREE, study_id, tree_id, field[1:], value))
+        self._insert_property_rows(rows)
+
+    def _insert_property_rows(self, rows):
+        self.connection.executemany("INSERT INTO property VALUES (?, ?, ?, ?, ?, ?)", rows)
+        if self.has_full_text_index:
+            self.connection.executemany(
+                    "INSERT INTO property_text (kind, study_id, tree_id, name, value) VALUES (?, ?, ?, ?, ?)",
+                    [row[:5] for row in rows])
+
+    def properties(self):
+        """
+        Local equivalent of :meth:`OpenTreeService.studies_properties()`, as of
+        the last sync.
+        """
+        self._check_synced()
+        properties = {"study_properties": [], "tree_properties": []}
+        with self._lock:
+            rows = self.connection.execute("SELECT kind, name FROM searchable_property ORDER BY kind, name").fetchall()
+        for kind, name in rows:
+            properties["{}_properties".format(kind)].append(name)
+        return properties
+
+    def _matching_ids(self, kind, property_name, property_value, exact):
+        """
+        Return an iterable of (study id, tree id) pairs of the studies (or
+        trees) with a property matching the given value, in study id order.
+        Raises `ValueError` if the property is not one of the searchable
+        properties listed by the server at the last sync, or if the mirror
+        has never been synced.
+        """
+        self._check_synced()
+        property_name = property_name[1:] if property_name.startswith("^") else property_name
+        with self._lock:
+            searchable = set(row[0] for row in self.connection.execute(
+                "SELECT name FROM searchable_property WHERE kind = ?",
+                (kind,)))
+        if property_name not in searchable:
+            raise ValueError("'{}' is not a searchable {} property".format(property_name, kind))
+        property_value = _property_value_text(property_value)
+        if exact:
+            query = "SELECT DISTINCT study_id, tree_id FROM property WHERE kind = ? AND name = ? AND value = ? ORDER BY study_id, tree_id"
+            args = (kind, property_name, property_value)
+        elif self.has_full_text_index and property_value.strip():
+            query = "SELECT DISTINCT study_id, tree_id FROM property_text WHERE value MATCH ? AND kind = ? AND name = ? ORDER BY study_id, tree_id"
+            args = ('"{}"'.format(property_value.replace('"', '""')), kind, property_name)
+        else:
+            query = "SELECT DISTINCT study_id, tree_id FROM property WHERE kind = ? AND name = ? AND folded_value LIKE ? ORDER BY study_id, tree_id"
+            args = (kind, property_name, "%{}%".format(property_value.lower()))
+        with self._lock:
+            return self.connection.execute(query, args).fetchall()
+
+    def find_studies(self, property_name=None, property_value=None, exact=False, verbose=False):
+        """
+        Local equivalent of :meth:`OpenTreeService.studies_find_studies()`.
+        """
+        if property_name is None or property_value is None:
+            self._check_synced()
+            with self._lock:
+                rows = self.connection.execute("SELECT study_id, record FROM study ORDER BY study_id").fetchall()
+        else:
+            study_ids = [row[0] for row in self._matching_ids(StudyMirror.STUDY, property_name, property_value, exact)]
+            rows = self._study_records(study_ids)
+        if verbose:
+            matched_studies = [json.loads(record) for study_id, record in rows]
+        else:
+            matched_studies = [{"ot:studyId": study_id} for study_id, record in rows]
+        return {"matched_studies": matched_studies}
+
+    def find_trees(self, property_name, property_value, exact=False, verbose=False):
+        """
+        Local equivalent of :meth:`OpenTreeService.studies_find_trees()`.
+        """
+        matched_studies = []
+        current = None
+        for study_id, tree_id in self._matching_ids(StudyMirror.TREE, property_name, property_value, exact):
+            if current is None or current["ot:studyId"] != study_id:
+                current = {"ot:studyId": study_id, "matched_trees": []}
+                matched_studies.append(current)
+            if verbose:
+                with self._lock:
+                    tree_record = json.loads(self.connection.execute(
+                        "SELECT record FROM tree WHERE study_id = ? AND tree_id = ?",
+                        (study_id, tree_id)).fetchone()[0])
+            else:
+                tree_record = {"nexson_id": tree_id, "oti_tree_id": "{}_{}".format(study_id, tree_id)}
+            current["matched_trees"].append(tree_record)
+        if verbose:
+            records = dict(self._study_records([study["ot:studyId"] for study in matched_studies]))
+            for study in matched_studies:
+                matched_trees = study["matched_trees"]
+                study.update(json.loads(records[study["ot:studyId"]]))
+                study["matched_trees"] = matched_trees
+        return {"matched_studies": matched_studies}
+
+    def search(self, text):
+        """
+        Return the ids of the studies any of whose properties, or those of
+        their trees, match all the words of `text` (or, without a full-text
+        index, contain `text`). The words are matched literally, so that
+        quotes or operators such as "AND" in `text` are not interpreted.
+        Raises `ValueError` if the mirror has never been synced.
+        """
+        self._check_synced()
+        if self.has_full_text_index:
+            words = text.split()
+            if not words:
+                return []
+            query = "SELECT DISTINCT study_id FROM property_text WHERE property_text MATCH ? ORDER BY study_id"
+            args = (" ".join('"{}"'.format(word.replace('"', '""')) for word in words),)
+        else:
+            query = "SELECT DISTINCT study_id FROM property WHERE folded_value LIKE ? ORDER BY study_id"
+            args = ("%{}%".format(text.lower()),)
+        with self._lock:
+            return [row[0] for row in self.connection.execute(query, args)]
+
+    def _study_records(self, study_ids):
+        records = []
+        with self._lock:
+            for study_id in study_ids:
+                row = self.connection.execute(
+                        "SELECT study_id, record FROM study WHERE study_id = ?",
+                        (study_id,)).fetchone()
+                if row is not None:
+                    records.append(row)
+        return records
+
+def _fingerprint(record_text, content_digest):
+    """
+    The fingerprint of a study: digests of its listing record and of its
+    metadata, separated by a colon.
+    """
+    return "{}:{}".format(hashlib.sha1(record_text.encode("utf-8")).hexdigest(), content_digest)
+
+def _study_property_rows(study_id, record):
+    rows = []
+    for name, value in record.items():
+        rows.extend(_property_rows(StudyMirror.STUDY, study_id, "", name, value))
+    return rows
+
+def _property_value_text(value):
+    if isinstance(value, dict):
+        for key in ("@href", "$"):
+            if key in value:
+                return _property_value_text(value[key])
+        return json.dumps(value, sort_keys=True)
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return "{}".format(value)
+
+def _property_rows(kind, study_id, tree_id, name, value):
+    if name.startswith("^"):
+        name = name[1:]
+    if isinstance(value, list):
+        values = value
+    else:
+        values = [value]
+    rows = []
+    for value in values:
+        if value is None:
+            continue
+        text = _property_value_text(value)
+        rows.append((kind, study_id, tree_id, name, text, text.lower()))
+    return rows
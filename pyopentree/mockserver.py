@@ -0,0 +1,394 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import io
+import json
+import random
+import sys
+import threading
+import time
+
+if sys.hexversion < 0x03000000:
+    from BaseHTTPServer import BaseHTTPRequestHandler
+    from BaseHTTPServer import HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlsplit
+    _STRING_TYPES = basestring
+else:
+    from http.server import BaseHTTPRequestHandler
+    from http.server import HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlsplit
+    _STRING_TYPES = str
+
+try:
+    from pyopentree.opentreeservice import OpenTreeService
+    from pyopentree.recording import canonical_request_key
+    from pyopentree.recording import split_request
+except ImportError:
+    from opentreeservice import OpenTreeService
+    from recording import canonical_request_key
+    from recording import split_request
+
+__all__ = [str(name) for name in (
+        "MockOpenTreeServer",
+        "fixture_call",
+        "synthesize_fixture_response",
+        )]
+
+# Arguments of the shared-api-tests fixtures that are named differently in
+# the methods of OpenTreeService.
+FIXTURE_ARGUMENT_NAMES = {
+        "studies_find_studies": {"property": "property_name", "value": "property_value"},
+        "studies_find_trees": {"property": "property_name", "value": "property_value"},
+        }
+
+def fixture_call(case):
+    """
+    Return `(function_name, kwargs)`, the :class:`OpenTreeService` method
+    exercised by the shared-api-tests fixture `case` and the keyword
+    arguments to call it with.
+    """
+    function_name = case["test_function"]
+    names = FIXTURE_ARGUMENT_NAMES.get(function_name, {})
+    kwargs = dict((str(names.get(k, k)), v) for k, v in case["test_input"].items())
+    return function_name, kwargs
+
+def synthesize_fixture_response(tests):
+    """
+    Return `(status, response)`, a response (a parsed JSON document) that
+    satisfies the expectations `tests` of a shared-api-tests fixture case,
+    and its HTTP status.
+    """
+    if "parameters_error" in tests:
+        return 400, {"error": tests["parameters_error"][-1]}
+    if "contains_error" in tests:
+        return 200, {"error": tests["contains_error"][0]}
+    of_type = tests.get("of_type", ("dict",))[0]
+    if of_type == "list":
+        return 200, []
+    response = {}
+    for sub_test in tests.get("contains", ()):
+        response.setdefault(sub_test[0], None)
+    for sub_test in tests.get("equals", ()):
+        response[sub_test[0][0]] = sub_test[0][1]
+    for sub_test in tests.get("deep_equals", ()):
+        _set_path(response, sub_test[0][0], sub_test[0][1])
+    for sub_test in tests.get("length_greater_than", ()):
+        response[sub_test[0][0]] = [None] * (sub_test[0][1] + 1)
+    for sub_test in tests.get("length_less_than", ()):
+        response[sub_test[0][0]] = []
+    return 200, response
+
+class _RequestCaptured(Exception):
+
+    def __init__(self, request):
+        Exception.__init__(self)
+        self.request = request
+
+class _RequestCapturingService(OpenTreeService):
+    """
+    A service that, instead of sending its first request, raises it.
+    """
+
+    def open_url(self, request):
+        raise _RequestCaptured(request)
+
+class MockOpenTreeServer(object):
+    """
+    A local stand-in for the Open Tree of Life API, for tests and benchmarks.
+
+    Responses are looked up by the :func:`canonical_request_key()` of each
+    request, among the recordings added with :meth:`add_response()`, loaded
+    from a JSONL file with :meth:`load_recordings()` or from a
+    :class:`RecordingStore` with :meth:`load_recording_store()`, or
+    synthesized from the expectations of shared-api-tests fixtures with
+    :meth:`load_fixtures()`.
+    Requests without a recording get a 404 with a JSON error.
+
+    The server can add `latency` seconds (plus up to `jitter` seconds at
+    random) before each response, fail a fraction `error_rate` of the
+    requests with status `error_status`, and send response bodies at no more
+    than `bandwidth` bytes per second. It serves each connection on its own
+    thread, and counts connections, requests and bytes sent in `stats`.
+
+    Use it as a context manager, or call :meth:`start()` and :meth:`stop()`;
+    point a service at it with `OpenTreeService(base_url=server.base_url)`.
+    """
+
+    BASE_PATH = "/v2"
+
+    def __init__(self,
+            host="127.0.0.1",
+            port=0,
+            latency=0.0,
+            jitter=0.0,
+            error_rate=0.0,
+            error_status=500,
+            bandwidth=None,
+            seed=None):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.bandwidth = bandwidth
+        self.responses = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._httpd = None
+        self._thread = None
+        self.reset_stats()
+
+    @property
+    def base_url(self):
+        return "http://{}:{}{}".format(self.host, self.port, MockOpenTreeServer.BASE_PATH)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def start(self):
+        self._httpd = _ThreadingHTTPServer((self.host, self.port), _MockRequestHandler)
+        self._httpd.mock = self
+        self.port = self._httpd.server_address[1]
+        self._thread = threading.Thread(
+                target=self._httpd.serve_forever,
+                kwargs={"poll_interval": 0.1})
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._thread.join()
+            self._httpd = None
+            self._thread = None
+
+    def reset_stats(self):
+        with self._lock:
+            # connections open across a reset are still counted as active
+            active = getattr(self, "stats", {}).get("active_connections", 0)
+            self.stats = {
+                    "connections": 0,
+                    "active_connections": active,
+                    "peak_connections": active,
+                    "requests": 0,
+                    "unmatched": 0,
+                    "errors_injected": 0,
+                    "bytes_sent": 0,
+                    }
+
+    def add_response(self,
+            sub_url,
+            body,
+            payload=None,
+            method="POST",
+            status=200,
+            headers=None):
+        """
+        Serve `body` (bytes, text, or an object to be sent as JSON) with the
+        given status and headers to requests for `sub_url` with the given
+        method and payload.
+        """
+        if isinstance(body, bytes):
+            data = body
+        elif isinstance(body, _STRING_TYPES):
+            data = body.encode("utf-8")
+        else:
+            data = json.dumps(body).encode("utf-8")
+        key = canonical_request_key(method, sub_url, payload)
+        self.responses[key] = (status, dict(headers or {}), data)
+        return key
+
+    def load_recordings(self, path):
+        """
+        Add the responses in the JSONL file at `path`, one object per line
+        with members "method", "sub_url", "payload", "status", "headers" and
+        "body" (as in :meth:`add_response()`). Returns the number of
+        responses added.
+        """
+        num_added = 0
+        with io.open(path, "r", encoding="utf-8") as src:
+            for line in src:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                self.add_response(
+                        entry["sub_url"],
+                        entry["body"],
+                        payload=entry.get("payload", None),
+                        method=entry.get("method", "POST"),
+                        status=entry.get("status", 200),
+                        headers=entry.get("headers", None))
+                num_added += 1
+        return num_added
+
+    def load_recording_store(self, store):
+        """
+        Add the responses recorded in the :class:`RecordingStore` `store`.
+        Returns the number of responses added.
+        """
+        num_added = 0
+        for key, status, headers, body in store.items():
+            self.responses[key] = (status, dict(headers), body)
+            num_added += 1
+        return num_added
+
+    def add_call_response(self,
+            function_name,
+            kwargs,
+            body,
+            status=200,
+            headers=None):
+        """
+        Serve `body` (as in :meth:`add_response()`) to the request issued by
+        calling the :class:`OpenTreeService` method `function_name` with the
+        keyword arguments `kwargs`. The request is found by calling the
+        method without sending it. Returns the key of the request, or `None`
+        if the call does not issue one (e.g., because its arguments are
+        rejected by the client).
+        """
+        service = _RequestCapturingService(base_url=self.base_url)
+        try:
+            getattr(service, function_name)(**kwargs)
+        except _RequestCaptured as e:
+            request = e.request
+        except Exception:
+            return None
+        else:
+            return None
+        method, sub_url, payload = split_request(request, service.base_url)
+        return self.add_response(
+                sub_url,
+                body,
+                payload=payload,
+                method=method,
+                status=status,
+                headers=headers)
+
+    def load_fixtures(self, data):
+        """
+        Add a response for each case of the shared-api-tests fixtures `data`
+        (the parsed contents of, e.g., "tree_of_life.json"), synthesized to
+        satisfy the expectations of the case (see
+        :meth:`add_call_response()`). Returns the number of responses added.
+        """
+        num_added = 0
+        for case in data.values():
+            function_name, kwargs = fixture_call(case)
+            status, response = synthesize_fixture_response(case["tests"])
+            if self.add_call_response(function_name, kwargs, response, status=status) is not None:
+                num_added += 1
+        return num_added
+
+    def respond(self, handler):
+        with self._lock:
+            self.stats["requests"] += 1
+        length = int(handler.headers.get("Content-Length", 0) or 0)
+        data = handler.rfile.read(length) if length else None
+        parts = urlsplit(handler.path)
+        sub_url = parts.path
+        if sub_url.startswith(MockOpenTreeServer.BASE_PATH):
+            sub_url = sub_url[len(MockOpenTreeServer.BASE_PATH):]
+        if parts.query:
+            sub_url += "?" + parts.query
+        key = canonical_request_key(handler.command, sub_url, data)
+        delay = self.latency
+        if self.jitter:
+            delay += self._random.uniform(0, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+        if self.error_rate and self._random.random() < self.error_rate:
+            with self._lock:
+                self.stats["errors_injected"] += 1
+            status, headers, body = self.error_status, {}, b'{"error": "injected error"}'
+        elif key in self.responses:
+            status, headers, body = self.responses[key]
+        else:
+            with self._lock:
+                self.stats["unmatched"] += 1
+            status, headers = 404, {}
+            body = json.dumps({"error": "no recorded response for '{}'".format(key)}).encode("utf-8")
+        handler.send_response(status)
+        if "Content-Type" not in headers:
+            handler.send_header("Content-Type", "application/json")
+        for name, value in headers.items():
+            handler.send_header(name, value)
+        handler.send_header("Content-Length", str(len(body)))
+        handler.end_headers()
+        self._send_body(handler.wfile, body)
+        with self._lock:
+            self.stats["bytes_sent"] += len(body)
+
+    def _send_body(self, dest, body):
+        if not self.bandwidth:
+            dest.write(body)
+            return
+        # send in pieces of a tenth of a second's worth of data
+        piece_size = max(1, int(self.bandwidth / 10))
+        for start in range(0, len(body), piece_size):
+            piece = body[start:start + piece_size]
+            dest.write(piece)
+            dest.flush()
+            time.sleep(len(piece) / float(self.bandwidth))
+
+    def _connection_opened(self):
+        with self._lock:
+            self.stats["connections"] += 1
+            self.stats["active_connections"] += 1
+            if self.stats["active_connections"] > self.stats["peak_connections"]:
+                self.stats["peak_connections"] = self.stats["active_connections"]
+
+    def _connection_closed(self):
+        with self._lock:
+            self.stats["active_connections"] -= 1
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def process_request_thread(self, request, client_address):
+        self.mock._connection_opened()
+        try:
+            ThreadingMixIn.process_request_thread(self, request, client_address)
+        finally:
+            self.mock._connection_closed()
+
+class _MockRequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        self.server.mock.respond(self)
+
+    def do_POST(self):
+        self.server.mock.respond(self)
+
+    def log_message(self, format, *args):
+        pass
+
+def _set_path(obj, path, value):
+    for position, step in enumerate(path):
+        is_last = position == len(path) - 1
+        if is_last:
+            child = value
+        elif isinstance(path[position + 1], int):
+            child = []
+        else:
+            child = {}
+        if isinstance(step, int):
+            while len(obj) <= step:
+                obj.append(None)
+            if obj[step] is None or is_last:
+                obj[step] = child
+        elif step not in obj or obj[step] is None or is_last:
+            obj[step] = child
+        obj = obj[step]
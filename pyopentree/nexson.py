@@ -0,0 +1,594 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import json
+import re
+import sys
+from xml.sax.saxutils import escape as _xml_escape
+from xml.sax.saxutils import quoteattr as _xml_quoteattr
+
+try:
+    from pyopentree.compacttree import quote_newick_label
+except ImportError:
+    from compacttree import quote_newick_label
+
+__all__ = [str(name) for name in (
+        "Otu",
+        "OtuIndex",
+        "NexsonNode",
+        "NexsonTree",
+        "LazyStudy",
+        "study_tree",
+        "study_tree_as_newick",
+        "study_tree_as_nexus",
+        "study_tree_as_nexml",
+        "study_tree_as_nexson",
+        "STUDY_TREE_WRITERS",
+        )]
+
+if sys.hexversion < 0x03070000:
+    # dictionaries only keep the order of their keys from Python 3.7, and
+    # the order of the children of a node is that of its tree's "nodeById"
+    from collections import OrderedDict as _ordered_dict
+    def _json_loads(text):
+        return json.loads(text, object_pairs_hook=_ordered_dict)
+else:
+    _ordered_dict = dict
+    _json_loads = json.loads
+
+_JSON_STRING_PATTERN = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"')
+_JSON_WHITESPACE_PATTERN = re.compile(r'\s*')
+# Decodes a JSON value while discarding every object as soon as it has been
+# built, which finds the end of a (possibly very large) value quickly and
+# without holding it in memory.
+_JSON_SKIPPING_DECODER = json.JSONDecoder(object_pairs_hook=lambda pairs: None)
+
+class Otu(object):
+    """
+    An OTU of a NexSON study.
+    """
+
+    __slots__ = ("otu_id", "label", "original_label", "ott_id", "ott_taxon_name")
+
+    def __init__(self, otu_id, label=None, original_label=None, ott_id=None, ott_taxon_name=None):
+        self.otu_id = otu_id
+        self.label = label
+        self.original_label = original_label
+        self.ott_id = ott_id
+        self.ott_taxon_name = ott_taxon_name
+
+    @classmethod
+    def from_dict(cls, otu_id, otu):
+        return cls(
+                otu_id=otu_id,
+                label=otu.get("@label", None),
+                original_label=otu.get("^ot:originalLabel", None),
+                ott_id=otu.get("^ot:ottId", None),
+                ott_taxon_name=otu.get("^ot:ottTaxonName", None))
+
+    def __repr__(self):
+        return "<Otu {} ({})>".format(self.otu_id, self.original_label)
+
+class OtuIndex(object):
+    """
+    An index of the OTUs of a study by label and by ott id.
+
+    Each OTU is indexed under its original label, its label and the name of
+    the taxon it is mapped to (if any), both exactly and case-folded.
+    """
+
+    def __init__(self, otus):
+        self.otus = list(otus)
+        self.by_label = {}
+        self.by_folded_label = {}
+        self.by_ott_id = {}
+        for otu in self.otus:
+            labels = set(label for label in (otu.original_label, otu.label, otu.ott_taxon_name) if label is not None)
+            for label in labels:
+                self.by_label.setdefault(label, []).append(otu)
+            for folded_label in set(label.lower() for label in labels):
+                self.by_folded_label.setdefault(folded_label, []).append(otu)
+            if otu.ott_id is not None:
+                self.by_ott_id.setdefault(otu.ott_id, []).append(otu)
+
+    def __len__(self):
+        return len(self.otus)
+
+    def lookup_label(self, label, ignore_case=False):
+        """
+        Return the list of OTUs with the given label (empty if there are
+        none).
+        """
+        if ignore_case:
+            return list(self.by_folded_label.get(label.lower(), []))
+        return list(self.by_label.get(label, []))
+
+    def lookup_ott_id(self, ott_id):
+        """
+        Return the list of OTUs mapped to the given ott id (empty if there are
+        none).
+        """
+        return list(self.by_ott_id.get(ott_id, []))
+
+class NexsonNode(object):
+    """
+    A node of a NexSON tree. `edge_length` is the length of the edge
+    subtending the node, or `None`.
+    """
+
+    __slots__ = ("node_id", "otu_id", "parent_id", "edge_length")
+
+    def __init__(self, node_id, otu_id=None, parent_id=None, edge_length=None):
+        self.node_id = node_id
+        self.otu_id = otu_id
+        self.parent_id = parent_id
+        self.edge_length = edge_length
+
+    def __repr__(self):
+        return "<NexsonNode {}>".format(self.node_id)
+
+class NexsonTree(object):
+    """
+    A tree of a NexSON study, with its nodes as :class:`NexsonNode` objects.
+    `nodes` lists the nodes in document order (that of the "nodeById"
+    dictionary the tree is built from) and `child_ids` maps the id of each
+    internal node to the ids of its children, in the same order.
+    """
+
+    def __init__(self, tree_id, label, root_node_id, ingroup_node_id, nodes):
+        self.tree_id = tree_id
+        self.label = label
+        self.root_node_id = root_node_id
+        self.ingroup_node_id = ingroup_node_id
+        self.nodes = nodes
+        self.node_by_id = dict((node.node_id, node) for node in nodes)
+        self.child_ids = {}
+        for node in nodes:
+            if node.parent_id is not None:
+                self.child_ids.setdefault(node.parent_id, []).append(node.node_id)
+
+    @classmethod
+    def from_dict(cls, tree_id, tree):
+        """
+        Build a tree from its NexSON (version 1.2) dictionary.
+        """
+        parents = {}
+        for edges in tree.get("edgeBySourceId", {}).values():
+            for edge in edges.values():
+                parents[edge["@target"]] = (edge["@source"], edge.get("@length", None))
+        nodes = []
+        root_node_id = tree.get("^ot:rootNodeId", None)
+        for node_id, node in tree.get("nodeById", {}).items():
+            parent_id, edge_length = parents.get(node_id, (None, None))
+            if node.get("@root", False) and root_node_id is None:
+                root_node_id = node_id
+            nodes.append(NexsonNode(
+                node_id=node_id,
+                otu_id=node.get("@otu", None),
+                parent_id=parent_id,
+                edge_length=edge_length))
+        if root_node_id is None:
+            for node in nodes:
+                if node.parent_id is None:
+                    root_node_id = node.node_id
+                    break
+        return cls(
+                tree_id=tree_id,
+                label=tree.get("@label", None),
+                root_node_id=root_node_id,
+                ingroup_node_id=tree.get("^ot:inGroupClade", None),
+                nodes=nodes)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def children(self, node_id):
+        return self.child_ids.get(node_id, [])
+
+class LazyStudy(object):
+    """
+    A NexSON study that is parsed on demand.
+
+    The text of the document is kept, and only the positions of its main
+    sections are located up front (without keeping their contents). The
+    study metadata, the OTU table and each tree are parsed the first time
+    they are accessed, so that code touching only part of a large study does
+    not pay to hold the rest.
+    """
+
+    def __init__(self, raw):
+        if isinstance(raw, bytes):
+            raw = raw.decode("utf-8")
+        self.text = raw
+        self._sections = None
+        self._tree_spans = {}
+        self._metadata = None
+        self._otus = None
+        self._otu_index = None
+        self._trees = {}
+        # Locate the sections and the trees in a single pass, descending
+        # only into "nexml" (possibly wrapped in "data"), "treesById" and
+        # its "treeById" groups, and skipping over everything else.
+        def trees_group_value_end(key, value_start):
+            if key != "treeById":
+                return _value_end(raw, value_start)
+            members, end = _scan_object(raw, value_start)
+            for tree_id, tree_start, tree_end in members:
+                self._tree_spans[tree_id] = (tree_start, tree_end)
+            return end
+        def trees_value_end(key, value_start):
+            return _scan_object(raw, value_start, trees_group_value_end)[1]
+        def nexml_value_end(key, value_start):
+            if key == "treesById":
+                return _scan_object(raw, value_start, trees_value_end)[1]
+            return _value_end(raw, value_start)
+        def document_value_end(key, value_start):
+            if key == "nexml" and self._sections is None:
+                members, end = _scan_object(raw, value_start, nexml_value_end)
+                self._sections = dict((key, (start, end)) for key, start, end in members)
+                return end
+            if key == "data":
+                return _scan_object(raw, value_start, document_value_end)[1]
+            return _value_end(raw, value_start)
+        _scan_object(raw, _skip_whitespace(raw, 0), document_value_end)
+        if self._sections is None:
+            raise ValueError("Not a NexSON study: no 'nexml' element")
+
+    def _parse(self, start, end):
+        return _json_loads(self.text[start:end])
+
+    @property
+    def metadata(self):
+        """
+        The study-level fields of the "nexml" element (everything except the
+        OTUs and the trees), as a dictionary.
+        """
+        if self._metadata is None:
+            self._metadata = dict(
+                    (key, self._parse(start, end))
+                    for key, (start, end) in self._sections.items()
+                    if key not in ("otusById", "treesById"))
+        return self._metadata
+
+    @property
+    def otus(self):
+        """
+        A dictionary mapping OTU ids to :class:`Otu` objects.
+        """
+        if self._otus is None:
+            otus = {}
+            if "otusById" in self._sections:
+                start, end = self._sections["otusById"]
+                for otus_group in self._parse(start, end).values():
+                    for otu_id, otu in otus_group.get("otuById", {}).items():
+                        otus[otu_id] = Otu.from_dict(otu_id, otu)
+            self._otus = otus
+        return self._otus
+
+    @property
+    def otu_index(self):
+        """
+        An :class:`OtuIndex` of the OTUs of the study.
+        """
+        if self._otu_index is None:
+            self._otu_index = OtuIndex(self.otus.values())
+        return self._otu_index
+
+    def tree_ids(self):
+        """
+        Return the ids of the trees of the study, in document order.
+        """
+        spans = self._tree_spans
+        return sorted(spans, key=lambda tree_id: spans[tree_id][0])
+
+    def tree_dict(self, tree_id):
+        """
+        Return the NexSON dictionary of the tree `tree_id`.
+        """
+        if tree_id not in self._tree_spans:
+            raise KeyError("Tree '{}' not found in study".format(tree_id))
+        start, end = self._tree_spans[tree_id]
+        return self._parse(start, end)
+
+    def tree(self, tree_id):
+        """
+        Return the tree `tree_id` as a :class:`NexsonTree`.
+        """
+        if tree_id not in self._trees:
+            self._trees[tree_id] = NexsonTree.from_dict(tree_id, self.tree_dict(tree_id))
+        return self._trees[tree_id]
+
+    def as_dict(self):
+        """
+        Return the complete study, parsed, as returned by `get_study`.
+        """
+        return _json_loads(self.text)
+
+def study_tree(study, tree_id):
+    """
+    Return the tree `tree_id` of `study` (a :class:`LazyStudy`, or a parsed
+    NexSON dictionary as returned by `get_study`) as a :class:`NexsonTree`,
+    together with a dictionary mapping OTU ids to :class:`Otu` objects.
+    """
+    if isinstance(study, LazyStudy):
+        return study.tree(tree_id), study.otus
+    otus = {}
+    for otus_group in _nexml(study).get("otusById", {}).values():
+        for otu_id, otu in otus_group.get("otuById", {}).items():
+            otus[otu_id] = Otu.from_dict(otu_id, otu)
+    return NexsonTree.from_dict(tree_id, _study_tree_dict(study, tree_id)), otus
+
+def _nexml(study):
+    if "data" in study:
+        study = study["data"]
+    return study["nexml"]
+
+def _study_tree_dict(study, tree_id):
+    if isinstance(study, LazyStudy):
+        return study.tree_dict(tree_id)
+    for trees_group in _nexml(study).get("treesById", {}).values():
+        trees = trees_group.get("treeById", {})
+        if tree_id in trees:
+            return trees[tree_id]
+    raise KeyError("Tree '{}' not found in study".format(tree_id))
+
+def _subtree_root(tree, subtree_id):
+    if subtree_id is None:
+        return tree.root_node_id
+    if subtree_id == "ingroup":
+        if tree.ingroup_node_id is None:
+            raise ValueError("Tree '{}' does not have an ingroup specified".format(tree.tree_id))
+        return tree.ingroup_node_id
+    if subtree_id not in tree.node_by_id:
+        raise KeyError("Node '{}' not found in tree '{}'".format(subtree_id, tree.tree_id))
+    return subtree_id
+
+def _otu_label(otu):
+    if otu is None:
+        return None
+    for label in (otu.original_label, otu.label, otu.ott_taxon_name):
+        if label is not None:
+            return label
+    return otu.otu_id
+
+def study_tree_as_newick(study, tree_id, subtree_id=None):
+    """
+    Return the tree `tree_id` of `study` (a :class:`LazyStudy` or a parsed
+    NexSON dictionary) as a NEWICK string, labelling the tips with the
+    original labels of their OTUs.
+
+    If `subtree_id` is given, only the subtree descended from the node with
+    that id (or from the ingroup node, if `subtree_id` is "ingroup") is
+    returned.
+    """
+    tree, otus = study_tree(study, tree_id)
+    return _nexson_tree_as_newick(tree, otus, _subtree_root(tree, subtree_id))
+
+def _nexson_tree_as_newick(tree, otus, root_node_id, otu_labels=None):
+    parts = []
+    stack = [(root_node_id, False)]
+    while stack:
+        node_id, is_closing = stack.pop()
+        if node_id is None:
+            parts.append(",")
+            continue
+        if is_closing:
+            parts.append(")")
+        else:
+            child_ids = tree.children(node_id)
+            if child_ids:
+                parts.append("(")
+                stack.append((node_id, True))
+                for pos in range(len(child_ids) - 1, -1, -1):
+                    stack.append((child_ids[pos], False))
+                    if pos > 0:
+                        stack.append((None, False))
+                continue
+        node = tree.node_by_id[node_id]
+        if node.otu_id is not None:
+            if otu_labels is not None:
+                label = otu_labels.get(node.otu_id, None)
+            else:
+                label = _otu_label(otus.get(node.otu_id, None))
+            if label is not None:
+                parts.append(quote_newick_label(label))
+        if node.edge_length is not None and node_id != root_node_id:
+            parts.append(":{}".format(node.edge_length))
+    parts.append(";")
+    return "".join(parts)
+
+def study_tree_as_nexus(study, tree_id, subtree_id=None):
+    """
+    Return the tree `tree_id` of `study` (a :class:`LazyStudy` or a parsed
+    NexSON dictionary) as a NEXUS document with a TAXA block and a TREES
+    block. `subtree_id` is as for :func:`study_tree_as_newick()`.
+    """
+    tree, otus = study_tree(study, tree_id)
+    root_node_id = _subtree_root(tree, subtree_id)
+    # TAXLABELS must be unique: the label of an OTU that is already used by
+    # another OTU is suffixed with the OTU id
+    otu_labels = {}
+    used_labels = set()
+    labels = []
+    to_visit = [root_node_id]
+    while to_visit:
+        node_id = to_visit.pop()
+        child_ids = tree.children(node_id)
+        if child_ids:
+            to_visit.extend(reversed(child_ids))
+            continue
+        otu_id = tree.node_by_id[node_id].otu_id
+        if otu_id is None or otu_id in otu_labels:
+            continue
+        label = _otu_label(otus.get(otu_id, None))
+        if label is None:
+            continue
+        if label in used_labels:
+            label = "{}_{}".format(label, otu_id)
+        otu_labels[otu_id] = label
+        used_labels.add(label)
+        labels.append(quote_newick_label(label))
+    return "\n".join([
+        "#NEXUS",
+        "",
+        "BEGIN TAXA;",
+        "    DIMENSIONS NTAX={};".format(len(labels)),
+        "    TAXLABELS",
+        ] + ["        {}".format(label) for label in labels] + [
+        "    ;",
+        "END;",
+        "",
+        "BEGIN TREES;",
+        "    TREE {} = [&R] {}".format(
+            quote_newick_label(tree.tree_id),
+            _nexson_tree_as_newick(tree, otus, root_node_id, otu_labels)),
+        "END;",
+        "",
+        ])
+
+def study_tree_as_nexml(study, tree_id, subtree_id=None):
+    """
+    Return the tree `tree_id` of `study` (a :class:`LazyStudy` or a parsed
+    NexSON dictionary) as a NeXML document. `subtree_id` is as for
+    :func:`study_tree_as_newick()`.
+    """
+    tree, otus = study_tree(study, tree_id)
+    root_node_id = _subtree_root(tree, subtree_id)
+    node_ids = []
+    to_visit = [root_node_id]
+    while to_visit:
+        node_id = to_visit.pop()
+        node_ids.append(node_id)
+        to_visit.extend(reversed(tree.children(node_id)))
+    otu_ids = [tree.node_by_id[node_id].otu_id for node_id in node_ids if tree.node_by_id[node_id].otu_id is not None]
+    lines = [
+        '<?xml version="1.0" encoding="UTF-8"?>',
+        '<nex:nexml xmlns:nex="http://www.nexml.org/2009" xmlns="http://www.nexml.org/2009" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" version="0.9">',
+        '    <otus id="otus">',
+        ]
+    for otu_id in otu_ids:
+        label = _otu_label(otus.get(otu_id, None))
+        if label is None:
+            lines.append('        <otu id={}/>'.format(_xml_quoteattr(otu_id)))
+        else:
+            lines.append('        <otu id={} label={}/>'.format(_xml_quoteattr(otu_id), _xml_quoteattr(label)))
+    lines.extend([
+        '    </otus>',
+        '    <trees id="trees" otus="otus">',
+        '        <tree id={} xsi:type="nex:FloatTree"{}>'.format(
+            _xml_quoteattr(tree.tree_id),
+            "" if tree.label is None else " label={}".format(_xml_quoteattr(tree.label))),
+        ])
+    for node_id in node_ids:
+        node = tree.node_by_id[node_id]
+        attributes = ["id={}".format(_xml_quoteattr(node_id))]
+        if node.otu_id is not None:
+            attributes.append("otu={}".format(_xml_quoteattr(node.otu_id)))
+        if node_id == root_node_id:
+            attributes.append('root="true"')
+        lines.append('            <node {}/>'.format(" ".join(attributes)))
+    for node_id in node_ids[1:]:
+        node = tree.node_by_id[node_id]
+        attributes = [
+                "id={}".format(_xml_quoteattr("edge_" + node_id)),
+                "source={}".format(_xml_quoteattr(node.parent_id)),
+                "target={}".format(_xml_quoteattr(node_id)),
+                ]
+        if node.edge_length is not None:
+            attributes.append("length={}".format(_xml_quoteattr("{}".format(node.edge_length))))
+        lines.append('            <edge {}/>'.format(" ".join(attributes)))
+    lines.extend([
+        '        </tree>',
+        '    </trees>',
+        '</nex:nexml>',
+        '',
+        ])
+    return "\n".join(lines)
+
+def study_tree_as_nexson(study, tree_id, subtree_id=None):
+    """
+    Return the tree `tree_id` of `study` (a :class:`LazyStudy` or a parsed
+    NexSON dictionary) as a dictionary mapping the tree id to its NexSON.
+    `subtree_id` is as for :func:`study_tree_as_newick()`; if given, the
+    nodes and edges outside the subtree are dropped.
+    """
+    tree_dict = _study_tree_dict(study, tree_id)
+    if subtree_id is None:
+        return {tree_id: tree_dict}
+    tree = NexsonTree.from_dict(tree_id, tree_dict)
+    root_node_id = _subtree_root(tree, subtree_id)
+    node_ids = set()
+    to_visit = [root_node_id]
+    while to_visit:
+        node_id = to_visit.pop()
+        node_ids.add(node_id)
+        to_visit.extend(tree.children(node_id))
+    subtree_dict = _ordered_dict(tree_dict)
+    subtree_dict["nodeById"] = _ordered_dict(
+            (node_id, node)
+            for node_id, node in tree_dict.get("nodeById", {}).items()
+            if node_id in node_ids)
+    subtree_dict["edgeBySourceId"] = _ordered_dict(
+            (source_id, edges)
+            for source_id, edges in tree_dict.get("edgeBySourceId", {}).items()
+            if source_id in node_ids)
+    subtree_dict["^ot:rootNodeId"] = root_node_id
+    return {tree_id: subtree_dict}
+
+STUDY_TREE_WRITERS = {
+        "newick": study_tree_as_newick,
+        "nexus": study_tree_as_nexus,
+        "nexml": study_tree_as_nexml,
+        "nexson": study_tree_as_nexson,
+        "json": study_tree_as_nexson,
+        }
+
+def _skip_whitespace(text, pos):
+    return _JSON_WHITESPACE_PATTERN.match(text, pos).end()
+
+def _value_end(text, start):
+    """
+    Return the position just past the end of the JSON value starting at
+    `start`.
+    """
+    return _JSON_SKIPPING_DECODER.raw_decode(text, start)[1]
+
+def _scan_object(text, start, value_end=None):
+    """
+    Scan the JSON object starting at `start`, without keeping its values.
+
+    Returns `(members, end)`, where `members` is a list of `(key,
+    value_start, value_end)` tuples and `end` is the position just past the
+    object. If given, `value_end(key, value_start)` is called to find the end
+    of each value (which lets the caller descend into values of interest);
+    otherwise values are skipped.
+    """
+    if text[start:start + 1] != "{":
+        raise ValueError("Expecting a JSON object at position {}".format(start))
+    members = []
+    pos = _skip_whitespace(text, start + 1)
+    if text[pos:pos + 1] == "}":
+        return members, pos + 1
+    while True:
+        key_match = _JSON_STRING_PATTERN.match(text, pos)
+        if key_match is None:
+            raise ValueError("Expecting a key at position {}".format(pos))
+        key = json.loads(key_match.group(0))
+        pos = _skip_whitespace(text, key_match.end())
+        if text[pos:pos + 1] != ":":
+            raise ValueError("Expecting ':' at position {}".format(pos))
+        member_start = _skip_whitespace(text, pos + 1)
+        if value_end is None:
+            member_end = _value_end(text, member_start)
+        else:
+            member_end = value_end(key, member_start)
+        members.append((key, member_start, member_end))
+        pos = _skip_whitespace(text, member_end)
+        delimiter = text[pos:pos + 1]
+        if delimiter == "}":
+            return members, pos + 1
+        if delimiter != ",":
+            raise ValueError("Expecting ',' or '}}' at position {}".format(pos))
+        pos = _skip_whitespace(text, pos + 1)
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import threading
+
+__all__ = [str(name) for name in (
+        "LineageNode",
+        "NodeInfoRecord",
+        "NodeInfoBatch",
+        )]
+
+class LineageNode(object):
+    """
+    A node of the draft tree that appears in the lineage of one or more
+    nodes of a :class:`NodeInfoBatch`. Each distinct node is represented by
+    a single instance, shared by all the lineages it appears in.
+    """
+
+    __slots__ = ("node_id", "ott_id", "name", "unique_name", "rank", "num_tips", "parent_node_id")
+
+    def __init__(self, node_id, ott_id=None, name=None, unique_name=None, rank=None, num_tips=None, parent_node_id=None):
+        self.node_id = node_id
+        self.ott_id = ott_id
+        self.name = name
+        self.unique_name = unique_name
+        self.rank = rank
+        self.num_tips = num_tips
+        self.parent_node_id = parent_node_id
+
+    def __repr__(self):
+        return "<LineageNode {} ({})>".format(self.node_id, self.name)
+
+class NodeInfoRecord(object):
+    """
+    The result of `gol_node_info` for one node of a :class:`NodeInfoBatch`.
+    The lineage is not stored in the record: it is the chain of
+    :class:`LineageNode` objects starting at `parent_node_id` in the batch's
+    node table (see :meth:`NodeInfoBatch.lineage()`).
+    """
+
+    __slots__ = (
+            "node_id",
+            "ott_id",
+            "name",
+            "rank",
+            "num_tips",
+            "num_synth_children",
+            "in_graph",
+            "in_synth_tree",
+            "tax_source",
+            "synth_sources",
+            "tree_sources",
+            "parent_node_id",
+            )
+
+    def __init__(self, **kwargs):
+        for field in NodeInfoRecord.__slots__:
+            setattr(self, field, kwargs.get(field, None))
+
+    def __repr__(self):
+        return "<NodeInfoRecord {} ({})>".format(self.node_id, self.name)
+
+class NodeInfoBatch(object):
+    """
+    The results of `gol_node_info` for many nodes.
+
+    `records` holds a :class:`NodeInfoRecord` for each requested node (or
+    `None` if the request failed, in which case the error message is given
+    in `errors`, keyed by position). `nodes` is the node table: a dictionary
+    mapping node ids to :class:`LineageNode` objects for every distinct node
+    seen in any of the lineages, so that memory scales with the number of
+    distinct ancestors rather than with the total length of the lineages.
+    Frequently repeated strings (ranks, taxonomy source names) are shared
+    by the records and nodes of the batch, and released with it.
+    """
+
+    def __init__(self, num_records):
+        self.records = [None] * num_records
+        self.errors = {}
+        self.nodes = {}
+        self._strings = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def __getitem__(self, idx):
+        return self.records[idx]
+
+    def lineage(self, record):
+        """
+        Return the lineage of `record` (a :class:`NodeInfoRecord` or
+        :class:`LineageNode`) as a list of :class:`LineageNode` objects, with
+        the immediate parent first and the root of the tree last.
+        """
+        lineage = []
+        node_id = record.parent_node_id
+        while node_id is not None:
+            node = self.nodes.get(node_id, None)
+            if node is None:
+                break
+            lineage.append(node)
+            node_id = node.parent_node_id
+        return lineage
+
+    def add_response(self, position, response):
+        """
+        Store `response`, the parsed result of `gol_node_info` for the node at
+        `position`, merging its lineage into the node table.
+        """
+        lineage = response.get("lineage", None) or []
+        parent_node_id = lineage[0]["node_id"] if lineage else None
+        record = NodeInfoRecord(
+                node_id=response.get("node_id", None),
+                ott_id=response.get("ott_id", None),
+                name=response.get("name", None),
+                rank=self._intern_or_none(response.get("rank", None)),
+                num_tips=response.get("num_tips", None),
+                num_synth_children=response.get("num_synth_children", None),
+                in_graph=response.get("in_graph", None),
+                in_synth_tree=response.get("in_synth_tree", None),
+                tax_source=self._intern_or_none(response.get("tax_source", None)),
+                synth_sources=response.get("synth_sources", None),
+                tree_sources=response.get("tree_sources", None),
+                parent_node_id=parent_node_id)
+        with self._lock:
+            nodes = self.nodes
+            for pos, ancestor in enumerate(lineage):
+                node_id = ancestor["node_id"]
+                if node_id in nodes:
+                    # the rest of the lineage is already in the table
+                    break
+                if pos + 1 < len(lineage):
+                    ancestor_parent_node_id = lineage[pos + 1]["node_id"]
+                else:
+                    ancestor_parent_node_id = None
+                nodes[node_id] = LineageNode(
+                        node_id=node_id,
+                        ott_id=ancestor.get("ott_id", None),
+                        name=ancestor.get("name", None),
+                        unique_name=ancestor.get("unique_name", None),
+                        rank=self._intern_or_none(ancestor.get("rank", None)),
+                        num_tips=ancestor.get("num_tips", None),
+                        parent_node_id=ancestor_parent_node_id)
+            self.records[position] = record
+
+    def _intern_or_none(self, s):
+        if s is None:
+            return None
+        return self._strings.setdefault(s, s)
@@ -3,20 +3,146 @@
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import itertools
 import locale
 import json
 import sys
+import threading
+from array import array
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
 
 if sys.hexversion < 0x03000000:
     from urllib2 import Request
     from urllib2 import urlopen
     from urllib import urlencode
     from urllib2 import HTTPError
+    from urllib2 import URLError
 else:
     from urllib.request import Request
     from urllib.request import urlopen
     from urllib.parse import urlencode
     from urllib.error import HTTPError
+    from urllib.error import URLError
+
+try:
+    from pyopentree.compacttree import SyntheticTreeIndex
+    from pyopentree.cache import SourceTreeCache
+    from pyopentree.nodeinfo import NodeInfoBatch
+    from pyopentree.mirror import StudyMirror
+    from pyopentree.nexson import LazyStudy
+    from pyopentree.nexson import STUDY_TREE_WRITERS
+    from pyopentree.crawler import StudyStore
+    from pyopentree.jsonstream import iter_array_items
+    from pyopentree.jsonstream import project_fields
+    from pyopentree.recording import RecordingStore
+except ImportError:
+    from compacttree import SyntheticTreeIndex
+    from cache import SourceTreeCache
+    from nodeinfo import NodeInfoBatch
+    from mirror import StudyMirror
+    from nexson import LazyStudy
+    from nexson import STUDY_TREE_WRITERS
+    from crawler import StudyStore
+    from jsonstream import iter_array_items
+    from jsonstream import project_fields
+    from recording import RecordingStore
+
+class IdIndex(object):
+    """
+    A two-way mapping between node ids and ott ids, populated from the
+    node id/ott id pairs found in service responses. The ids known to have
+    no counterpart (node ids without an ott id, ott ids not in the graph)
+    are also remembered, in memory only, in `missing`.
+    """
+
+    ID_PAIR_FIELDS = (
+            ("node_id", "ott_id"),
+            ("node_id", "ot:ottId"),
+            ("mrca_node_id", "ott_id"),
+            ("nearest_taxon_mrca_node_id", "nearest_taxon_mrca_ott_id"),
+            ("matched_node_id", "ot:ottId"),
+            )
+
+    def __init__(self):
+        self.node_id_to_ott_id = {}
+        self.ott_id_to_node_id = {}
+        self.missing = {"node_id": set(), "ott_id": set()}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.node_id_to_ott_id)
+
+    def add(self, node_id, ott_id):
+        node_id = int(node_id)
+        ott_id = int(ott_id)
+        with self._lock:
+            self.node_id_to_ott_id[node_id] = ott_id
+            self.ott_id_to_node_id[ott_id] = node_id
+            self.missing["node_id"].discard(node_id)
+            self.missing["ott_id"].discard(ott_id)
+
+    def add_missing(self, id_field, i):
+        """
+        Record that the id `i` (a "node_id" or an "ott_id", according to
+        `id_field`) has no counterpart.
+        """
+        with self._lock:
+            self.missing[id_field].add(int(i))
+
+    def harvest(self, response):
+        """
+        Add all node id/ott id pairs found in (the dictionaries nested in)
+        `response`, a parsed JSON response.
+        """
+        to_visit = [response]
+        while to_visit:
+            item = to_visit.pop()
+            if isinstance(item, dict):
+                for node_id_field, ott_id_field in IdIndex.ID_PAIR_FIELDS:
+                    node_id = item.get(node_id_field, None)
+                    ott_id = item.get(ott_id_field, None)
+                    if node_id is not None and ott_id is not None:
+                        self.add(node_id, ott_id)
+                to_visit.extend(value for value in item.values() if isinstance(value, (dict, list)))
+            elif isinstance(item, list):
+                to_visit.extend(value for value in item if isinstance(value, (dict, list)))
+
+    def save(self, path):
+        """
+        Write the index to `path` in a compact binary format: the node ids
+        followed by the corresponding ott ids, as little-endian 32-bit
+        integers.
+        """
+        with self._lock:
+            node_ids = array("i", self.node_id_to_ott_id.keys())
+            ott_ids = array("i", self.node_id_to_ott_id.values())
+        if sys.byteorder != "little":
+            node_ids.byteswap()
+            ott_ids.byteswap()
+        with open(path, "wb") as dest:
+            node_ids.tofile(dest)
+            ott_ids.tofile(dest)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Return an index read from a file written by :meth:`save()`.
+        """
+        with open(path, "rb") as src:
+            data = src.read()
+        ids = array("i")
+        if sys.hexversion < 0x03000000:
+            ids.fromstring(data)
+        else:
+            ids.frombytes(data)
+        if sys.byteorder != "little":
+            ids.byteswap()
+        num_pairs = len(ids) // 2
+        index = cls()
+        index.node_id_to_ott_id = dict(zip(ids[:num_pairs], ids[num_pairs:]))
+        index.ott_id_to_node_id = dict(zip(ids[num_pairs:], ids[:num_pairs]))
+        return index
 
 class OpenTreeService(object):
 
@@ -29,16 +155,44 @@ class OpenTreeService(object):
             "json"   : ".json",
             }
 
+    DEFAULT_MAX_WORKERS = 8
+    DEFAULT_SUBTREE_TIP_BUDGET = 25000
+    STUDY_CACHE_MEMORY_SIZE = 8
+    OTU_INDEX_MEMORY_SIZE = 256
+    ID_PAIR_SUB_URLS = frozenset([
+            '/tree_of_life/mrca',
+            '/graph/node_info',
+            '/tnrs/match_names',
+            '/taxonomy/lica',
+            '/taxonomy/taxon',
+            ])
+
     class OpenTreeError(Exception):
         pass
 
-    def __init__(self, base_url=None):
+    def __init__(self, base_url=None, max_workers=None):
         if base_url is None:
             # self.base_url = 'http://devapi.opentreeoflife.org/v2'
             self.base_url = 'http://api.opentreeoflife.org/v2'
         else:
             self.base_url = base_url
+        if max_workers is None:
+            self.max_workers = OpenTreeService.DEFAULT_MAX_WORKERS
+        else:
+            self.max_workers = max_workers
         self.is_testing_mode = False
+        self.synthetic_tree_index = None
+        self.subtree_tip_budget = OpenTreeService.DEFAULT_SUBTREE_TIP_BUDGET
+        self.id_index = IdIndex()
+        self.source_tree_cache = None
+        self.study_mirror = None
+        self.study_cache = None
+        self._cached_studies = OrderedDict()
+        self._cached_studies_lock = threading.Lock()
+        self._otu_indexes = OrderedDict()
+        self._otu_indexes_lock = threading.Lock()
+        self.recording_store = None
+        self.recording_mode = None
 
     def otl_format_specifier_extension(self, schema):
         schema = schema.lower()
@@ -46,36 +200,82 @@ class OpenTreeService(object):
 
     def open_url(self, request):
         """
-        Override this to provide custom added functionality, to, e.g. cache the
-        requests. Signature and return is the same as Python's standard
-        library's `urlopen`.
+        Send `request` and return the response. Signature and return is the
+        same as Python's standard library's `urlopen`, which is used unless a
+        recording store is in use (see :meth:`use_recording_store()`).
+        Override this to provide custom added functionality, e.g., to route
+        requests through a proxy.
 
         Example
         -------
 
-        The following shows how you might want to use a special class that
-        caches the calls to the server using VCRpy.
+        The following records every response of the server on the first run,
+        and replays them, without network access, on subsequent runs:
 
-            import vcr
             import pyopentree
-            class CachedOpenTreeService(pyopentree.OpenTreeService):
-                def __init__(self, *args, **kwargs):
-                    self.cache_path = kwargs.pop("cache_path",
-                            ".opentree.cache.yaml")
-                    pyopentree.OpenTreeService.__init__(self, *args, **kwargs)
-                def open_url(self, request):
-                    with vcr.use_cassette(self.cache_path):
-                        return pyopentree.OpenTreeService.open_url(self, request)
+            service = pyopentree.OpenTreeService()
+            service.use_recording_store(".opentree.recordings", mode="auto")
 
         """
+        if self.recording_store is not None:
+            return self.recording_store.open_url(
+                    request,
+                    self.base_url,
+                    urlopen,
+                    mode=self.recording_mode)
         return urlopen(request)
 
-    def request(self,
+    def use_recording_store(self, path, mode="replay"):
+        """
+        Serve requests through a :class:`RecordingStore` at `path`, in which
+        responses are kept compressed and indexed by their canonical request.
+        In "replay" mode, responses are served from the store only, and
+        requests that have not been recorded fail without reaching the
+        network; in "record" mode, every request is sent and its response
+        recorded; in "auto" mode, recorded responses are replayed and the
+        others recorded.
+        """
+        if mode not in ("replay", "record", "auto"):
+            raise ValueError("Recording mode '{}' is not supported".format(mode))
+        self.recording_store = RecordingStore(path)
+        self.recording_mode = mode
+        return self.recording_store
+
+    def map_concurrently(self, fn, items, max_workers=None):
+        """
+        Return `[fn(item) for item in items]`, with the calls distributed over
+        a pool of up to `max_workers` threads (defaults to `self.max_workers`).
+        Used by the bulk methods to overlap network round trips. The first
+        exception raised by `fn` is propagated.
+        """
+        items = list(items)
+        if max_workers is None:
+            max_workers = self.max_workers
+        max_workers = min(max_workers, len(items))
+        if max_workers <= 1:
+            return [fn(item) for item in items]
+        pool = ThreadPool(max_workers)
+        try:
+            return pool.map(fn, items, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+    def load_synthetic_tree_index(self, path):
+        """
+        Load a local copy of (part of) the synthetic tree, in NEWICK format
+        with ott ids embedded in the labels (as returned by `tol_subtree`), and
+        use it to answer topological queries (e.g., `tol_mrca_many`) locally
+        where possible.
+        """
+        self.synthetic_tree_index = SyntheticTreeIndex.from_path(path)
+        return self.synthetic_tree_index
+
+    def build_request(self,
             sub_url,
             payload=None,
             headers=None,
             protocol="POST",
-            process_response_as="json",
             ):
         if headers is None:
             headers = {'content-type': 'application/json'}
@@ -86,22 +286,77 @@ class OpenTreeService(object):
             data = json.dumps(payload).encode("utf-8")
         else:
             data = None
-        request = Request(
+        return Request(
                 url=url,
                 data=data,
                 headers=headers)
+
+    def request(self,
+            sub_url,
+            payload=None,
+            headers=None,
+            protocol="POST",
+            process_response_as="json",
+            ):
+        request = self.build_request(
+                sub_url,
+                payload=payload,
+                headers=headers,
+                protocol=protocol)
         response = self.open_url(request)
-        response_contents = response.read().decode(OpenTreeService.ENCODING)
+        response_contents = response.read()
+        if process_response_as == "raw":
+            return response_contents
+        response_contents = response_contents.decode(OpenTreeService.ENCODING)
         if process_response_as == "json":
             response_contents = json.loads(response_contents)
             if 'error' in response_contents and not self.is_testing_mode:
                 raise OpenTreeService.OpenTreeError(response_contents['error'])
+            if sub_url in OpenTreeService.ID_PAIR_SUB_URLS:
+                self.id_index.harvest(response_contents)
         elif process_response_as == "text":
             pass
         else:
             raise ValueError("Response type '{}' is not supported".format(process_response_as))
         return response_contents
 
+    def request_conditionally(self,
+            sub_url,
+            etag=None,
+            last_modified=None,
+            ):
+        """
+        Issue a conditional GET request for `sub_url`, i.e. one that only
+        returns the content if it differs from the version identified by the
+        validators `etag` and `last_modified` (as returned by a previous call).
+
+        Returns
+        -------
+        t : tuple
+            A tuple `(content, etag, last_modified)`, where `content` is the
+            raw bytes of the response, or `None` if the content has not been
+            modified (in which case the validators passed in are returned).
+        """
+        headers = {}
+        if etag is not None:
+            headers['If-None-Match'] = etag
+        if last_modified is not None:
+            headers['If-Modified-Since'] = last_modified
+        request = self.build_request(
+                sub_url,
+                headers=headers,
+                protocol="GET")
+        try:
+            response = self.open_url(request)
+        except HTTPError as e:
+            if e.code == 304:
+                return None, etag, last_modified
+            raise
+        info = response.info() if hasattr(response, "info") else {}
+        return (response.read(),
+                info.get('ETag', None),
+                info.get('Last-Modified', None))
+
     def tol_about(self, study_list=True):
         """
         Return information about the current draft tree itself.
@@ -203,6 +458,72 @@ class OpenTreeService(object):
                 '/tree_of_life/mrca',
                 payload)
 
+    def tol_mrca_many(self, id_sets, max_workers=None):
+        """
+        Return the most recent common ancestors of many sets of nodes in the
+        draft tree.
+
+        Each set is canonicalized (duplicate ids removed, order ignored) and
+        each distinct set is resolved only once. Sets consisting only of ott
+        ids that are all present in `self.synthetic_tree_index` (see
+        `load_synthetic_tree_index`) are answered locally; the remainder are
+        sent to the server concurrently, one `tol_mrca` call per distinct set.
+
+        Parameters
+        ----------
+        id_sets : iterable
+            An iterable of sets of ids. Each set is either an iterable of ott
+            ids, or a dictionary with "ott_ids" and/or "node_ids" keys, as
+            taken by `tol_mrca`.
+        max_workers : integer
+            Maximum number of concurrent requests (defaults to
+            `self.max_workers`).
+
+        Returns
+        -------
+        results : list of dict
+            A list of `tol_mrca` results aligned with `id_sets`. Identical
+            sets share the same result dictionary. Results answered from the
+            local index do not know node ids, and report them as `None`. If
+            the server reports an error for a set (or the request for it
+            fails), its result is a dictionary with a single "error" field.
+        """
+        keys = []
+        for id_set in id_sets:
+            if isinstance(id_set, dict):
+                ott_ids = id_set.get("ott_ids", None) or ()
+                node_ids = id_set.get("node_ids", None) or ()
+            else:
+                ott_ids = id_set
+                node_ids = ()
+            key = (tuple(sorted(set(ott_ids))), tuple(sorted(set(node_ids))))
+            if not key[0] and not key[1]:
+                raise ValueError('Each id set must contain at least one ott id or node id.')
+            keys.append(key)
+        resolved = {}
+        index = self.synthetic_tree_index
+        remote_keys = []
+        for key in set(keys):
+            if index is not None and not key[1]:
+                result = index.mrca(key[0])
+                if result is not None:
+                    resolved[key] = result
+                    continue
+            remote_keys.append(key)
+        def resolve_remotely(key):
+            try:
+                return self.tol_mrca(
+                        ott_ids=list(key[0]) or None,
+                        node_ids=list(key[1]) or None)
+            except (OpenTreeService.OpenTreeError, HTTPError, URLError) as e:
+                return {'error': str(e)}
+        remote_results = self.map_concurrently(
+                resolve_remotely,
+                remote_keys,
+                max_workers=max_workers)
+        resolved.update(zip(remote_keys, remote_results))
+        return [resolved[key] for key in keys]
+
     def tol_subtree(
             self,
             ott_id=None,
@@ -254,6 +575,137 @@ class OpenTreeService(object):
                 payload=payload)
         return result
 
+    def estimate_subtree_size(
+            self,
+            ott_id=None,
+            node_id=None):
+        """
+        Return the number of tips in the draft tree descended from a given
+        node, without fetching the subtree.
+
+        The count is taken from `self.synthetic_tree_index` if the node is
+        present in it, and from the "num_tips" field of `gol_node_info`
+        otherwise.
+
+        Parameters
+        ----------
+        ott_id : integer
+            An ott id. If `ott_id` is not specified, then `node_id` must specified,
+            and vice versa. Both cannot be specified.
+        node_id : integer
+            A node id. If `node_id` is not specified, then `ott_id` must specified,
+            and vice versa. Both cannot be specified.
+
+        Returns
+        -------
+        n : integer
+            The number of tips descended from the node.
+        """
+        if ott_id is not None and self.synthetic_tree_index is not None:
+            num_tips = self.synthetic_tree_index.num_tips(ott_id)
+            if num_tips is not None:
+                return num_tips
+        node_info = self.gol_node_info(ott_id=ott_id, node_id=node_id)
+        return node_info["num_tips"]
+
+    def tol_subtree_partitioned(
+            self,
+            ott_id=None,
+            node_id=None,
+            max_tips=None,
+            max_workers=None):
+        """
+        Return the complete subtree below a given node, splitting the request
+        into several smaller ones if the subtree is too large for the server
+        to return in one piece.
+
+        The size of the subtree is estimated up front using
+        `estimate_subtree_size`. If it is within `max_tips`, this is the same
+        as calling `tol_subtree`. Otherwise, the topology of
+        `self.synthetic_tree_index` is used to find the largest named clades
+        below the node that are within `max_tips`; these are fetched
+        concurrently with `tol_subtree` and grafted back onto the backbone
+        from the index to assemble the complete subtree. Tips of the
+        backbone (such as those of a large polytomy) are written from the
+        index, without a request.
+
+        Parameters
+        ----------
+        ott_id : integer
+            An ott id. If `ott_id` is not specified, then `node_id` must specified,
+            and vice versa. Both cannot be specified.
+        node_id : integer
+            A node id. If `node_id` is not specified, then `ott_id` must specified,
+            and vice versa. Both cannot be specified.
+        max_tips : integer
+            The maximum number of tips to request in a single call (defaults
+            to `self.subtree_tip_budget`).
+        max_workers : integer
+            Maximum number of concurrent requests (defaults to
+            `self.max_workers`).
+
+        Returns
+        -------
+        d : dict
+            A python dictionary with the following fields:
+
+                "newick"
+                "tree_id"
+                "num_requests"
+        """
+        if ott_id is None and node_id is None:
+            raise ValueError('Must specify ott_id or node_id but not both.')
+        if max_tips is None:
+            max_tips = self.subtree_tip_budget
+        num_tips = self.estimate_subtree_size(ott_id=ott_id, node_id=node_id)
+        if num_tips <= max_tips:
+            result = self.tol_subtree(ott_id=ott_id, node_id=node_id)
+            result["num_requests"] = 1
+            return result
+        index = self.synthetic_tree_index
+        root = None
+        if index is not None:
+            if ott_id is None:
+                # known from the response to `estimate_subtree_size`
+                ott_id = self.node_ids_to_ott_ids([node_id])[int(node_id)]
+            if ott_id is not None:
+                root = index.node_index(ott_id)
+        if root is None:
+            raise OpenTreeService.OpenTreeError(
+                    "Subtree has {} tips, which exceeds the budget of {}, and the node is not in the synthetic tree index needed to partition it".format(
+                        num_tips, max_tips))
+        tip_counts = index.cached_tip_counts()
+        partition_roots = []
+        to_visit = [root]
+        while to_visit:
+            idx = to_visit.pop()
+            if index.is_leaf(idx):
+                continue
+            if tip_counts[idx] <= max_tips and index.node_ott_ids[idx] != -1:
+                partition_roots.append(idx)
+            else:
+                to_visit.extend(index.children(idx))
+        def fetch_partition(idx):
+            return self.tol_subtree(ott_id=index.node_ott_ids[idx])
+        partitions = self.map_concurrently(
+                fetch_partition,
+                partition_roots,
+                max_workers=max_workers)
+        substitutions = {}
+        tree_id = None
+        for idx, partition in zip(partition_roots, partitions):
+            substitutions[idx] = partition["newick"].strip().rstrip(";")
+            tree_id = partition.get("tree_id", tree_id)
+        newick = index.as_newick(
+                root=root,
+                suppress_edge_lengths=True,
+                substitutions=substitutions)
+        return {
+                "newick": newick,
+                "tree_id": tree_id,
+                "num_requests": len(partition_roots),
+                }
+
     def tol_induced_subtree(
             self,
             ott_ids=None,
@@ -379,6 +831,11 @@ class OpenTreeService(object):
 
                 "newick"
         """
+        cache = self.source_tree_cache
+        if cache is not None and git_sha:
+            result = cache.get(study_id, tree_id, git_sha, schema)
+            if result is not None:
+                return result
         payload = {
                 'study_id': study_id,
                 'tree_id': tree_id,
@@ -387,8 +844,72 @@ class OpenTreeService(object):
         result = self.request(
                 '/graph/source_tree',
                 payload=payload)
+        if cache is not None and git_sha and 'error' not in result:
+            cache.put(study_id, tree_id, git_sha, schema, result)
         return result
 
+    def use_source_tree_cache(self, path):
+        """
+        Cache the results of `gol_source_tree` permanently in a
+        :class:`SourceTreeCache` at `path`. A source tree requested with a
+        git SHA can never change, so once cached it is never downloaded
+        again.
+        """
+        self.source_tree_cache = SourceTreeCache(path)
+        return self.source_tree_cache
+
+    def prefetch_source_trees(self, study_list=None, max_workers=None):
+        """
+        Download every source tree of the current draft tree into
+        `self.source_tree_cache`, concurrently.
+
+        Parameters
+        ----------
+        study_list : list of dict
+            The source trees to fetch, as listed in the "study_list" field of
+            `tol_about(study_list=True)`. If not given, the list is
+            requested from the server.
+        max_workers : integer
+            Maximum number of concurrent requests (defaults to
+            `self.max_workers`).
+
+        Returns
+        -------
+        d : dict
+            A python dictionary with the following fields:
+
+                "num_source_trees"
+                "num_cached"
+                "num_fetched"
+                "failed"
+        """
+        cache = self.source_tree_cache
+        if cache is None:
+            raise ValueError("Prefetching source trees requires a source tree cache: see 'use_source_tree_cache()'")
+        if study_list is None:
+            study_list = self.tol_about(study_list=True)["study_list"]
+        to_fetch = []
+        for source in study_list:
+            key = cache.key(source["study_id"], source["tree_id"], source["git_sha"])
+            if key not in cache:
+                to_fetch.append(source)
+        def fetch(source):
+            try:
+                self.gol_source_tree(
+                        study_id=source["study_id"],
+                        tree_id=source["tree_id"],
+                        git_sha=source["git_sha"])
+            except (OpenTreeService.OpenTreeError, HTTPError, URLError):
+                return False
+            return True
+        fetched = self.map_concurrently(fetch, to_fetch, max_workers=max_workers)
+        return {
+                "num_source_trees": len(study_list),
+                "num_cached": len(study_list) - len(to_fetch),
+                "num_fetched": sum(fetched),
+                "failed": [source for source, ok in zip(to_fetch, fetched) if not ok],
+                }
+
     def gol_node_info(
             self,
             ott_id=None,
@@ -450,6 +971,139 @@ class OpenTreeService(object):
                 payload=payload)
         return result
 
+    def gol_node_info_many(
+            self,
+            node_ids=None,
+            ott_ids=None,
+            include_lineage=True,
+            max_workers=None):
+        """
+        Get information about many nodes in the graph of life.
+
+        Calls `gol_node_info` for each node concurrently. The (typically
+        heavily overlapping) lineages are merged into a single node table as
+        the responses arrive, so that each distinct ancestor is held in memory
+        only once, and the per-node results are kept as lightweight records.
+
+        Parameters
+        ----------
+        node_ids : iterable of integers
+            An iterable of node ids.
+        ott_ids : iterable of integers
+            An iterable of ott ids.
+        include_lineage : bool
+            Include the ancestral lineages of the nodes in the draft tree.
+        max_workers : integer
+            Maximum number of concurrent requests (defaults to
+            `self.max_workers`).
+
+        Returns
+        -------
+        batch : :class:`NodeInfoBatch`
+            The results, with one record per requested node: first those for
+            `node_ids`, then those for `ott_ids`, each in the order given.
+            Use :meth:`NodeInfoBatch.lineage()` to get the lineage of a
+            record.
+        """
+        queries = []
+        if node_ids is not None:
+            queries.extend(("node_id", node_id) for node_id in node_ids)
+        if ott_ids is not None:
+            queries.extend(("ott_id", ott_id) for ott_id in ott_ids)
+        batch = NodeInfoBatch(len(queries))
+        def fetch(position):
+            id_field, id_value = queries[position]
+            try:
+                response = self.gol_node_info(
+                        include_lineage=include_lineage,
+                        **{id_field: id_value})
+            except (OpenTreeService.OpenTreeError, HTTPError, URLError) as e:
+                batch.errors[position] = str(e)
+                return
+            if 'error' in response:
+                batch.errors[position] = response['error']
+                return
+            batch.add_response(position, response)
+        self.map_concurrently(fetch, range(len(queries)), max_workers=max_workers)
+        return batch
+
+    def ott_ids_to_node_ids(self, ott_ids, max_workers=None):
+        """
+        Return the draft tree node ids corresponding to many ott ids.
+
+        Ids already known to `self.id_index` (which is populated from the
+        responses of all previous calls) are answered locally; the rest are
+        looked up concurrently with `gol_node_info`.
+
+        Parameters
+        ----------
+        ott_ids : iterable of integers
+            An iterable of ott ids.
+        max_workers : integer
+            Maximum number of concurrent requests (defaults to
+            `self.max_workers`).
+
+        Returns
+        -------
+        d : dict
+            A python dictionary mapping each ott id to its node id, or to
+            `None` if it is not in the graph.
+        """
+        return self._map_ids(
+                ids=ott_ids,
+                known_ids=self.id_index.ott_id_to_node_id,
+                id_field="ott_id",
+                max_workers=max_workers)
+
+    def node_ids_to_ott_ids(self, node_ids, max_workers=None):
+        """
+        Return the ott ids corresponding to many draft tree node ids.
+
+        Ids already known to `self.id_index` (which is populated from the
+        responses of all previous calls) are answered locally; the rest are
+        looked up concurrently with `gol_node_info`.
+
+        Parameters
+        ----------
+        node_ids : iterable of integers
+            An iterable of node ids.
+        max_workers : integer
+            Maximum number of concurrent requests (defaults to
+            `self.max_workers`).
+
+        Returns
+        -------
+        d : dict
+            A python dictionary mapping each node id to its ott id, or to
+            `None` if it is not in the graph or does not correspond to a taxon.
+        """
+        return self._map_ids(
+                ids=node_ids,
+                known_ids=self.id_index.node_id_to_ott_id,
+                id_field="node_id",
+                max_workers=max_workers)
+
+    def _map_ids(self, ids, known_ids, id_field, max_workers):
+        ids = [int(i) for i in ids]
+        missing_ids = self.id_index.missing[id_field]
+        unknown_ids = list(set(i for i in ids if i not in known_ids and i not in missing_ids))
+        def look_up(i):
+            try:
+                self.gol_node_info(**{id_field: i})
+            except OpenTreeService.OpenTreeError:
+                pass
+            except HTTPError as e:
+                # only client errors say the id does not exist
+                if not 400 <= e.code < 500:
+                    return
+            except URLError:
+                # nor does a failure to reach the server
+                return
+            if i not in known_ids:
+                self.id_index.add_missing(id_field, i)
+        self.map_concurrently(look_up, unknown_ids, max_workers=max_workers)
+        return dict((i, known_ids.get(i, None)) for i in ids)
+
     def tnrs_match_names(
             self,
             names,
@@ -746,6 +1400,10 @@ class OpenTreeService(object):
         Perform a simple search for indexed studies. To find all studies, omit both
         the property and the value from your query.
 
+        If a local mirror of the study metadata is in use (see
+        `use_study_mirror`), the search is done locally, and searching on a
+        property that is not searchable raises `ValueError`.
+
         Wraps::
 
             curl -X POST http://devapi.opentreeoflife.org/v2/studies/find_studies -H "content-type:application/json" -d '{"property":"ot:studyId","value":"pg_719","verbose":true}'
@@ -777,7 +1435,13 @@ class OpenTreeService(object):
 
                 "matched_studies"
         """
-        payload = {"exact" : exact}
+        if self.study_mirror is not None:
+            return self.study_mirror.find_studies(
+                    property_name=property_name,
+                    property_value=property_value,
+                    exact=exact,
+                    verbose=verbose)
+        payload = {"exact" : exact, "verbose" : verbose}
         if property_name is None or property_value is None:
             if property_name is not None:
                 raise ValueError("If 'property_name' is specified, 'property_value' must be specified as well")
@@ -803,6 +1467,10 @@ class OpenTreeService(object):
 
         Perform a simple search for trees in indexed studies.
 
+        If a local mirror of the study metadata is in use (see
+        `use_study_mirror`), the search is done locally, and searching on a
+        property that is not searchable raises `ValueError`.
+
         Wraps::
 
             curl -X POST http://devapi.opentreeoflife.org/v2/studies/find_trees -H "content-type:application/json" -d '{"property":"ot:ottTaxonName","value":"Garcinia"}'
@@ -831,8 +1499,15 @@ class OpenTreeService(object):
 
                 "matched_studies"
         """
+        if self.study_mirror is not None:
+            return self.study_mirror.find_trees(
+                    property_name=property_name,
+                    property_value=property_value,
+                    exact=exact,
+                    verbose=verbose)
         payload = {
                 "exact" : exact,
+                "verbose" : verbose,
                 "property": property_name,
                 "value": property_value, }
         result = self.request(
@@ -840,12 +1515,158 @@ class OpenTreeService(object):
             payload=payload)
         return result
 
+    def iter_request_array(self,
+            sub_url,
+            key,
+            payload=None):
+        """
+        Issue a POST request for `sub_url`, and yield the items of the array
+        `key` of the JSON response one at a time, as they are parsed from the
+        response stream. The connection is closed when the generator is
+        exhausted or discarded.
+        """
+        request = self.build_request(sub_url, payload=payload)
+        response = self.open_url(request)
+        other_members = {}
+        try:
+            for item in iter_array_items(response, key, other_members=other_members):
+                yield item
+        finally:
+            if hasattr(response, "close"):
+                response.close()
+        if 'error' in other_members and not self.is_testing_mode:
+            raise OpenTreeService.OpenTreeError(other_members['error'])
+
+    def iter_studies_find_studies(
+            self,
+            property_name=None,
+            property_value=None,
+            exact=False,
+            verbose=False,
+            fields=None,
+            start=0,
+            limit=None):
+        """
+        Iterate over the studies matched by :meth:`studies_find_studies()`,
+        yielding each study record as it is parsed from the response, rather
+        than building the complete list first.
+
+        The server does not page its results, so `start` and `limit` select
+        a window of the matched studies on the client side; the response
+        stream is abandoned as soon as `limit` studies have been yielded.
+
+        Parameters
+        ----------
+        fields : iterable of strings
+            If given, only these properties (and "ot:studyId") are retained in
+            each study record.
+        start : int
+            The (0-based) position of the first study to yield.
+        limit : int
+            The maximum number of studies to yield (defaults to all).
+        """
+        if self.study_mirror is not None:
+            records = iter(self.study_mirror.find_studies(
+                    property_name=property_name,
+                    property_value=property_value,
+                    exact=exact,
+                    verbose=verbose)["matched_studies"])
+        else:
+            payload = {"exact" : exact, "verbose" : verbose}
+            if property_name is None or property_value is None:
+                if property_name is not None:
+                    raise ValueError("If 'property_name' is specified, 'property_value' must be specified as well")
+                if property_value is not None:
+                    raise ValueError("If 'property_value' is specified, 'property_name' must be specified as well")
+            else:
+                payload["property"] = property_name
+                payload["value"] = property_value
+            records = self.iter_request_array(
+                    '/studies/find_studies',
+                    "matched_studies",
+                    payload=payload)
+        if fields is not None:
+            fields = frozenset(fields)
+        for record in _islice(records, start, limit):
+            yield project_fields(record, fields, keep=("ot:studyId",))
+
+    def iter_studies_find_trees(
+            self,
+            property_name,
+            property_value,
+            exact=False,
+            verbose=False,
+            fields=None,
+            start=0,
+            limit=None):
+        """
+        Iterate over the studies matched by :meth:`studies_find_trees()`,
+        yielding each study record (with its "matched_trees") as it is parsed
+        from the response, rather than building the complete list first.
+
+        `start` and `limit` select a window of the matched studies on the
+        client side, as for :meth:`iter_studies_find_studies()`. If `fields`
+        is given, only these properties are retained in each study and tree
+        record (together with "ot:studyId", "matched_trees", "nexson_id" and
+        "oti_tree_id").
+        """
+        if self.study_mirror is not None:
+            records = iter(self.study_mirror.find_trees(
+                    property_name=property_name,
+                    property_value=property_value,
+                    exact=exact,
+                    verbose=verbose)["matched_studies"])
+        else:
+            payload = {
+                    "exact" : exact,
+                    "verbose" : verbose,
+                    "property": property_name,
+                    "value": property_value, }
+            records = self.iter_request_array(
+                    '/studies/find_trees',
+                    "matched_studies",
+                    payload=payload)
+        if fields is not None:
+            fields = frozenset(fields)
+        for record in _islice(records, start, limit):
+            record = project_fields(record, fields, keep=("ot:studyId", "matched_trees"))
+            if fields is not None and "matched_trees" in record:
+                record["matched_trees"] = [
+                        project_fields(tree, fields, keep=("nexson_id", "oti_tree_id"))
+                        for tree in record["matched_trees"]]
+            yield record
+
+    def use_study_mirror(self, path, sync=False, include_otus=False):
+        """
+        Answer `studies_find_studies` and `studies_find_trees` from a local
+        :class:`StudyMirror` database at `path` instead of the server.
+
+        Parameters
+        ----------
+        path : string
+            Path to the SQLite database of the mirror (created if needed).
+        sync : bool
+            Whether to bring the mirror up to date with the server first.
+        include_otus : bool
+            If syncing, whether to also index the taxa in each tree, which
+            requires downloading complete studies.
+        """
+        mirror = StudyMirror(path)
+        if sync:
+            mirror.sync(self, include_otus=include_otus)
+        self.study_mirror = mirror
+        return mirror
+
     def studies_properties(self):
         """
         Return a list of properties that can be used to search studies and trees.
 
         Get a list of properties that can be used to search for studies and trees.
 
+        If a local mirror of the study metadata is in use (see
+        `use_study_mirror`), the properties listed at its last sync are
+        returned.
+
         Wraps::
 
             curl -X POST http://devapi.opentreeoflife.org/v2/studies/properties
@@ -858,11 +1679,100 @@ class OpenTreeService(object):
                 "tree_properties"
                 "study_properties"
         """
+        if self.study_mirror is not None:
+            return self.study_mirror.properties()
         result = self.request('/studies/properties')
         return result
 
-    def get_study(self, study_id):
-        result = self.request('/study/{STUDY_ID}'.format(STUDY_ID=study_id),
+    def use_study_cache(self, path):
+        """
+        Keep the NexSON of every study requested with `get_study`,
+        `get_study_tree` or `get_study_subtree` in a :class:`StudyStore` at
+        `path` (which may be the "studies" directory of a
+        :class:`StudyCrawler`). Each study is then downloaded only once: trees
+        and subtrees are rendered locally, in any schema, from the stored
+        NexSON.
+        """
+        self.study_cache = StudyStore(path)
+        with self._cached_studies_lock:
+            self._cached_studies.clear()
+        return self.study_cache
+
+    def cached_study(self, study_id):
+        """
+        Return the study as a :class:`LazyStudy`, read from the study cache
+        (see :meth:`use_study_cache()`), and downloaded into it first if it is
+        not there yet. The most recently used studies are also kept in
+        memory.
+        """
+        with self._cached_studies_lock:
+            study = self._cached_studies.pop(study_id, None)
+            if study is not None:
+                self._cached_studies[study_id] = study
+                return study
+        data = self.study_cache.get_bytes(study_id)
+        if data is None:
+            data = self.request('/study/{STUDY_ID}'.format(STUDY_ID=study_id),
+                    protocol="GET",
+                    process_response_as="raw")
+            study = self._lazy_study(data)
+            self.study_cache.put(study_id, data)
+        else:
+            study = LazyStudy(data)
+        with self._cached_studies_lock:
+            self._cached_studies[study_id] = study
+            while len(self._cached_studies) > OpenTreeService.STUDY_CACHE_MEMORY_SIZE:
+                self._cached_studies.popitem(last=False)
+        return study
+
+    def _lazy_study(self, raw):
+        """
+        Return the study `raw` (a raw response) as a :class:`LazyStudy`,
+        raising :class:`OpenTreeService.OpenTreeError` if it is an error
+        document instead, as :meth:`request()` does.
+        """
+        try:
+            return LazyStudy(raw)
+        except ValueError:
+            response = json.loads(raw.decode(OpenTreeService.ENCODING))
+            if not isinstance(response, dict) or 'error' not in response:
+                raise
+            raise OpenTreeService.OpenTreeError(response['error'])
+
+    def _render_cached_study_tree(self, study_id, tree_id, subtree_id, schema):
+        writer = STUDY_TREE_WRITERS[schema]
+        study = self.cached_study(study_id)
+        try:
+            return writer(study, tree_id, subtree_id)
+        except (KeyError, ValueError) as e:
+            # a missing tree or node, as the server would report it
+            raise OpenTreeService.OpenTreeError("Study '{}': {}".format(study_id, e.args[0] if e.args else e))
+
+    def get_study(self, study_id, lazy=False):
+        """
+        Return the NexSON of a study.
+
+        If `lazy` is `True`, a :class:`LazyStudy` is returned instead of the
+        parsed dictionary: it keeps the raw response and parses the metadata,
+        OTUs and individual trees of the study only when they are accessed.
+        """
+        if self.study_cache is not None:
+            study = self.cached_study(study_id)
+            if lazy:
+                return study
+            return study.as_dict()
+        sub_url = '/study/{STUDY_ID}'.format(STUDY_ID=study_id)
+        if lazy:
+            raw = self.request(sub_url,
+                protocol="GET",
+                process_response_as="raw")
+            try:
+                return self._lazy_study(raw)
+            except OpenTreeService.OpenTreeError:
+                if self.is_testing_mode:
+                    return json.loads(raw.decode(OpenTreeService.ENCODING))
+                raise
+        result = self.request(sub_url,
                 protocol="GET")
         return result
 
@@ -871,7 +1781,16 @@ class OpenTreeService(object):
             study_id,
             tree_id,
             schema="nexson"):
+        """
+        Return a tree of a study in the given schema ("nexson", "json",
+        "newick", "nexus" or "nexml").
+
+        If a study cache is in use (see :meth:`use_study_cache()`), the tree
+        is rendered locally from the cached NexSON of the study.
+        """
         schema = schema.lower()
+        if self.study_cache is not None:
+            return self._render_cached_study_tree(study_id, tree_id, None, schema)
         payload = {
             "STUDY_ID": study_id,
             "TREE_ID": tree_id,
@@ -904,7 +1823,17 @@ class OpenTreeService(object):
             tree_id,
             subtree_id,
             schema="nexson"):
+        """
+        Return the subtree of a tree of a study descended from the node
+        `subtree_id` (or from the ingroup node, if `subtree_id` is
+        "ingroup"), in the given schema.
+
+        If a study cache is in use (see :meth:`use_study_cache()`), the
+        subtree is extracted locally from the cached NexSON of the study.
+        """
         schema = schema.lower()
+        if self.study_cache is not None:
+            return self._render_cached_study_tree(study_id, tree_id, subtree_id, schema)
         payload = {
             "STUDY_ID": study_id,
             "TREE_ID": tree_id,
@@ -958,6 +1887,82 @@ class OpenTreeService(object):
             raise OpenTreeService.OpenTreeError(e)
         return result
 
+    def study_otu_index(self, study_id):
+        """
+        Return an :class:`OtuIndex` of the OTUs of the study, built from its
+        NexSON (fetched through the study cache, if in use) the first time
+        it is requested. The indexes of the most recently used studies are
+        kept in memory.
+        """
+        with self._otu_indexes_lock:
+            otu_index = self._otu_indexes.pop(study_id, None)
+            if otu_index is not None:
+                self._otu_indexes[study_id] = otu_index
+                return otu_index
+        study = self.get_study(study_id, lazy=True)
+        if isinstance(study, dict):
+            # an error document, returned as such in testing mode
+            raise OpenTreeService.OpenTreeError(study.get('error', "Study '{}' could not be parsed".format(study_id)))
+        otu_index = study.otu_index
+        with self._otu_indexes_lock:
+            self._otu_indexes[study_id] = otu_index
+            while len(self._otu_indexes) > OpenTreeService.OTU_INDEX_MEMORY_SIZE:
+                self._otu_indexes.popitem(last=False)
+        return otu_index
+
+    def lookup_study_otus_by_label(self, queries, ignore_case=False, max_workers=None):
+        """
+        Look up OTUs by label in many studies at once.
+
+        The OTU indexes of all the studies involved that are not yet loaded
+        are built concurrently (see :meth:`study_otu_index()`); every lookup
+        is then answered locally.
+
+        Parameters
+        ----------
+        queries : iterable of tuples
+            `(study_id, label)` pairs.
+        ignore_case : bool
+            Whether to match labels case-insensitively.
+
+        Returns
+        -------
+        l : list
+            For each query, the list of matching :class:`Otu` objects (empty if
+            there are none). If the study of a query cannot be loaded (e.g.,
+            it does not exist, or the request for it fails), the result of the
+            query is a dictionary with a single "error" field.
+        """
+        queries = list(queries)
+        otu_indexes = self._load_otu_indexes((study_id for study_id, label in queries), max_workers=max_workers)
+        return [_lookup_otus(otu_indexes[study_id], "lookup_label", label, ignore_case=ignore_case)
+                for study_id, label in queries]
+
+    def lookup_study_otus_by_ott_id(self, queries, max_workers=None):
+        """
+        Look up OTUs by the ott id they are mapped to in many studies at
+        once. `queries` is an iterable of `(study_id, ott_id)` pairs; see
+        :meth:`lookup_study_otus_by_label()`.
+        """
+        queries = [(study_id, int(ott_id)) for study_id, ott_id in queries]
+        otu_indexes = self._load_otu_indexes((study_id for study_id, ott_id in queries), max_workers=max_workers)
+        return [_lookup_otus(otu_indexes[study_id], "lookup_ott_id", ott_id)
+                for study_id, ott_id in queries]
+
+    def _load_otu_indexes(self, study_ids, max_workers=None):
+        """
+        Return a dictionary of the :class:`OtuIndex` of each of the studies,
+        or, for the studies that cannot be loaded, of a dictionary with a
+        single "error" field.
+        """
+        def load(study_id):
+            try:
+                return self.study_otu_index(study_id)
+            except (OpenTreeService.OpenTreeError, HTTPError, URLError, ValueError) as e:
+                return {'error': str(e)}
+        study_ids = sorted(set(study_ids))
+        return dict(zip(study_ids, self.map_concurrently(load, study_ids, max_workers=max_workers)))
+
     def get_study_otumap(self, study_id):
         payload = {
             "STUDY_ID": study_id,
@@ -968,6 +1973,16 @@ class OpenTreeService(object):
                 protocol="GET")
         return result
 
+def _lookup_otus(otu_index, method_name, *args, **kwargs):
+    if isinstance(otu_index, dict):
+        return dict(otu_index)
+    return getattr(otu_index, method_name)(*args, **kwargs)
+
+def _islice(iterable, start, limit):
+    if limit is None:
+        return itertools.islice(iterable, start, None)
+    return itertools.islice(iterable, start, start + limit)
+
 GLOBAL_OPEN_TREE_SERVICE = OpenTreeService(base_url=None)
 
 def tol_about(study_list=True):
@@ -987,6 +2002,14 @@ def tol_mrca(
             ott_ids=ott_ids,
             node_ids=node_ids)
 
+def tol_mrca_many(id_sets, max_workers=None):
+    """
+    Forwards to :meth:`OpenTreeService.tol_mrca_many()` of the global :class:`OpenTreeService` instance.
+    """
+    return GLOBAL_OPEN_TREE_SERVICE.tol_mrca_many(
+            id_sets=id_sets,
+            max_workers=max_workers)
+
 def tol_subtree(
         ott_id=None,
         node_id=None,
@@ -1000,6 +2023,32 @@ def tol_subtree(
             node_id=node_id,
             tree_id=tree_id)
 
+def estimate_subtree_size(
+        ott_id=None,
+        node_id=None,
+        ):
+    """
+    Forwards to :meth:`OpenTreeService.estimate_subtree_size()` of the global :class:`OpenTreeService` instance.
+    """
+    return GLOBAL_OPEN_TREE_SERVICE.estimate_subtree_size(
+            ott_id=ott_id,
+            node_id=node_id)
+
+def tol_subtree_partitioned(
+        ott_id=None,
+        node_id=None,
+        max_tips=None,
+        max_workers=None,
+        ):
+    """
+    Forwards to :meth:`OpenTreeService.tol_subtree_partitioned()` of the global :class:`OpenTreeService` instance.
+    """
+    return GLOBAL_OPEN_TREE_SERVICE.tol_subtree_partitioned(
+            ott_id=ott_id,
+            node_id=node_id,
+            max_tips=max_tips,
+            max_workers=max_workers)
+
 def tol_induced_subtree(
         ott_ids=None,
         node_ids=None,
@@ -1032,6 +2081,14 @@ def gol_source_tree(
             git_sha=git_sha,
             schema=schema)
 
+def prefetch_source_trees(study_list=None, max_workers=None):
+    """
+    Forwards to :meth:`OpenTreeService.prefetch_source_trees()` of the global :class:`OpenTreeService` instance.
+    """
+    return GLOBAL_OPEN_TREE_SERVICE.prefetch_source_trees(
+            study_list=study_list,
+            max_workers=max_workers)
+
 def gol_node_info(
         ott_id=None,
         node_id=None,
@@ -1045,6 +2102,37 @@ def gol_node_info(
             node_id=node_id,
             include_lineage=include_lineage)
 
+def gol_node_info_many(
+        node_ids=None,
+        ott_ids=None,
+        include_lineage=True,
+        max_workers=None,
+        ):
+    """
+    Forwards to :meth:`OpenTreeService.gol_node_info_many()` of the global :class:`OpenTreeService` instance.
+    """
+    return GLOBAL_OPEN_TREE_SERVICE.gol_node_info_many(
+            node_ids=node_ids,
+            ott_ids=ott_ids,
+            include_lineage=include_lineage,
+            max_workers=max_workers)
+
+def ott_ids_to_node_ids(ott_ids, max_workers=None):
+    """
+    Forwards to :meth:`OpenTreeService.ott_ids_to_node_ids()` of the global :class:`OpenTreeService` instance.
+    """
+    return GLOBAL_OPEN_TREE_SERVICE.ott_ids_to_node_ids(
+            ott_ids=ott_ids,
+            max_workers=max_workers)
+
+def node_ids_to_ott_ids(node_ids, max_workers=None):
+    """
+    Forwards to :meth:`OpenTreeService.node_ids_to_ott_ids()` of the global :class:`OpenTreeService` instance.
+    """
+    return GLOBAL_OPEN_TREE_SERVICE.node_ids_to_ott_ids(
+            node_ids=node_ids,
+            max_workers=max_workers)
+
 def tnrs_match_names(
         names,
         context_name=None,
@@ -1138,14 +2226,54 @@ def studies_find_trees(
             verbose=verbose,
             )
 
+def iter_studies_find_studies(
+        property_name=None,
+        property_value=None,
+        exact=False,
+        verbose=False,
+        fields=None,
+        start=0,
+        limit=None):
+    """
+    Forwards to :meth:`OpenTreeService.iter_studies_find_studies()` of the global :class:`OpenTreeService` instance.
+    """
+    return GLOBAL_OPEN_TREE_SERVICE.iter_studies_find_studies(
+            property_name=property_name,
+            property_value=property_value,
+            exact=exact,
+            verbose=verbose,
+            fields=fields,
+            start=start,
+            limit=limit)
+
+def iter_studies_find_trees(
+        property_name,
+        property_value,
+        exact=False,
+        verbose=False,
+        fields=None,
+        start=0,
+        limit=None):
+    """
+    Forwards to :meth:`OpenTreeService.iter_studies_find_trees()` of the global :class:`OpenTreeService` instance.
+    """
+    return GLOBAL_OPEN_TREE_SERVICE.iter_studies_find_trees(
+            property_name=property_name,
+            property_value=property_value,
+            exact=exact,
+            verbose=verbose,
+            fields=fields,
+            start=start,
+            limit=limit)
+
 def studies_properties():
     """
     Forwards to :meth:`OpenTreeService.studies_properties()` of the global :class:`OpenTreeService` instance.
     """
     return GLOBAL_OPEN_TREE_SERVICE.studies_properties()
 
-def get_study(study_id):
-    return GLOBAL_OPEN_TREE_SERVICE.get_study(study_id=study_id)
+def get_study(study_id, lazy=False):
+    return GLOBAL_OPEN_TREE_SERVICE.get_study(study_id=study_id, lazy=lazy)
 
 def get_study_tree(
         study_id,
@@ -1192,6 +2320,29 @@ def get_study_otus(
             otu_names=otu_names,
             )
 
+def study_otu_index(study_id):
+    """
+    Forwards to :meth:`OpenTreeService.study_otu_index()` of the global :class:`OpenTreeService` instance.
+    """
+    return GLOBAL_OPEN_TREE_SERVICE.study_otu_index(study_id=study_id)
+
+def lookup_study_otus_by_label(queries, ignore_case=False, max_workers=None):
+    """
+    Forwards to :meth:`OpenTreeService.lookup_study_otus_by_label()` of the global :class:`OpenTreeService` instance.
+    """
+    return GLOBAL_OPEN_TREE_SERVICE.lookup_study_otus_by_label(
+            queries=queries,
+            ignore_case=ignore_case,
+            max_workers=max_workers)
+
+def lookup_study_otus_by_ott_id(queries, max_workers=None):
+    """
+    Forwards to :meth:`OpenTreeService.lookup_study_otus_by_ott_id()` of the global :class:`OpenTreeService` instance.
+    """
+    return GLOBAL_OPEN_TREE_SERVICE.lookup_study_otus_by_ott_id(
+            queries=queries,
+            max_workers=max_workers)
+
 def get_study_otumap(study_id, ):
     return GLOBAL_OPEN_TREE_SERVICE.get_study_otumap(
             study_id=study_id,
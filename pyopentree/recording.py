@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import io
+import json
+import os
+import sys
+import threading
+
+if sys.hexversion < 0x03000000:
+    from urllib import urlencode
+    from urllib2 import HTTPError
+    from urlparse import parse_qsl
+    from urlparse import urlsplit
+else:
+    from urllib.error import HTTPError
+    from urllib.parse import parse_qsl
+    from urllib.parse import urlencode
+    from urllib.parse import urlsplit
+
+try:
+    from pyopentree.cache import BlobStore
+except ImportError:
+    from cache import BlobStore
+
+__all__ = [str(name) for name in (
+        "canonical_request_key",
+        "canonical_key_for_request",
+        "split_request",
+        "RecordedResponse",
+        "RecordingStore",
+        )]
+
+# Response headers kept with a recording (those the client looks at).
+RECORDED_HEADERS = ("Content-Type", "ETag", "Last-Modified")
+
+def canonical_request_key(method, sub_url, payload=None):
+    """
+    Return a string identifying a request to the API, independently of the
+    order of the members of its JSON payload or of the server it is sent to:
+    the HTTP method, the path relative to the API root (e.g.,
+    "/tol/about") with its query string, if any (parameters sorted), and,
+    for POST requests, the payload in canonical JSON (a missing payload is
+    sent by the client as an empty object). `payload` is either the parsed
+    payload or the raw body of the request.
+    """
+    method = method.upper()
+    parts = urlsplit(sub_url)
+    sub_url = parts.path or "/"
+    if parts.query:
+        sub_url += "?" + urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    if method != "POST":
+        return "{} {}".format(method, sub_url)
+    if isinstance(payload, bytes):
+        payload = _decode_payload(payload)
+    if payload is None:
+        payload = {}
+    return "{} {} {}".format(
+            method,
+            sub_url,
+            json.dumps(payload, sort_keys=True, separators=(",", ":")))
+
+def canonical_key_for_request(request, base_url):
+    """
+    Return the :func:`canonical_request_key()` of the `urllib` request
+    `request` to the API at `base_url`.
+    """
+    return canonical_request_key(*split_request(request, base_url))
+
+def split_request(request, base_url):
+    """
+    Return `(method, sub_url, payload)` for the `urllib` request `request` to
+    the API at `base_url`, where `sub_url` is relative to `base_url` (with
+    the query string, if any) and `payload` is the parsed JSON payload, if
+    any.
+    """
+    base_path = urlsplit(base_url).path.rstrip("/")
+    parts = urlsplit(request.get_full_url())
+    sub_url = parts.path
+    if base_path and sub_url.startswith(base_path):
+        sub_url = sub_url[len(base_path):]
+    if parts.query:
+        sub_url += "?" + parts.query
+    return request.get_method(), sub_url, _decode_payload(request.data)
+
+class RecordedResponse(object):
+    """
+    A response replayed from a :class:`RecordingStore`, with the parts of
+    the interface of the responses of `urlopen` used by the client.
+    """
+
+    def __init__(self, url, status, headers, body):
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self._body = io.BytesIO(body)
+
+    def read(self, *args):
+        return self._body.read(*args)
+
+    def info(self):
+        return self.headers
+
+    def getcode(self):
+        return self.status
+
+    def geturl(self):
+        return self.url
+
+    def close(self):
+        self._body.close()
+
+class RecordingStore(object):
+    """
+    A store of responses of the API, keyed by the
+    :func:`canonical_request_key()` of their requests.
+
+    The response bodies are kept compressed in a :class:`BlobStore` under
+    `root` (so identical responses are stored once), and the keys, with the
+    status, headers and digest of each response, in an append-only index
+    file, "requests.jsonl" (recording a request again supersedes its older
+    entry). The index is read into memory when the store is opened, so
+    looking up a response costs a dictionary lookup and the read of one
+    blob, whatever the number of recordings.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.blobs = BlobStore(os.path.join(root, "blobs"))
+        self.index_path = os.path.join(root, "requests.jsonl")
+        self.entries = {}
+        self._lock = threading.Lock()
+        if os.path.exists(self.index_path):
+            with io.open(self.index_path, "r", encoding="utf-8") as src:
+                for line in src:
+                    if not line.strip():
+                        continue
+                    entry = json.loads(line)
+                    self.entries[entry["key"]] = (entry["status"], entry["headers"], entry["digest"])
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def keys(self):
+        return list(self.entries.keys())
+
+    def put(self, key, status, headers, body):
+        """
+        Record the response with the given status, headers (a dictionary) and
+        body (bytes) for the request identified by `key`.
+        """
+        digest = self.blobs.put(body)
+        entry = (status, dict(headers), digest)
+        with self._lock:
+            if self.entries.get(key, None) == entry:
+                return
+            with io.open(self.index_path, "a", encoding="utf-8") as dest:
+                dest.write(json.dumps({
+                    "key": key,
+                    "status": status,
+                    "headers": entry[1],
+                    "digest": digest,
+                    }, sort_keys=True) + "\n")
+            self.entries[key] = entry
+
+    def get(self, key):
+        """
+        Return `(status, headers, body)`, the response recorded for the request
+        identified by `key`, or `None` if there is none.
+        """
+        entry = self.entries.get(key, None)
+        if entry is None:
+            return None
+        body = self.blobs.get(entry[2])
+        if body is None:
+            return None
+        return entry[0], entry[1], body
+
+    def items(self):
+        """
+        Yield `(key, status, headers, body)` for each recorded response.
+        """
+        for key in self.keys():
+            response = self.get(key)
+            if response is not None:
+                yield (key,) + response
+
+    def open_url(self, request, base_url, urlopen, mode="replay"):
+        """
+        Return the response to `request` (sent to the API at `base_url`). In
+        "replay" mode, the response is served from the store, and an
+        `IOError` is raised if it has not been recorded; in "record" mode,
+        the request is sent with `urlopen` and its response recorded; in
+        "auto" mode, recorded responses are replayed and the others
+        recorded. Recorded responses other than successes are raised as
+        `HTTPError`, as `urlopen` would.
+
+        Keys do not include the validators of conditional requests, so a
+        "304 Not Modified" response is passed on without being recorded;
+        instead, a conditional request whose "If-None-Match" validator is
+        the ETag of the recorded response is answered with a 304 on replay.
+        """
+        key = canonical_key_for_request(request, base_url)
+        url = request.get_full_url()
+        response = None
+        if mode in ("replay", "auto"):
+            response = self.get(key)
+            if response is None and mode == "replay":
+                raise IOError("No recorded response for '{}'".format(key))
+        elif mode != "record":
+            raise ValueError("Recording mode '{}' is not supported".format(mode))
+        if response is None:
+            try:
+                live = urlopen(request)
+                status = live.getcode() if hasattr(live, "getcode") else 200
+            except HTTPError as e:
+                if e.code == 304:
+                    raise
+                live = e
+                status = e.code
+            info = live.info()
+            headers = dict((name, info.get(name)) for name in RECORDED_HEADERS if info.get(name) is not None)
+            try:
+                body = live.read()
+            finally:
+                live.close()
+            response = (status or 200, headers, body)
+            self.put(key, *response)
+        status, headers, body = response
+        etag = headers.get("ETag", None)
+        if 200 <= status < 300 and etag is not None and request.get_header("If-none-match") == etag:
+            raise HTTPError(url, 304, "Not Modified", headers, io.BytesIO(b""))
+        if not 200 <= status < 300:
+            raise HTTPError(url, status, "Recorded error response", headers, io.BytesIO(body))
+        return RecordedResponse(url, status, headers, body)
+
+def _decode_payload(data):
+    if not data:
+        return None
+    if isinstance(data, bytes):
+        data = data.decode("utf-8")
+    try:
+        return json.loads(data)
+    except ValueError:
+        return data
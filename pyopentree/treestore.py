@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import io
+import json
+import mmap
+import os
+import sys
+import threading
+
+if sys.hexversion < 0x03000000:
+    from urllib2 import HTTPError
+    _STRING_TYPES = basestring
+else:
+    from urllib.error import HTTPError
+    _STRING_TYPES = str
+
+try:
+    from pyopentree.compacttree import CompactTree
+except ImportError:
+    from compacttree import CompactTree
+
+__all__ = [str(name) for name in ("TreeStore",)]
+
+class TreeStore(object):
+    """
+    An append-only store of tree strings, keyed by study id, tree id and
+    schema.
+
+    The trees are appended, uncompressed, to a single data file,
+    "trees.dat", under `root`, and their offsets and lengths to an index
+    file, "trees.index.jsonl" (storing a tree again appends a new copy that
+    supersedes the old one). The index is read into memory when the store is
+    opened, and the data file is memory-mapped, so reading a tree back costs
+    a dictionary lookup and a slice of the map, whatever the size of the
+    store.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        if not os.path.isdir(root):
+            os.makedirs(root)
+        self.data_path = os.path.join(root, "trees.dat")
+        self.index_path = os.path.join(root, "trees.index.jsonl")
+        self.entries = {}
+        self._lock = threading.Lock()
+        self._map = None
+        self._map_size = 0
+        if not os.path.exists(self.data_path):
+            open(self.data_path, "wb").close()
+        data_size = os.path.getsize(self.data_path)
+        if os.path.exists(self.index_path):
+            self._read_index(data_size)
+
+    @staticmethod
+    def key(study_id, tree_id, schema="newick"):
+        return (study_id, tree_id, schema.lower())
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def keys(self):
+        return list(self.entries.keys())
+
+    def close(self):
+        with self._lock:
+            if self._map is not None:
+                self._map.close()
+                self._map = None
+                self._map_size = 0
+
+    def put(self, study_id, tree_id, tree, schema="newick"):
+        """
+        Append `tree`, the string of the tree in the given schema.
+        """
+        data = tree.encode("utf-8")
+        key = TreeStore.key(study_id, tree_id, schema)
+        with self._lock:
+            with open(self.data_path, "ab") as dest:
+                dest.seek(0, os.SEEK_END)
+                offset = dest.tell()
+                dest.write(data)
+            with io.open(self.index_path, "a", encoding="utf-8") as dest:
+                dest.write(json.dumps({
+                    "study_id": study_id,
+                    "tree_id": tree_id,
+                    "schema": key[2],
+                    "offset": offset,
+                    "length": len(data),
+                    }, sort_keys=True) + "\n")
+            self.entries[key] = (offset, len(data))
+
+    def get(self, study_id, tree_id, schema="newick"):
+        """
+        Return the string of the tree in the given schema, or `None` if it is
+        not in the store.
+        """
+        entry = self.entries.get(TreeStore.key(study_id, tree_id, schema), None)
+        if entry is None:
+            return None
+        offset, length = entry
+        if length == 0:
+            # nothing to read, and the map of an empty data file is not open
+            return ""
+        with self._lock:
+            if offset + length > self._map_size:
+                self._remap()
+            data = self._map[offset:offset + length]
+        return data.decode("utf-8")
+
+    def get_compact_tree(self, study_id, tree_id):
+        """
+        Return the tree, stored in NEWICK format, as a
+        :class:`CompactTree`, or `None` if it is not in the store.
+        """
+        newick = self.get(study_id, tree_id, schema="newick")
+        if newick is None:
+            return None
+        return CompactTree.from_newick(newick)
+
+    def fetch(self, service, trees, schema="newick", max_workers=None):
+        """
+        Download the trees identified by the `(study_id, tree_id)` pairs in
+        `trees` that are not already in the store, concurrently, with the
+        `get_study_tree` method of `service`. A tree that cannot be fetched
+        is reported as failed, and does not stop the others.
+
+        Returns
+        -------
+        d : dict
+            A python dictionary with the following fields:
+
+                "num_fetched"
+                "failed"
+
+            where "failed" lists the `(study_id, tree_id)` pairs of the trees
+            that could not be fetched.
+        """
+        to_fetch = [tree for tree in trees if TreeStore.key(tree[0], tree[1], schema) not in self.entries]
+        def fetch_tree(tree):
+            study_id, tree_id = tree
+            try:
+                result = service.get_study_tree(study_id=study_id, tree_id=tree_id, schema=schema)
+            except (HTTPError, IOError, KeyError, ValueError, service.OpenTreeError):
+                return False
+            if not isinstance(result, _STRING_TYPES):
+                result = json.dumps(result, sort_keys=True)
+            self.put(study_id, tree_id, result, schema=schema)
+            return True
+        fetched = service.map_concurrently(fetch_tree, to_fetch, max_workers=max_workers)
+        return {
+                "num_fetched": sum(fetched),
+                "failed": [tree for tree, ok in zip(to_fetch, fetched) if not ok],
+                }
+
+    def _read_index(self, data_size):
+        index_size = 0
+        with open(self.index_path, "rb") as src:
+            for line in src:
+                try:
+                    entry = json.loads(line.decode("utf-8")) if line.strip() else None
+                except ValueError:
+                    entry = None
+                    if line.endswith(b"\n"):
+                        raise
+                if not line.endswith(b"\n"):
+                    # the last line was cut short by an interrupted write
+                    break
+                index_size += len(line)
+                if entry is None:
+                    continue
+                # ignore entries for data lost in an interrupted write
+                if entry["offset"] + entry["length"] > data_size:
+                    continue
+                key = TreeStore.key(entry["study_id"], entry["tree_id"], entry["schema"])
+                self.entries[key] = (entry["offset"], entry["length"])
+        if index_size < os.path.getsize(self.index_path):
+            # drop the torn line, so that the next entry starts a line of its own
+            with open(self.index_path, "r+b") as dest:
+                dest.truncate(index_size)
+
+    def _remap(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+            self._map_size = 0
+        with open(self.data_path, "rb") as src:
+            size = os.fstat(src.fileno()).st_size
+            if size > 0:
+                self._map = mmap.mmap(src.fileno(), 0, access=mmap.ACCESS_READ)
+                self._map_size = size
@@ -54,7 +54,11 @@ EXTRA_KWARGS = dict(
 PACKAGE_DIRS = [p.replace(".", os.path.sep) for p in PACKAGES]
 PACKAGE_INFO = [("{p[0]:>40} : {p[1]}".format(p=p)) for p in zip(PACKAGES, PACKAGE_DIRS)]
 sys.stderr.write("-setup.py: packages identified:\n{}\n".format("\n".join(PACKAGE_INFO)))
-ENTRY_POINTS = {}
+ENTRY_POINTS = {
+    "console_scripts": [
+        "pyopentree = pyopentree.cli:main",
+        ],
+    }
 
 ###############################################################################
 # Script paths
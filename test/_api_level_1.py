@@ -1,8 +1,11 @@
 from __future__ import print_function
 from __future__ import unicode_literals
+import argparse
 import unittest
 import sys
 import locale
+import time
+import traceback
 ENCODING = locale.getdefaultlocale()[1]
 # so we import local api before any globally installed one
 sys.path.insert(0,"../pyopentree")
@@ -10,28 +13,32 @@ sys.path.insert(0,"../pyopentree")
 sys.path.insert(0,"pyopentree")
 import opentreeservice
 from opentreeservice import OpenTreeService
+from mockserver import MockOpenTreeServer
+from mockserver import fixture_call
 import json
 if sys.version_info.major < 3:
     from urllib2 import urlopen
     from urllib2 import URLError, HTTPError
+    import __builtin__ as builtins
 else:
     from urllib.request import urlopen
     from urllib.error import URLError
+    import builtins
 
+FIXTURES_URL = 'https://raw.githubusercontent.com/OpenTreeOfLife/shared-api-tests/master/'
+
+# read the fixtures from the current directory instead of GitHub
 use_file = False
+# run against a local stand-in server serving responses synthesized from the
+# fixtures, instead of the API at `TestingOpenTreeClass.base_url`
+use_mock = False
+# number of test cases run concurrently
+max_workers = 8
 TestingOpenTreeClass = OpenTreeService()
 TestingOpenTreeClass.is_testing_mode = True
+mock_server = None
 
 
-def exec_and_return_locals(statement, locals_dict=None):
-    """
-    Executes `statement` and returns locals dict.
-    """
-    if locals_dict is None:
-        locals_dict = locals()
-    exec(statement, None, locals_dict)
-    return locals_dict
-
 class bcolors:
     HEADER = '\033[95m'
     OKBLUE = '\033[94m'
@@ -41,195 +48,202 @@ class bcolors:
     ENDC = '\033[0m'
 
 
+def load_fixtures(name):
+    """
+    Returns the shared-api-tests fixtures in the file `name`.
+    """
+    if use_file:
+        with open(name) as data_file:
+            return json.load(data_file)
+    data_file = urlopen(FIXTURES_URL + name)
+    return json.loads(data_file.read().decode(ENCODING))
+
+def is_instance_of_named(obj, name):
+    """
+    Whether `obj` is an instance of a class called `name` (e.g. "dict",
+    "HTTPError" or "OpenTreeService.OpenTreeError"), or of a subclass of it.
+    """
+    name = name.split(".")[-1]
+    if name == "str" and sys.version_info.major < 3:
+        name = "basestring"
+    cls = getattr(builtins, name, None)
+    if isinstance(cls, type):
+        return isinstance(obj, cls)
+    return any(c.__name__ == name for c in type(obj).__mro__)
+
+def get_path(response, path):
+    for step in path:
+        response = response[step]
+    return response
+
+def check_response(key, tests, response):
+    """
+    Returns the failures of the checks `tests` of the test case `key` on
+    `response`.
+    """
+    failures = []
+    def check(passed, message):
+        if not passed:
+            failures.append(key + ": " + message)
+    for test in tests:
+        if test == 'contains':
+            for sub_test in tests[test]:
+                check(sub_test[0] in response, sub_test[1])
+        elif test == 'of_type':
+            sub_test = tests[test]
+            check(is_instance_of_named(response, sub_test[0]), sub_test[1])
+        elif test == 'equals':
+            for sub_test in tests[test]:
+                check(response[sub_test[0][0]] == sub_test[0][1], sub_test[1])
+        elif test == 'deep_equals':
+            for sub_test in tests[test]:
+                check(get_path(response, sub_test[0][0]) == sub_test[0][1], sub_test[1])
+        elif test == 'length_greater_than':
+            for sub_test in tests[test]:
+                length = len(response[sub_test[0][0]])
+                check(length > sub_test[0][1], sub_test[1] + " len " + str(length))
+        elif test == 'length_less_than':
+            for sub_test in tests[test]:
+                length = len(response[sub_test[0][0]])
+                check(length < sub_test[0][1], sub_test[1] + " len " + str(length))
+        elif test == "parameters_error":
+            # dealt with when calling
+            continue
+        elif test == "contains_error":
+            check("error" in response, tests[test][0])
+        else:
+            print("\t\t" + bcolors.FAIL + "Oh oh. I didn't know how to deal with test type: " + test + bcolors.ENDC)
+    return failures
+
+def run_case(key, case):
+    """
+    Calls the method of the test case `case` and checks the response.
+    Returns `(seconds, failures)`.
+    """
+    function_name, kwargs = fixture_call(case)
+    start = time.time()
+    try:
+        response = getattr(TestingOpenTreeClass, function_name)(**kwargs)
+    except Exception as e:
+        seconds = time.time() - start
+        if "parameters_error" in case['tests']:
+            sub_test = case['tests']['parameters_error']
+            if is_instance_of_named(e, sub_test[0]):
+                return seconds, []
+            return seconds, [key + ": expected " + sub_test[0] + ", got:\n" + traceback.format_exc()]
+        # an exception we didn't test for
+        return seconds, [key + ": unexpected exception:\n" + traceback.format_exc()]
+    seconds = time.time() - start
+    if "parameters_error" in case['tests']:
+        return seconds, [key + ": expected " + case['tests']['parameters_error'][0]]
+    try:
+        return seconds, check_response(key, case['tests'], response)
+    except Exception:
+        return seconds, [key + ": checking the response failed:\n" + traceback.format_exc()]
+
+
 class OpenTreeLib(unittest.TestCase):
 
     def test_tree_of_life_tests(self):
         print("\n" + bcolors.OKBLUE + "     Running ToL tests\n" + bcolors.ENDC)
-        try:
-            if (not use_file):
-                data_file = urlopen('https://raw.githubusercontent.com/OpenTreeOfLife/shared-api-tests/master/tree_of_life.json')
-                data = json.loads(data_file.read().decode(ENCODING))
-            else:
-                with open('tree_of_life.json') as data_file:
-                    data = json.load(data_file)
-            self.run_tests(data)
-        except URLError as e:
-            if e.code == 404:
-                self.assertTrue(False,"Error fetching tree_of_life.json from GitHub")
-            else:
-                raise
-
+        self.run_fixture_file('tree_of_life.json')
 
     def test_graph_of_life_tests(self):
         print("\n" + bcolors.OKBLUE + "     Running GoL tests\n" + bcolors.ENDC)
-        try:
+        if not use_mock:
             response = opentreeservice.gol_source_tree("pg_420", "522", "a2c48df995ddc9fd208986c3d4225112550c8452")
-
-            if (not use_file):
-                data_file = urlopen('https://raw.githubusercontent.com/OpenTreeOfLife/shared-api-tests/master/graph_of_life.json')
-                data = json.loads(data_file.read().decode(ENCODING))
-            else:
-                with open('graph_of_life.json') as data_file:
-                    data = json.load(data_file)
-            self.run_tests(data)
-        except URLError as e:
-            if e.code == 404:
-                self.assertTrue(False,"Error fetching graph_of_life.json from GitHub")
-            else:
-                raise
-
+        self.run_fixture_file('graph_of_life.json')
 
     def test_tnrs_tests(self):
         print("\n" + bcolors.OKBLUE + "     Running TNRS tests\n" + bcolors.ENDC)
-        try:
-            if (not use_file):
-                data_file = urlopen('https://raw.githubusercontent.com/OpenTreeOfLife/shared-api-tests/master/tnrs.json')
-                data = json.loads(data_file.read().decode(ENCODING))
-            else:
-                with open('tnrs.json') as data_file:
-                    data = json.load(data_file)
-            self.run_tests(data)
-        except URLError as e:
-            if e.code == 404:
-                self.assertTrue(False,"Error fetching tnrs.json from GitHub")
-            else:
-                raise
-
+        self.run_fixture_file('tnrs.json')
 
     def test_taxonomy_tests(self):
         print("\n" + bcolors.OKBLUE + "     Running Taxonomy tests\n" + bcolors.ENDC)
-        try:
-            if (not use_file):
-                data_file = urlopen('https://raw.githubusercontent.com/OpenTreeOfLife/shared-api-tests/master/taxonomy.json')
-                data = json.loads(data_file.read().decode(ENCODING))
-            else:
-                with open('taxonomy.json') as data_file:
-                    data = json.load(data_file)
-            self.run_tests(data)
-        except URLError as e:
-            if e.code == 404:
-                self.assertTrue(False,"Error fetching taxonomy.json from GitHub")
-            else:
-                raise
+        self.run_fixture_file('taxonomy.json')
 
     def test_studies_tests(self):
         print("\n" + bcolors.OKBLUE + "     Running Studies tests\n" + bcolors.ENDC)
+        self.run_fixture_file('studies.json')
+
+    def run_fixture_file(self, name):
         try:
-            if (not use_file):
-                data_file = urlopen('https://raw.githubusercontent.com/OpenTreeOfLife/shared-api-tests/master/studies.json')
-                data = json.loads(data_file.read().decode(ENCODING))
-            else:
-                with open('studies.json') as data_file:
-                    data = json.load(data_file)
-            self.run_tests(data)
+            data = load_fixtures(name)
         except URLError as e:
-            if e.code == 404:
-                self.assertTrue(False,"Error fetching studies.json from GitHub")
+            if getattr(e, "code", None) == 404:
+                self.assertTrue(False,"Error fetching " + name + " from GitHub")
             else:
                 raise
-
-
-    def construct_arguments(self,data):
-        
-        arguments = ""
-        i = 0
-
-        for arg in data['test_input']:
-            if isinstance(data['test_input'][arg], str):
-                arg_val = "'"+data['test_input'][arg]+"'"
-            else:
-                arg_val = str(data['test_input'][arg])
-            # Exceptions - some keywords need amended to python values
-            if data['test_function'] == 'studies_find_studies':
-                if arg == 'property':
-                    # this is actually study_property
-                    arg = 'property_name'
-                if arg == 'value':
-                    arg = 'property_value'
-            if data['test_function'] == 'studies_find_trees':
-                if arg == 'property':
-                    # this is actually study_property
-                    arg = 'property_name'
-                if arg == 'value':
-                    arg = 'property_value'
-
-
-            if i == len(data)-1:
-                arguments = arguments + arg + "=" + arg_val
-            else:
-                arguments = arguments + arg + "=" + arg_val + ","
-            i += 1
-
-        return 'response = TestingOpenTreeClass.'+data['test_function']+'('+arguments+')'
+        if use_mock:
+            mock_server.load_fixtures(data)
+        self.run_tests(data)
 
     # This is the function that does the heavy lifting
     def run_tests(self, data):
-
-        for key in data:
-            print("\tRunning test: "+key)
-            try:
-                if (data[key]['test_input'] == {}):
-                    response = exec_and_return_locals('response = TestingOpenTreeClass.'+data[key]['test_function']+'()', locals())["response"]
-                else:
-                    args = self.construct_arguments(data[key])
-                    response = exec_and_return_locals(args, locals())["response"]
-            except:
-                if "parameters_error" in data[key]['tests']:
-                    sub_test = data[key]['tests']['parameters_error']
-                    with self.assertRaises(eval(sub_test[0])):
-                        if (data[key]['test_input'] == {}):
-                            response = exec_and_return_locals('response = TestingOpenTreeClass.'+data[key]['test_function']+'()', locals())['response']
-                        else:
-                            args = self.construct_arguments(data[key])
-                            response = exec_and_return_locals(args, locals())["response"]
-                else:
-                    # we got here because there was an exception, but we didn't test for it. Raise it.
-                    raise
-            # now test as we didn't get an error
-            for test in data[key]['tests']:
-                if test == 'contains':
-                    for sub_test in data[key]['tests'][test]:
-                        self.assertTrue(sub_test[0] in response, key+": "+sub_test[1])
-                elif test == 'of_type':
-                    sub_test = data[key]['tests'][test]
-                    self.assertTrue(isinstance(response,eval(sub_test[0])), key+": "+sub_test[1])
-                elif test == 'equals':
-                    for sub_test in data[key]['tests'][test]:
-                        self.assertTrue(eval("response['"+sub_test[0][0]+"']") == sub_test[0][1], key+": "+sub_test[1])
-                elif test == 'deep_equals':
-                    for sub_test in data[key]['tests'][test]:
-                        results = ""
-                        i = 0
-                        for result in sub_test[0][0]:
-                            if isinstance(result,str):
-                                results += "['" + result + "']"
-                            else:
-                                results += "["+str(result)+"]"
-                            i += 1
-
-                        self.assertTrue(eval("response"+results) == sub_test[0][1], key+": "+sub_test[1])
-                elif test == 'length_greater_than':
-                    for sub_test in data[key]['tests'][test]:
-                        self.assertTrue(eval("len(response['"+sub_test[0][0]+"'])") > sub_test[0][1], key+": "+sub_test[1] + " len "+str(eval("len(response['"+sub_test[0][0]+"'])")))
-                elif test == 'length_less_than':
-                    for sub_test in data[key]['tests'][test]:
-                        self.assertTrue(eval("len(response['"+sub_test[0][0]+"'])") < sub_test[0][1], key+": "+sub_test[1] + " len "+str(eval("len(response['"+sub_test[0][0]+"'])")))
-                elif test == "parameters_error":
-                    continue
-                    # dealt with above!
-                elif test == "contains_error":
-                    sub_test = data[key]['tests'][test]
-                    self.assert_("error" in response, key+": "+sub_test[0])
-                else:
-                    print("\t\t" + bcolors.FAIL + "Oh oh. I didn't know how to deal with test type: " + test + bcolors.ENDC)
-
-def run():
+        keys = sorted(data)
+        start = time.time()
+        results = TestingOpenTreeClass.map_concurrently(
+                lambda key: run_case(key, data[key]),
+                keys,
+                max_workers=max_workers)
+        elapsed = time.time() - start
+        failures = []
+        for key, (seconds, case_failures) in zip(keys, results):
+            if case_failures:
+                status = bcolors.FAIL + "FAIL" + bcolors.ENDC
+            else:
+                status = "ok"
+            print("\tRunning test: {} ({:.3f}s) {}".format(key, seconds, status))
+            failures.extend(case_failures)
+        print("\t{} tests in {:.3f}s ({:.3f}s of calls)".format(
+            len(keys), elapsed, sum(result[0] for result in results)))
+        if failures:
+            self.fail("\n".join(failures))
+
+def run(base_url=None, mock=False, workers=None):
+    """
+    Runs the fixture tests against the API at `base_url` (default: the
+    public API) or, if `mock` is `True`, against a local stand-in server,
+    running up to `workers` test cases at a time.
+    """
+    global use_mock, max_workers, mock_server
+    use_mock = mock
+    if workers is not None:
+        max_workers = workers
+    if use_mock:
+        mock_server = MockOpenTreeServer().start()
+        TestingOpenTreeClass.base_url = mock_server.base_url
+    elif base_url is not None:
+        TestingOpenTreeClass.base_url = base_url
     suite = unittest.TestSuite()
     for method in dir(OpenTreeLib):
        if method.startswith("test"):
           suite.addTest(OpenTreeLib(method))
-    unittest.TextTestRunner().run(suite)
+    try:
+        return unittest.TextTestRunner().run(suite)
+    finally:
+        if mock_server is not None:
+            mock_server.stop()
+            mock_server = None
 
 
 if __name__ == '__main__':
-    run()
+    parser = argparse.ArgumentParser(description="Runs the shared-api-tests fixtures.")
+    parser.add_argument("--base-url",
+            default=None,
+            help="Base URL of the API to test (default: the public API).")
+    parser.add_argument("--mock",
+            action="store_true",
+            default=False,
+            help="Test against a local stand-in server instead.")
+    parser.add_argument("--use-file",
+            action="store_true",
+            default=False,
+            help="Read the fixtures from the current directory instead of GitHub.")
+    parser.add_argument("-w", "--workers",
+            type=int,
+            default=max_workers,
+            help="Number of test cases run concurrently (default: %(default)s).")
+    args = parser.parse_args()
+    use_file = args.use_file
+    run(base_url=args.base_url, mock=args.mock, workers=args.workers)
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+if sys.hexversion < 0x03000000:
+    from urllib2 import HTTPError
+else:
+    from urllib.error import HTTPError
+
+from pyopentree import cli
+from pyopentree import OpenTreeService
+
+class TaxonService(OpenTreeService):
+
+    def __init__(self):
+        OpenTreeService.__init__(self, base_url="http://localhost/v2")
+
+    def open_url(self, request):
+        sub_url = request.get_full_url()[len(self.base_url):]
+        if sub_url == "/taxonomy/about":
+            raise HTTPError(request.get_full_url(), 500, "Internal Server Error", {}, io.BytesIO(b"{}"))
+        if sub_url == "/tree_of_life/about":
+            study_list = [{"study_id": "pg_1", "tree_id": "tree1", "git_sha": "sha1"}]
+            return io.BytesIO(json.dumps({"study_list": study_list}).encode("utf-8"))
+        if sub_url == "/graph/source_tree":
+            return io.BytesIO(b'{"newick": "(a,b);"}')
+        if sub_url == "/studies/properties":
+            return io.BytesIO(b'{"study_properties": ["ot:studyId"], "tree_properties": []}')
+        if sub_url == "/studies/find_studies":
+            return io.BytesIO(b'{"matched_studies": [{"ot:studyId": "pg_1"}]}')
+        if sub_url == "/study/pg_1/meta":
+            return io.BytesIO(b'{"nexml": {}}')
+        if request.data is None:
+            if sub_url == "/study/pg_1":
+                return io.BytesIO(b'{"nexml": {"^ot:studyId": "pg_1"}}')
+            if sub_url == "/study/pg_2":
+                raise HTTPError(request.get_full_url(), 404, "Not Found", {}, io.BytesIO(b"{}"))
+            if sub_url == "/study/pg_1/otu/otu1":
+                return io.BytesIO(b'{"otu1": {"^ot:originalLabel": "Aster"}}')
+            raise AssertionError(sub_url)
+        payload = json.loads(request.data.decode("utf-8"))
+        if sub_url == "/tree_of_life/mrca":
+            if min(payload["ott_ids"]) < 0:
+                raise HTTPError(request.get_full_url(), 400, "Bad Request", {}, io.BytesIO(b"{}"))
+            return io.BytesIO(json.dumps({"mrca_node_id": sum(payload["ott_ids"])}).encode("utf-8"))
+        if sub_url == "/taxonomy/taxon":
+            if payload["ott_id"] < 0:
+                return io.BytesIO(b'{"error": "not found"}')
+            return io.BytesIO(json.dumps({"ot:ottId": payload["ott_id"], "node_id": payload["ott_id"] * 10}).encode("utf-8"))
+        if sub_url == "/tnrs/match_names":
+            results = [{"id": name, "matches": [{"ot:ottTaxonName": name.capitalize()}]} for name in payload["names"] if name != "zzz"]
+            return io.BytesIO(json.dumps({"results": results}).encode("utf-8"))
+        raise AssertionError(sub_url)
+
+class CliTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.stdout = sys.stdout
+        sys.stdout = io.StringIO()
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+        shutil.rmtree(self.tempdir)
+
+    def run_cli(self, argv):
+        stderr = sys.stderr
+        sys.stderr = io.StringIO()
+        try:
+            status = cli.main(argv, service=TaxonService())
+        finally:
+            self.errors = sys.stderr.getvalue()
+            sys.stderr = stderr
+        records = [json.loads(line) for line in sys.stdout.getvalue().splitlines()]
+        sys.stdout.seek(0)
+        sys.stdout.truncate()
+        return status, records
+
+    def test_items_from_file_in_order(self):
+        path = os.path.join(self.tempdir, "ids.txt")
+        with io.open(path, "w", encoding="utf-8") as dest:
+            dest.write("\n".join("{}".format(i) for i in range(1, 201)) + "\n\n")
+        status, records = self.run_cli(["-w", "4", "taxonomy-taxon", "-1", "--input", path])
+        self.assertEqual(status, 1)
+        self.assertEqual(len(records), 201)
+        self.assertEqual(records[0], {"input": "-1", "error": "not found"})
+        self.assertEqual(records[200], {"input": "200", "result": {"ot:ottId": 200, "node_id": 2000}})
+
+    def test_match_names_in_batches(self):
+        status, records = self.run_cli(["tnrs-match-names", "--batch-size", "2", "aster", "zzz", "bellis"])
+        self.assertEqual(status, 0)
+        self.assertEqual([record["input"] for record in records], ["aster", "zzz", "bellis"])
+        self.assertEqual(records[1]["result"]["matches"], [])
+        self.assertEqual(records[2]["result"]["matches"][0]["ot:ottTaxonName"], "Bellis")
+
+    def test_mrca_per_item_errors(self):
+        status, records = self.run_cli(["tol-mrca", "1 2", "3,x", ",", "-1 4", "2,1"])
+        self.assertEqual(status, 1)
+        self.assertEqual([record["input"] for record in records], ["1 2", "3,x", ",", "-1 4", "2,1"])
+        self.assertEqual(records[0]["result"]["mrca_node_id"], 3)
+        self.assertTrue("error" in records[1])
+        self.assertTrue("error" in records[2])
+        self.assertTrue("400" in records[3]["error"])
+        self.assertEqual(records[4]["result"]["mrca_node_id"], 3)
+
+    def test_study_otu(self):
+        status, records = self.run_cli(["get-study-otu", "pg_1 otu1"])
+        self.assertEqual(status, 0)
+        self.assertEqual(records, [{"input": "pg_1 otu1", "result": {"otu1": {"^ot:originalLabel": "Aster"}}}])
+
+    def test_items_from_stdin(self):
+        stdin = sys.stdin
+        sys.stdin = io.StringIO("2\n\n3\n")
+        try:
+            status, records = self.run_cli(["taxonomy-taxon", "1", "--input", "-"])
+        finally:
+            sys.stdin = stdin
+        self.assertEqual(status, 0)
+        self.assertEqual([record["input"] for record in records], ["1", "2", "3"])
+
+    def test_command_error(self):
+        status, records = self.run_cli(["taxonomy-about"])
+        self.assertEqual(status, 1)
+        self.assertEqual(records, [])
+        self.assertTrue(self.errors.startswith("pyopentree: error: "))
+        self.assertTrue("500" in self.errors)
+
+    def test_study_mirror(self):
+        path = os.path.join(self.tempdir, "mirror.sqlite")
+        self.assertRaises(SystemExit, self.run_cli, ["--study-mirror", path, "studies-find-studies"])
+        self.assertTrue("never been synced" in self.errors)
+        status, records = self.run_cli(["--study-mirror", path, "--sync-study-mirror", "studies-find-studies"])
+        self.assertEqual(status, 0)
+        self.assertEqual(records, [{"ot:studyId": "pg_1"}])
+        status, records = self.run_cli(["--study-mirror", path, "studies-properties"])
+        self.assertEqual(records, [{"study_properties": ["ot:studyId"], "tree_properties": []}])
+
+    def test_crawl(self):
+        status, records = self.run_cli(["crawl", "--root", self.tempdir, "pg_1", "pg_2"])
+        self.assertEqual(status, 0)
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0]["outcomes"], {"pg_1": "fetched", "pg_2": "failed"})
+        # the interrupted crawl is resumed
+        status, records = self.run_cli(["crawl", "--root", self.tempdir, "pg_1", "pg_2"])
+        self.assertEqual((records[0]["skipped"], records[0]["failed"]), (1, 1))
+        status, records = self.run_cli(["crawl", "--root", self.tempdir, "--restart", "pg_1"])
+        self.assertEqual(records[0]["outcomes"], {"pg_1": "fetched"})
+
+    def test_sync(self):
+        status, records = self.run_cli(["sync", "--root", self.tempdir])
+        self.assertEqual(status, 0)
+        self.assertEqual(len(records), 1)
+        self.assertEqual((records[0]["added"], records[0]["studies_fetched"], records[0]["source_trees_fetched"]), (1, 1, 1))
+        status, records = self.run_cli(["sync", "--root", self.tempdir])
+        self.assertEqual((records[0]["unchanged"], records[0]["studies_fetched"]), (1, 0))
+
+    def test_workers_validated(self):
+        stderr = sys.stderr
+        sys.stderr = io.StringIO()
+        try:
+            self.assertRaises(SystemExit, cli.main, ["-w", "0", "taxonomy-taxon", "1"], service=TaxonService())
+        finally:
+            sys.stderr = stderr
+
+if __name__ == "__main__":
+    unittest.main()
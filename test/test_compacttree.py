@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import io
+import sys
+import unittest
+
+if sys.hexversion < 0x03000000:
+    from urllib2 import HTTPError
+else:
+    from urllib.error import HTTPError
+
+from pyopentree import OpenTreeService
+from pyopentree import CompactTree
+from pyopentree import SyntheticTreeIndex
+from pyopentree import parse_ott_labels
+
+SYNTHETIC_TREE = "((A_ott1:1,B_ott2:2)AB_ott12,(C_ott3,'D x_ott4')CD,E_ott5)life_ott99;"
+
+class CountingOpenTreeService(OpenTreeService):
+
+    def __init__(self, *args, **kwargs):
+        OpenTreeService.__init__(self, *args, **kwargs)
+        self.mrca_calls = []
+        self.subtree_calls = []
+
+    def tol_mrca(self, ott_ids=None, node_ids=None):
+        self.mrca_calls.append((ott_ids, node_ids))
+        if ott_ids and -1 in ott_ids:
+            raise HTTPError("http://localhost/v2/tree_of_life/mrca", 400, "Bad Request", {}, io.BytesIO(b""))
+        return {"mrca_node_id": 1000 + len(self.mrca_calls), "ott_id": None}
+
+    def tol_subtree(self, ott_id=None, node_id=None, tree_id=None):
+        self.subtree_calls.append(ott_id)
+        index = SyntheticTreeIndex.from_newick(SYNTHETIC_TREE)
+        return {
+                "newick": index.as_newick(root=index.node_index(ott_id or 99)),
+                "tree_id": "opentree1.0",
+                }
+
+    def gol_node_info(self, ott_id=None, node_id=None, include_lineage=False):
+        response = {"ott_id": 99, "node_id": node_id, "num_tips": 5}
+        self.id_index.harvest(response)
+        return response
+
+class CompactTreeTest(unittest.TestCase):
+
+    def test_newick_round_trip(self):
+        tree = CompactTree.from_newick(SYNTHETIC_TREE)
+        self.assertEqual(len(tree), 8)
+        self.assertEqual(tree.as_newick(),
+                "((A_ott1:1.0,B_ott2:2.0)AB_ott12,(C_ott3,'D x_ott4')CD,E_ott5)life_ott99;")
+
+    def test_empty_labels(self):
+        tree = CompactTree.from_newick("(,(,));")
+        self.assertEqual(list(tree.tip_counts()), [3, 1, 2, 1, 1])
+        self.assertEqual(tree.as_newick(), "(,(,));")
+
+    def test_parse_ott_labels(self):
+        tree = CompactTree.from_newick(SYNTHETIC_TREE)
+        names, ott_ids = parse_ott_labels(tree.labels)
+        self.assertEqual(names, ["life", "AB", "A", "B", "CD", "C", "D x", "E"])
+        self.assertEqual(list(ott_ids), [99, 12, 1, 2, -1, 3, 4, 5])
+        names, ott_ids = parse_ott_labels([None, "ott7", "Foo_ott", "Bar_ott8_x"])
+        self.assertEqual(names, ["", "", "Foo_ott", "Bar_ott8_x"])
+        self.assertEqual(list(ott_ids), [-1, 7, -1, -1])
+
+    def test_subtree_end(self):
+        tree = CompactTree.from_newick(SYNTHETIC_TREE)
+        self.assertEqual(tree.subtree_end(1), 4)
+        self.assertEqual(tree.subtree_end(4), 7)
+        self.assertEqual(tree.subtree_end(0), 8)
+
+class SyntheticTreeIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.index = SyntheticTreeIndex.from_newick(SYNTHETIC_TREE)
+
+    def test_mrca(self):
+        self.assertEqual(self.index.mrca([1, 2])["ott_id"], 12)
+        self.assertEqual(self.index.mrca([1, 5])["mrca_name"], "life")
+        result = self.index.mrca([3, 4])
+        self.assertEqual(result["ott_id"], None)
+        self.assertEqual(result["mrca_name"], "CD")
+        self.assertEqual(result["nearest_taxon_mrca_ott_id"], 99)
+        self.assertEqual(self.index.mrca([1, 404]), None)
+
+    def test_num_tips(self):
+        self.assertEqual(self.index.num_tips(12), 2)
+        self.assertEqual(self.index.num_tips(99), 5)
+        self.assertEqual(self.index.num_tips(404), None)
+
+    def test_tol_mrca_many(self):
+        service = CountingOpenTreeService(max_workers=4)
+        service.synthetic_tree_index = self.index
+        results = service.tol_mrca_many([
+                [1, 2],
+                [404, 1],
+                {"ott_ids": [2, 1]},
+                [1, 404, 1],
+                {"node_ids": [7, 8]},
+                ])
+        self.assertEqual(len(service.mrca_calls), 2)
+        self.assertEqual(results[0]["ott_id"], 12)
+        self.assertTrue(results[0] is results[2])
+        self.assertTrue(results[1] is results[3])
+        self.assertTrue(results[1]["mrca_node_id"] > 1000)
+        self.assertTrue(results[4]["mrca_node_id"] > 1000)
+        self.assertRaises(ValueError, service.tol_mrca_many, [[]])
+
+    def test_tol_mrca_many_failed_request(self):
+        service = CountingOpenTreeService(max_workers=4)
+        results = service.tol_mrca_many([[1, 2], [-1, 2], [3]])
+        self.assertEqual(results[1], {"error": "HTTP Error 400: Bad Request"})
+        self.assertTrue(results[0]["mrca_node_id"] > 1000)
+        self.assertTrue(results[2]["mrca_node_id"] > 1000)
+
+    def test_tol_subtree_partitioned(self):
+        service = CountingOpenTreeService()
+        service.synthetic_tree_index = self.index
+        self.assertEqual(service.estimate_subtree_size(ott_id=12), 2)
+        self.assertEqual(service.estimate_subtree_size(node_id=1), 5)
+        result = service.tol_subtree_partitioned(ott_id=99, max_tips=2)
+        # the tips of the backbone are written from the index
+        self.assertEqual(sorted(service.subtree_calls), [12])
+        self.assertEqual(result["num_requests"], 1)
+        self.assertEqual(result["newick"],
+                "((A_ott1:1.0,B_ott2:2.0)AB_ott12,(C_ott3,'D x_ott4')CD,E_ott5)life_ott99;")
+        service.subtree_calls = []
+        result = service.tol_subtree_partitioned(ott_id=99, max_tips=1)
+        self.assertEqual(service.subtree_calls, [])
+        self.assertEqual(result["newick"], "((A_ott1,B_ott2)AB_ott12,(C_ott3,'D x_ott4')CD,E_ott5)life_ott99;")
+        result = service.tol_subtree_partitioned(node_id=1, max_tips=2)
+        self.assertEqual(service.subtree_calls, [12])
+        service.subtree_calls = []
+        result = service.tol_subtree_partitioned(node_id=1, max_tips=5)
+        self.assertEqual(service.subtree_calls, [None])
+        service.synthetic_tree_index = None
+        self.assertRaises(OpenTreeService.OpenTreeError,
+                service.tol_subtree_partitioned, node_id=1, max_tips=2)
+
+if __name__ == "__main__":
+    unittest.main()
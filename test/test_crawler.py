@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import io
+import json
+import shutil
+import tempfile
+import unittest
+
+from pyopentree import OpenTreeService
+from pyopentree.crawler import CorpusSync
+from pyopentree.crawler import StudyCrawler
+from pyopentree.opentreeservice import HTTPError
+
+class VersionedResponse(io.BytesIO):
+
+    def __init__(self, data, headers):
+        io.BytesIO.__init__(self, data)
+        self.headers = headers
+
+    def info(self):
+        return self.headers
+
+class VersionedStudyService(OpenTreeService):
+    """
+    Serves studies with ETags, honouring conditional requests.
+    """
+
+    def __init__(self, versions):
+        OpenTreeService.__init__(self, base_url="http://localhost/v2")
+        self.versions = versions
+        self.failing_study_ids = set()
+        self.requests = []
+
+    def open_url(self, request):
+        sub_url = request.get_full_url()[len(self.base_url):]
+        if sub_url == "/studies/find_studies":
+            data = {"matched_studies": [{"ot:studyId": study_id} for study_id in sorted(self.versions)]}
+            return VersionedResponse(json.dumps(data).encode("utf-8"), {})
+        study_id = sub_url.split("/")[2]
+        self.requests.append(study_id)
+        if study_id in self.failing_study_ids:
+            raise HTTPError(request.get_full_url(), 500, "Internal Server Error", {}, None)
+        etag = '"{}"'.format(self.versions[study_id])
+        if request.get_header("If-none-match") == etag:
+            raise HTTPError(request.get_full_url(), 304, "Not Modified", {}, None)
+        data = json.dumps({"nexml": {"^ot:studyId": study_id, "version": self.versions[study_id]}})
+        return VersionedResponse(data.encode("utf-8"), {"ETag": etag})
+
+class StudyCrawlerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.service = VersionedStudyService({"pg_1": 1, "pg_2": 1, "pg_3": 1})
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_conditional_recrawl(self):
+        crawler = StudyCrawler(self.service, self.tempdir, max_workers=2)
+        report = crawler.crawl()
+        self.assertEqual(report["fetched"], 3)
+        self.assertEqual(crawler.store.get("pg_2")["nexml"]["version"], 1)
+        self.service.versions["pg_2"] = 2
+        crawler = StudyCrawler(self.service, self.tempdir, max_workers=2)
+        report = crawler.crawl()
+        self.assertEqual(report["fetched"], 1)
+        self.assertEqual(report["not_modified"], 2)
+        self.assertEqual(crawler.store.get("pg_2")["nexml"]["version"], 2)
+
+    def test_resume(self):
+        self.service.failing_study_ids.add("pg_3")
+        crawler = StudyCrawler(self.service, self.tempdir)
+        report = crawler.crawl()
+        self.assertEqual(report["failed"], 1)
+        self.service.failing_study_ids.clear()
+        del self.service.requests[:]
+        crawler = StudyCrawler(self.service, self.tempdir)
+        report = crawler.crawl()
+        self.assertEqual(report["skipped"], 2)
+        self.assertEqual(report["fetched"], 1)
+        self.assertEqual(self.service.requests, ["pg_3"])
+        self.assertFalse(crawler.journal.is_crawl_in_progress)
+
+class SourceTreeService(VersionedStudyService):
+    """
+    Also serves the draft tree study list and source trees.
+    """
+
+    def __init__(self, versions):
+        VersionedStudyService.__init__(self, versions)
+        self.source_tree_requests = []
+
+    def study_list(self):
+        return [{"study_id": study_id, "tree_id": "tree1", "git_sha": "sha{}".format(version)}
+                for study_id, version in sorted(self.versions.items())]
+
+    def open_url(self, request):
+        sub_url = request.get_full_url()[len(self.base_url):]
+        if sub_url == "/tree_of_life/about":
+            return VersionedResponse(json.dumps({"study_list": self.study_list()}).encode("utf-8"), {})
+        if sub_url == "/graph/source_tree":
+            payload = json.loads(request.data.decode("utf-8"))
+            self.source_tree_requests.append((payload["study_id"], payload["git_sha"]))
+            return VersionedResponse(json.dumps({"newick": "(a,b);"}).encode("utf-8"), {})
+        return VersionedStudyService.open_url(self, request)
+
+class CorpusSyncTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_incremental_sync(self):
+        service = SourceTreeService({"pg_1": 1, "pg_2": 1, "pg_3": 1})
+        report = CorpusSync(service, self.tempdir).sync()
+        self.assertEqual((report["added"], report["changed"], report["removed"]), (3, 0, 0))
+        self.assertEqual(report["source_trees_fetched"], 3)
+        self.assertEqual(report["bytes_saved"], 0)
+        service = SourceTreeService({"pg_1": 1, "pg_2": 2, "pg_4": 1})
+        sync = CorpusSync(service, self.tempdir)
+        report = sync.sync()
+        self.assertEqual((report["added"], report["changed"], report["removed"], report["unchanged"]), (1, 1, 1, 1))
+        self.assertEqual(sorted(service.requests), ["pg_2", "pg_4"])
+        self.assertEqual(sorted(service.source_tree_requests), [("pg_2", "sha2"), ("pg_4", "sha1")])
+        self.assertEqual(report["bytes_saved"], len(sync.crawler.store.get_bytes("pg_1")))
+        self.assertEqual(sync.crawler.store.study_ids(), ["pg_1", "pg_2", "pg_4"])
+        self.assertEqual(sync.stored_study_list(), service.study_list())
+
+if __name__ == "__main__":
+    unittest.main()
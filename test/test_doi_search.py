@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import io
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+try:
+    import dendropy
+except ImportError:
+    dendropy = None
+
+EXAMPLE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+        os.pardir, "examples", "opentree-doi-search", "opentree-doi-search.py")
+
+def load_example():
+    """
+    Returns the opentree-doi-search example, imported as a module.
+    """
+    if "opentree_doi_search" in sys.modules:
+        return sys.modules["opentree_doi_search"]
+    if sys.hexversion < 0x03000000:
+        import imp
+        return imp.load_source(b"opentree_doi_search", EXAMPLE_PATH)
+    import importlib.util
+    spec = importlib.util.spec_from_file_location("opentree_doi_search", EXAMPLE_PATH)
+    module = importlib.util.module_from_spec(spec)
+    # registered, so that the process pool of get_trees can find its functions
+    sys.modules["opentree_doi_search"] = module
+    spec.loader.exec_module(module)
+    return module
+
+def study_service(example, doi_index_path, num_studies=5):
+    """
+    Returns an `OpenTreeDoiSearcher` answering locally for `num_studies`
+    studies, all with a DOI but "pg_3", and for the six trees of study
+    "pg_trees", and recording the sub-URLs requested.
+    """
+    class StudyService(example.OpenTreeDoiSearcher):
+
+        def open_url(self, request):
+            sub_url = request.get_full_url()[len(self.base_url):]
+            self.sub_urls.append(sub_url)
+            if sub_url == "/study/pg_trees/meta":
+                trees = {"trees1": {"treeById": {"tree{}".format(i): {} for i in range(6)}}}
+                return io.BytesIO(json.dumps({"nexml": {"treesById": trees}}).encode("utf-8"))
+            if sub_url.startswith("/study/pg_trees/tree/"):
+                tree_id = sub_url.split("/")[4].split(".")[0]
+                return io.BytesIO("((A,B),{}:1.5);\n".format(tree_id).encode("utf-8"))
+            if sub_url == "/studies/find_studies":
+                if "property" in json.loads(request.data.decode("utf-8")):
+                    studies = []
+                else:
+                    studies = [{"ot:studyId": "pg_{}".format(i)} for i in range(num_studies)]
+                return io.BytesIO(json.dumps({"matched_studies": studies}).encode("utf-8"))
+            study_id = sub_url.split("/")[2]
+            study = {"^ot:studyPublicationReference": "Ref {}".format(study_id)}
+            if study_id != "pg_3":
+                study["^ot:studyPublication"] = {"@href": "http://dx.doi.org/10.1/{}".format(study_id.upper())}
+            return io.BytesIO(json.dumps({"nexml": study}).encode("utf-8"))
+
+    service = StudyService(base_url="http://localhost/v2", doi_index_path=doi_index_path)
+    service.sub_urls = []
+    return service
+
+@unittest.skipIf(dendropy is None, "DendroPy is not installed")
+class DoiIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.example = load_example()
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_normalize_doi(self):
+        normalize_doi = self.example.normalize_doi
+        self.assertEqual(normalize_doi("http://dx.doi.org/10.1111/J.1365-294X.2012.05606.x"), "10.1111/j.1365-294x.2012.05606.x")
+        self.assertEqual(normalize_doi(" https://doi.org/10.1/ABC\n"), "10.1/abc")
+        self.assertEqual(normalize_doi("DOI:10.1/abc"), "10.1/abc")
+        self.assertEqual(normalize_doi("10.1/abc"), "10.1/abc")
+
+    def test_lookup_and_persistence(self):
+        path = os.path.join(self.tempdir, "index.json")
+        index = self.example.DoiIndex(path)
+        self.assertEqual(len(index), 0)
+        index.add("pg_1", "http://dx.doi.org/10.1/ABC", "Ref 1")
+        index.add("pg_2", "doi:10.1/abc", "Ref 2")
+        index.add("pg_3", None, "Ref 3")
+        index.add("pg_1", "http://dx.doi.org/10.1/ABC", "Ref 1")
+        self.assertEqual(index.lookup_doi("https://doi.org/10.1/Abc"), ["pg_1", "pg_2"])
+        self.assertEqual(index.lookup_doi("10.1/xyz"), [])
+        self.assertTrue("pg_3" in index)
+        self.assertFalse(os.path.exists(path))
+        index.save()
+        self.assertEqual(os.listdir(self.tempdir), ["index.json"])
+        index = self.example.DoiIndex(path)
+        self.assertEqual(len(index), 3)
+        self.assertEqual(index.studies["pg_3"], (None, "Ref 3"))
+        self.assertEqual(index.lookup_doi("10.1/abc"), ["pg_1", "pg_2"])
+
+    def test_no_path(self):
+        index = self.example.DoiIndex()
+        index.add("pg_1", "10.1/abc", "Ref 1")
+        index.save()
+        self.assertEqual(os.listdir(self.tempdir), [])
+
+@unittest.skipIf(dendropy is None, "DendroPy is not installed")
+class YieldStudiesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.example = load_example()
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, "index.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_in_order(self):
+        service = study_service(self.example, self.path, num_studies=50)
+        service.doi_index.add("pg_7", "10.1/indexed", "Indexed")
+        studies = list(service.yield_studies(window_size=4, max_workers=3))
+        self.assertEqual([s.study_id for s in studies], ["pg_{}".format(i) for i in range(50) if i != 3])
+        self.assertEqual(studies[6].doi, "10.1/indexed")
+        self.assertEqual(studies[0].citation, "Ref pg_0")
+        self.assertFalse("/study/pg_7/meta" in service.sub_urls)
+        self.assertEqual(len(self.example.DoiIndex(self.path)), 50)
+        # listed again from the saved index, without fetching any metadata
+        service = study_service(self.example, self.path, num_studies=50)
+        studies = list(service.yield_studies(list_from=11, max_studies=5))
+        self.assertEqual([s.study_id for s in studies], ["pg_{}".format(i) for i in range(10, 15)])
+        self.assertEqual(service.sub_urls, ["/studies/find_studies"])
+
+    def test_abandoned(self):
+        service = study_service(self.example, self.path, num_studies=50)
+        studies = service.yield_studies(window_size=4, max_workers=2)
+        self.assertEqual(next(studies).study_id, "pg_0")
+        studies.close()
+        # the metadata fetched so far is kept, and no more is fetched
+        num_fetched = len(service.sub_urls) - 1
+        self.assertTrue(1 <= num_fetched <= 5)
+        self.assertTrue("pg_0" in self.example.DoiIndex(self.path))
+        self.assertEqual(len(service.sub_urls) - 1, num_fetched)
+
+@unittest.skipIf(dendropy is None, "DendroPy is not installed")
+class GetTreesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.example = load_example()
+        self.tempdir = tempfile.mkdtemp()
+        self.service = study_service(self.example, os.path.join(self.tempdir, "index.json"))
+        self.service.doi_index.add("pg_trees", "10.1/trees", "Ref pg_trees")
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def check_compact_trees(self, trees):
+        newicks = sorted(tree.as_newick() for tree in trees)
+        self.assertEqual(newicks, ["((A,B),tree{}:1.5);".format(i) for i in range(6)])
+
+    def test_compact_trees(self):
+        self.check_compact_trees(self.service.get_trees("doi:10.1/TREES", as_compact_trees=True, num_processes=1))
+        self.assertEqual(self.service.get_trees("10.1/none", as_compact_trees=True), None)
+
+    @unittest.skipUnless(getattr(multiprocessing, "get_start_method", lambda: "fork")() == "fork",
+            "worker processes cannot import the example")
+    def test_compact_trees_in_processes(self):
+        self.check_compact_trees(self.service.get_trees("10.1/trees", as_compact_trees=True, num_processes=3))
+
+    def test_dendropy_trees(self):
+        trees = self.service.get_trees("10.1/trees")
+        self.assertEqual(len(trees), 6)
+        self.assertEqual(len(trees.taxon_namespace), 8)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import gzip
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from pyopentree import OpenTreeService
+from pyopentree import TreeExporter
+from pyopentree import load_export_index
+from pyopentree import read_exported_tree
+from pyopentree.opentreeservice import HTTPError
+
+class TreeServingService(OpenTreeService):
+
+    def __init__(self, *args, **kwargs):
+        OpenTreeService.__init__(self, base_url="http://localhost/v2", *args, **kwargs)
+
+    def open_url(self, request):
+        sub_url = request.get_full_url()[len(self.base_url):]
+        if sub_url == "/studies/find_trees":
+            return io.BytesIO(json.dumps({"matched_studies": [
+                {"ot:studyId": "pg_{}".format(i), "matched_trees": [
+                    {"nexson_id": "tree{}".format(j)} for j in range(3)]}
+                for i in range(10)]}).encode("utf-8"))
+        if sub_url == "/study/pg_4/tree/tree1.tre":
+            raise HTTPError(request.get_full_url(), 500, "Internal Server Error", {}, None)
+        study_id, tree_id = sub_url.split("/")[2], sub_url.split("/")[4][:-len(".tre")]
+        return io.BytesIO("(({0}_{1}_a,{0}_{1}_b),c);\n".format(study_id, tree_id).encode("utf-8"))
+
+class TreeExporterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, "trees.tre.gz")
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_export_newick(self):
+        exporter = TreeExporter(TreeServingService(max_workers=4), window_size=7)
+        stats = exporter.export_query(self.path, "ot:ottTaxonName", "Garcinia")
+        self.assertEqual(stats["num_trees"], 29)
+        self.assertEqual(stats["failed"], [("pg_4", "tree1")])
+        with gzip.open(self.path, "rb") as src:
+            lines = src.read().decode("utf-8").splitlines()
+        self.assertEqual(len(lines), 29)
+        self.assertEqual(lines[0], "((pg_0_tree0_a,pg_0_tree0_b),c);")
+        index = load_export_index(self.path)
+        self.assertEqual(len(index), 29)
+        self.assertFalse(("pg_4", "tree1") in index)
+        self.assertEqual(read_exported_tree(self.path, *index[("pg_9", "tree2")]), "((pg_9_tree2_a,pg_9_tree2_b),c);\n")
+
+    def test_export_nexus(self):
+        exporter = TreeExporter(TreeServingService())
+        stats = exporter.export(self.path, [("pg_1", "tree0"), ("pg_2", "tree2")], schema="nexus")
+        self.assertEqual(stats["num_trees"], 2)
+        with gzip.open(self.path, "rb") as src:
+            nexus = src.read().decode("utf-8")
+        self.assertTrue(nexus.startswith("#NEXUS\n\nBEGIN TREES;\n    TREE pg_1_tree0 = [&R] ((pg_1_tree0_a,pg_1_tree0_b),c);\n"))
+        self.assertTrue(nexus.endswith("END;\n"))
+        index = load_export_index(self.path)
+        self.assertEqual(read_exported_tree(self.path, *index[("pg_2", "tree2")]), "    TREE pg_2_tree2 = [&R] ((pg_2_tree2_a,pg_2_tree2_b),c);\n")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import io
+import json
+import unittest
+
+from pyopentree import iter_array_items
+from pyopentree import jsonstream
+
+class IterArrayItemsTest(unittest.TestCase):
+
+    def test_items_across_chunks(self):
+        document = {
+                "before": {"a": [1, 2, {"b": "]"}]},
+                "matched_studies": [{"ot:studyId": "pg_{}".format(i), "n": 12345.5, "s": "caf\u00e9 \"x\""} for i in range(20)],
+                "after": 123,
+                }
+        data = json.dumps(document, ensure_ascii=False).encode("utf-8")
+        for chunk_size in (1, 2, 3, 7, 1 << 16):
+            other_members = {}
+            items = list(iter_array_items(io.BytesIO(data), "matched_studies", chunk_size=chunk_size, other_members=other_members))
+            self.assertEqual(items, document["matched_studies"])
+            self.assertEqual(other_members, {"before": document["before"], "after": 123})
+
+    def test_large_value_decoded_once(self):
+        item = {"s": "\\\"]}" * 1000, "a": [[i, "x\\"] for i in range(1000)], "n": -1.5e3}
+        data = json.dumps({"matched_studies": [item, True, None]}).encode("utf-8")
+        decoder = jsonstream._DECODER
+        calls = []
+        class CountingDecoder(object):
+            def raw_decode(self, s, idx=0):
+                calls.append(idx)
+                return decoder.raw_decode(s, idx)
+        jsonstream._DECODER = CountingDecoder()
+        try:
+            items = list(iter_array_items(io.BytesIO(data), "matched_studies", chunk_size=5))
+        finally:
+            jsonstream._DECODER = decoder
+        self.assertEqual(items, [item, True, None])
+        # the key and each of the items, whatever the number of chunks
+        self.assertEqual(len(calls), 4)
+
+    def test_missing_or_empty(self):
+        self.assertEqual(list(iter_array_items(io.BytesIO(b'{"error": "no"}'), "matched_studies")), [])
+        self.assertEqual(list(iter_array_items(io.BytesIO(b'{}'), "matched_studies")), [])
+        self.assertEqual(list(iter_array_items(io.BytesIO(b'{"matched_studies": [ ]}'), "matched_studies")), [])
+
+    def test_truncated(self):
+        stream = io.BytesIO(b'{"matched_studies": [{"a": 1}, {"a": ')
+        items = iter_array_items(stream, "matched_studies", chunk_size=4)
+        self.assertEqual(next(items), {"a": 1})
+        self.assertRaises(ValueError, next, items)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+if sys.hexversion < 0x03000000:
+    from urllib2 import HTTPError
+else:
+    from urllib.error import HTTPError
+
+from pyopentree import canonical_request_key
+from pyopentree.mockserver import MockOpenTreeServer
+from pyopentree import OpenTreeService
+
+FIXTURES = {
+    "test_mrca": {
+        "test_function": "tol_mrca",
+        "test_input": {"ott_ids": [412129, 536234]},
+        "tests": {
+            "contains": [["mrca_node_id", "Doesn't contain node id"]],
+            "equals": [[["nearest_taxon_mrca_unique_name", "Canis"], "Wrong taxon"]],
+            "deep_equals": [[[["lineage", 0, "ot:ottId"], 7], "Wrong lineage"]],
+            "length_greater_than": [[["ott_ids_not_in_tree", 2], "Too few"]],
+        },
+    },
+    "test_find_studies": {
+        "test_function": "studies_find_studies",
+        "test_input": {"property": "ot:studyId", "value": "pg_719"},
+        "tests": {"contains_error": ["Should be an error"]},
+    },
+}
+
+class MockOpenTreeServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = MockOpenTreeServer().start()
+        self.service = OpenTreeService(base_url=self.server.base_url)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_canonical_request_key(self):
+        self.assertEqual(
+                canonical_request_key("post", "/tol/mrca", {"b": 1, "a": [2]}),
+                'POST /tol/mrca {"a":[2],"b":1}')
+        self.assertEqual(
+                canonical_request_key("POST", "/tol/about"),
+                canonical_request_key("POST", "/tol/about", {}))
+        self.assertEqual(canonical_request_key("GET", "/study/pg_1?y=2&x=1"), "GET /study/pg_1?x=1&y=2")
+
+    def test_query_string(self):
+        self.server.add_response("/study/pg_1/tree/tree1.tre?subtree_id=node1", "(a,b);", method="GET")
+        self.server.add_response("/study/pg_1/tree/tree1.tre?subtree_id=node2", "(c,d);", method="GET")
+        self.assertEqual(self.service.get_study_subtree("pg_1", "tree1", "node1", schema="newick"), "(a,b);")
+        self.assertEqual(self.service.get_study_subtree("pg_1", "tree1", "node2", schema="newick"), "(c,d);")
+        self.assertEqual(self.server.stats["unmatched"], 0)
+
+    def test_recorded_responses(self):
+        self.server.add_response("/taxonomy/taxon", {"ot:ottId": 1, "node_id": 10}, payload={"include_lineage": False, "ott_id": 1})
+        self.server.add_response("/study/pg_1/tree/tree1.tre", "(a,b);", method="GET")
+        self.assertEqual(self.service.taxonomy_taxon(1), {"ot:ottId": 1, "node_id": 10})
+        self.assertEqual(self.service.get_study_tree("pg_1", "tree1", schema="newick"), "(a,b);")
+        with self.assertRaises(HTTPError) as cm:
+            self.service.taxonomy_taxon(2)
+        self.assertEqual(cm.exception.code, 404)
+        self.assertEqual(self.server.stats["requests"], 3)
+        self.assertEqual(self.server.stats["unmatched"], 1)
+        self.assertEqual(self.server.stats["connections"], 3)
+
+    def test_load_recordings(self):
+        tempdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tempdir, "recordings.jsonl")
+            with io.open(path, "w", encoding="utf-8") as dest:
+                dest.write(json.dumps({"sub_url": "/tnrs/contexts", "body": {"PLANTS": ["Plants"]}}) + "\n")
+            self.assertEqual(self.server.load_recordings(path), 1)
+        finally:
+            shutil.rmtree(tempdir)
+        self.assertEqual(self.service.tnrs_contexts(), {"PLANTS": ["Plants"]})
+
+    def test_fixtures(self):
+        self.assertEqual(self.server.load_fixtures(FIXTURES), 2)
+        response = self.service.tol_mrca(ott_ids=[412129, 536234])
+        self.assertIn("mrca_node_id", response)
+        self.assertEqual(response["nearest_taxon_mrca_unique_name"], "Canis")
+        self.assertEqual(response["lineage"][0]["ot:ottId"], 7)
+        self.assertEqual(len(response["ott_ids_not_in_tree"]), 3)
+        with self.assertRaises(OpenTreeService.OpenTreeError):
+            self.service.studies_find_studies(property_name="ot:studyId", property_value="pg_719")
+
+    def test_error_injection_and_concurrency(self):
+        self.server.add_response("/tnrs/contexts", {"PLANTS": ["Plants"]})
+        self.server.error_rate = 1.0
+        self.server.error_status = 503
+        with self.assertRaises(HTTPError) as cm:
+            self.service.tnrs_contexts()
+        self.assertEqual(cm.exception.code, 503)
+        self.server.error_rate = 0.0
+        self.server.latency = 0.05
+        self.server.reset_stats()
+        results = self.service.map_concurrently(lambda i: self.service.tnrs_contexts(), range(8), max_workers=8)
+        self.assertEqual(results, [{"PLANTS": ["Plants"]}] * 8)
+        self.assertEqual(self.server.stats["connections"], 8)
+        self.assertGreater(self.server.stats["peak_connections"], 1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from collections import OrderedDict
+
+from pyopentree import LazyStudy
+from pyopentree import OpenTreeService
+from pyopentree import study_tree_as_newick
+from pyopentree import study_tree_as_nexus
+from pyopentree import study_tree_as_nexml
+from pyopentree import study_tree_as_nexson
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+def read_study_bytes():
+    with open(os.path.join(DATA_DIR, "pg_test.json"), "rb") as src:
+        return src.read()
+
+class LazyStudyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.raw = read_study_bytes()
+        self.study = LazyStudy(self.raw)
+
+    def test_sections_parsed_on_demand(self):
+        self.assertEqual(self.study._otus, None)
+        self.assertEqual(self.study._trees, {})
+        self.assertEqual(self.study.metadata["^ot:studyPublication"]["@href"], "http://dx.doi.org/10.1/test")
+        self.assertTrue("otusById" not in self.study.metadata)
+        self.assertEqual(self.study._otus, None)
+
+    def test_otus(self):
+        otus = self.study.otus
+        self.assertEqual(len(otus), 4)
+        self.assertEqual(otus["otu2"].ott_id, 417950)
+        self.assertEqual(otus["otu4"].ott_id, None)
+
+    def test_trees(self):
+        self.assertEqual(self.study.tree_ids(), ["tree1", "tree2"])
+        tree = self.study.tree("tree1")
+        self.assertEqual(tree.root_node_id, "n1")
+        self.assertEqual(tree.ingroup_node_id, "n2")
+        self.assertEqual(len(tree), 7)
+        self.assertEqual(sorted(tree.children("n2")), ["n3", "n6"])
+        self.assertEqual(tree.node_by_id["n4"].edge_length, 0.125)
+        self.assertEqual(self.study.tree_dict("tree2")["^ot:rootNodeId"], "m1")
+
+    def test_wrapped_study(self):
+        wrapped = '{"sha": "abc", "data": ' + self.raw.decode("utf-8") + '}'
+        study = LazyStudy(wrapped.encode("utf-8"))
+        self.assertEqual(study.tree_ids(), ["tree1", "tree2"])
+        self.assertEqual(study.as_dict()["sha"], "abc")
+
+class StudyTreeWritersTest(unittest.TestCase):
+
+    def setUp(self):
+        self.raw = read_study_bytes()
+
+    def test_newick(self):
+        for study in (LazyStudy(self.raw), json.loads(self.raw.decode("utf-8"))):
+            self.assertEqual(study_tree_as_newick(study, "tree1"),
+                    "((('Homo sapiens':0.125,'Pan troglodytes':0.125):0.25,'Gorilla gorilla':1):0.5,'Macaca''s mulatta':2);")
+            self.assertEqual(study_tree_as_newick(study, "tree1", "ingroup"),
+                    "(('Homo sapiens':0.125,'Pan troglodytes':0.125):0.25,'Gorilla gorilla':1);")
+        self.assertRaises(KeyError, study_tree_as_newick, study, "tree1", "nx")
+
+    def test_nexus(self):
+        nexus = study_tree_as_nexus(LazyStudy(self.raw), "tree2")
+        self.assertTrue("DIMENSIONS NTAX=2;" in nexus)
+        self.assertTrue("TREE tree2 = [&R] ('Homo sapiens','Gorilla gorilla');" in nexus)
+
+    def test_nexus_duplicate_labels(self):
+        # parsed in document order, which is that of the children of a node
+        study = json.loads(self.raw.decode("utf-8"), object_pairs_hook=OrderedDict)
+        study["nexml"]["otusById"]["otus1"]["otuById"]["otu3"]["^ot:originalLabel"] = "Homo sapiens"
+        nexus = study_tree_as_nexus(study, "tree2")
+        self.assertTrue("DIMENSIONS NTAX=2;" in nexus)
+        self.assertTrue("        'Homo sapiens'\n        'Homo sapiens_otu3'\n" in nexus)
+        self.assertTrue("TREE tree2 = [&R] ('Homo sapiens','Homo sapiens_otu3');" in nexus)
+
+    def test_nexml(self):
+        nexml = study_tree_as_nexml(LazyStudy(self.raw), "tree1", "n3")
+        self.assertTrue('<node id="n3" root="true"/>' in nexml)
+        self.assertTrue('<edge id="edge_n4" source="n3" target="n4" length="0.125"/>' in nexml)
+        self.assertFalse('id="n6"' in nexml)
+
+    def test_nexson_subtree(self):
+        subtree = study_tree_as_nexson(LazyStudy(self.raw), "tree1", "n3")["tree1"]
+        self.assertEqual(sorted(subtree["nodeById"]), ["n3", "n4", "n5"])
+        self.assertEqual(sorted(subtree["edgeBySourceId"]), ["n3"])
+        self.assertEqual(subtree["^ot:rootNodeId"], "n3")
+
+class StudyOnlyService(OpenTreeService):
+
+    def __init__(self, raw):
+        OpenTreeService.__init__(self, base_url="http://localhost/v2")
+        self.raw = raw
+        self.sub_urls = []
+
+    def open_url(self, request):
+        sub_url = request.get_full_url()[len(self.base_url):]
+        self.sub_urls.append(sub_url)
+        if not sub_url.startswith("/study/pg_"):
+            raise AssertionError(sub_url)
+        return io.BytesIO(self.raw)
+
+class LazyGetStudyTest(unittest.TestCase):
+
+    def test_error_document(self):
+        service = StudyOnlyService(b'{"error": "study pg_0 not found"}')
+        with self.assertRaises(OpenTreeService.OpenTreeError) as cm:
+            service.get_study("pg_0", lazy=True)
+        self.assertEqual(str(cm.exception), "study pg_0 not found")
+        service = StudyOnlyService(b'{"description": "not a study"}')
+        self.assertRaises(ValueError, service.get_study, "pg_0", lazy=True)
+
+class StudyCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_trees_rendered_from_one_download(self):
+        service = StudyOnlyService(read_study_bytes())
+        service.use_study_cache(self.tempdir)
+        for schema in ("newick", "nexus", "nexml", "nexson"):
+            service.get_study_tree("pg_test", "tree1", schema=schema)
+            service.get_study_subtree("pg_test", "tree1", "ingroup", schema=schema)
+        self.assertEqual(service.get_study_tree("pg_test", "tree2", schema="newick"),
+                "('Homo sapiens','Gorilla gorilla');")
+        self.assertEqual(service.sub_urls, ["/study/pg_test"])
+        service = StudyOnlyService(None)
+        service.use_study_cache(self.tempdir)
+        self.assertEqual(service.get_study("pg_test")["nexml"]["^ot:studyPublication"]["@href"], "http://dx.doi.org/10.1/test")
+        self.assertEqual(service.sub_urls, [])
+
+    def test_missing_tree_or_node(self):
+        service = StudyOnlyService(read_study_bytes())
+        service.use_study_cache(self.tempdir)
+        self.assertRaises(OpenTreeService.OpenTreeError, service.get_study_tree, "pg_test", "tree9", schema="newick")
+        self.assertRaises(OpenTreeService.OpenTreeError, service.get_study_subtree, "pg_test", "tree1", "n9", schema="nexus")
+        self.assertRaises(OpenTreeService.OpenTreeError, service.get_study_subtree, "pg_test", "tree2", "ingroup", schema="newick")
+
+    def test_error_document_not_cached(self):
+        service = StudyOnlyService(b'{"error": "study pg_0 not found"}')
+        store = service.use_study_cache(self.tempdir)
+        self.assertRaises(OpenTreeService.OpenTreeError, service.get_study_tree, "pg_0", "tree1", schema="newick")
+        self.assertEqual(store.get_bytes("pg_0"), None)
+
+class OtuIndexTest(unittest.TestCase):
+
+    def test_lookup(self):
+        otu_index = LazyStudy(read_study_bytes()).otu_index
+        self.assertEqual([otu.otu_id for otu in otu_index.lookup_label("Gorilla gorilla")], ["otu3"])
+        self.assertEqual(otu_index.lookup_label("macaca's MULATTA"), [])
+        self.assertEqual([otu.otu_id for otu in otu_index.lookup_label("macaca's MULATTA", ignore_case=True)], ["otu4"])
+        self.assertEqual([otu.otu_id for otu in otu_index.lookup_ott_id(417950)], ["otu2"])
+
+    def test_batch_lookup_across_studies(self):
+        service = StudyOnlyService(read_study_bytes())
+        results = service.lookup_study_otus_by_label(
+                [("pg_1", "Homo sapiens"), ("pg_2", "Homo sapiens"), ("pg_1", "Pongo")] * 50)
+        self.assertEqual(len(results), 150)
+        self.assertEqual([otu.otu_id for otu in results[1]], ["otu1"])
+        self.assertEqual(results[2], [])
+        results = service.lookup_study_otus_by_ott_id([("pg_2", 417969), ("pg_3", 417969)])
+        self.assertEqual([otu.otu_id for otu in results[1]], ["otu3"])
+        self.assertEqual(sorted(service.sub_urls), ["/study/pg_1", "/study/pg_2", "/study/pg_3"])
+
+    def test_batch_lookup_failed_study(self):
+        service = StudyOnlyService(read_study_bytes())
+        open_url = service.open_url
+        def open_study(request):
+            if request.get_full_url().endswith("/pg_0"):
+                return io.BytesIO(b'{"error": "study pg_0 not found"}')
+            return open_url(request)
+        service.open_url = open_study
+        results = service.lookup_study_otus_by_label([("pg_0", "Homo sapiens"), ("pg_1", "Homo sapiens")])
+        self.assertEqual(results[0], {"error": "study pg_0 not found"})
+        self.assertEqual([otu.otu_id for otu in results[1]], ["otu1"])
+        # in testing mode, the error document is returned by get_study
+        service.is_testing_mode = True
+        service._otu_indexes.clear()
+        results = service.lookup_study_otus_by_ott_id([("pg_0", 417969), ("pg_1", "417969")])
+        self.assertEqual(results[0], {"error": "study pg_0 not found"})
+        self.assertEqual([otu.otu_id for otu in results[1]], ["otu3"])
+
+    def test_indexes_bounded(self):
+        service = StudyOnlyService(read_study_bytes())
+        size = OpenTreeService.OTU_INDEX_MEMORY_SIZE
+        results = service.lookup_study_otus_by_ott_id([("pg_{}".format(i), 417969) for i in range(size + 10)])
+        self.assertTrue(all([otu.otu_id for otu in result] == ["otu3"] for result in results))
+        self.assertEqual(len(service._otu_indexes), size)
+        service.study_otu_index("pg_{}".format(size + 9))
+        self.assertEqual(len(service.sub_urls), size + 10)
+
+if __name__ == "__main__":
+    unittest.main()
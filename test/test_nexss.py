@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import os
+import sys
+import unittest
+
+try:
+    import dendropy
+except ImportError:
+    dendropy = None
+
+EXAMPLE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+        os.pardir, "examples", "opentree-nexss", "opentree-nexss.py")
+
+def load_example():
+    """
+    Returns the opentree-nexss example, imported as a module.
+    """
+    if "opentree_nexss" in sys.modules:
+        return sys.modules["opentree_nexss"]
+    if sys.hexversion < 0x03000000:
+        import imp
+        return imp.load_source(b"opentree_nexss", EXAMPLE_PATH)
+    import importlib.util
+    spec = importlib.util.spec_from_file_location("opentree_nexss", EXAMPLE_PATH)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["opentree_nexss"] = module
+    spec.loader.exec_module(module)
+    return module
+
+@unittest.skipIf(dendropy is None, "DendroPy is not installed")
+class RelabelTest(unittest.TestCase):
+
+    NEWICK = "((Homo_sapiens_ott770315,Pan_paniscus)Homininae_ott312031,ott417950)mrcaott1ott2;"
+
+    def relabel(self, **kwargs):
+        tree = dendropy.Tree.get_from_string(
+            src=RelabelTest.NEWICK,
+            schema='newick',
+            preserve_underscores=True,
+            suppress_internal_node_taxa=False)
+        load_example().parse_opentree_taxon_labels_in_dendropy_tree(tree=tree, **kwargs)
+        return [node.taxon.label for node in tree.preorder_node_iter() if node.taxon is not None]
+
+    def test_relabel(self):
+        self.assertEqual(self.relabel(),
+                ["mrcaott1ott2", "Homininae_ott312031", "Homo_sapiens_ott770315", "Pan_paniscus", "_ott417950"])
+        self.assertEqual(self.relabel(keep_ott_id=False),
+                ["mrcaott1ott2", "Homininae", "Homo_sapiens", "Pan_paniscus", ""])
+        self.assertEqual(self.relabel(keep_taxon_name=False),
+                ["mrcaott1ott2", "ott312031", "ott770315", "Pan_paniscus", "ott417950"])
+
+@unittest.skipIf(dendropy is None, "DendroPy is not installed")
+class StyleSheetTest(unittest.TestCase):
+
+    def test_set_style(self):
+        nexss = load_example().NEXSS()
+        nexss.set_style("clade", "A", {"color": "red"})
+        nexss.set_style("clade", "A", {"width": "2"}, mode="append")
+        self.assertEqual(nexss.rules[nexss.style_id("clade", "A")], {"color": "red", "width": "2"})
+        self.assertRaises(ValueError, nexss.set_style, "clade", "A", {}, mode="replace")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,344 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from pyopentree import OpenTreeService
+from pyopentree import IdIndex
+from pyopentree import NodeInfoBatch
+from pyopentree import SourceTreeCache
+from pyopentree.opentreeservice import HTTPError
+from pyopentree.opentreeservice import URLError
+
+class CannedOpenTreeService(OpenTreeService):
+    """
+    Serves responses from a dictionary mapping (sub-URL, payload) to response
+    objects instead of from the network, and records the requests made.
+    """
+
+    def __init__(self, responses, *args, **kwargs):
+        OpenTreeService.__init__(self, base_url="http://localhost/v2", *args, **kwargs)
+        self.responses = responses
+        self.requests = []
+
+    def open_url(self, request):
+        sub_url = request.get_full_url()[len(self.base_url):]
+        data = request.data
+        payload = json.loads(data.decode("utf-8")) if data else None
+        self.requests.append((sub_url, payload))
+        response = self.responses(sub_url, payload)
+        if not isinstance(response, bytes):
+            response = json.dumps(response).encode("utf-8")
+        return io.BytesIO(response)
+
+class VersionedResponse(io.BytesIO):
+
+    def __init__(self, data, headers):
+        io.BytesIO.__init__(self, data)
+        self.headers = headers
+
+    def info(self):
+        return self.headers
+
+class ValidatingOpenTreeService(CannedOpenTreeService):
+    """
+    A :class:`CannedOpenTreeService` that serves GET responses with an ETag
+    (the digest of the response), honouring conditional requests, and
+    records the sub-URLs answered with a 304.
+    """
+
+    def __init__(self, responses, *args, **kwargs):
+        CannedOpenTreeService.__init__(self, responses, *args, **kwargs)
+        self.not_modified = []
+
+    def open_url(self, request):
+        response = CannedOpenTreeService.open_url(self, request)
+        if request.get_method() != "GET":
+            return response
+        data = response.read()
+        etag = '"{}"'.format(hashlib.sha1(data).hexdigest())
+        if request.get_header("If-none-match") == etag:
+            self.not_modified.append(self.requests[-1][0])
+            raise HTTPError(request.get_full_url(), 304, "Not Modified", {}, None)
+        return VersionedResponse(data, {"ETag": etag})
+
+NODE_INFO = {
+        (3, None): {"node_id": 3, "ott_id": 30, "num_tips": 1, "lineage": [
+            {"node_id": 2, "ott_id": 20},
+            {"node_id": 1, "ott_id": None}]},
+        (None, 40): {"node_id": 4, "ott_id": 40, "num_tips": 1},
+        }
+
+def node_info_responses(sub_url, payload):
+    if sub_url == "/graph/node_info":
+        key = (payload["node_id"], payload["ott_id"])
+        if key == (None, 503):
+            raise URLError("connection refused")
+        if key in NODE_INFO:
+            return NODE_INFO[key]
+        return {"error": "not found"}
+    if sub_url == "/tree_of_life/mrca":
+        return {"mrca_node_id": 5, "ott_id": 50, "nearest_taxon_mrca_node_id": 5, "nearest_taxon_mrca_ott_id": 50}
+    raise AssertionError(sub_url)
+
+class IdIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_harvested_from_responses(self):
+        service = CannedOpenTreeService(node_info_responses)
+        service.gol_node_info(node_id=3, include_lineage=True)
+        service.tol_mrca(ott_ids=[30, 40])
+        self.assertEqual(service.id_index.node_id_to_ott_id, {3: 30, 2: 20, 5: 50})
+        self.assertEqual(service.id_index.ott_id_to_node_id[50], 5)
+
+    def test_bulk_conversion(self):
+        service = CannedOpenTreeService(node_info_responses)
+        service.gol_node_info(node_id=3, include_lineage=True)
+        del service.requests[:]
+        self.assertEqual(
+                service.node_ids_to_ott_ids([3, 2, 3, 99]),
+                {3: 30, 2: 20, 99: None})
+        self.assertEqual(service.requests, [
+            ("/graph/node_info", {"node_id": 99, "ott_id": None, "include_lineage": False})])
+        self.assertEqual(service.ott_ids_to_node_ids([20, 40]), {20: 2, 40: 4})
+        del service.requests[:]
+        self.assertEqual(service.node_ids_to_ott_ids([99, 1]), {99: None, 1: None})
+        self.assertEqual(service.node_ids_to_ott_ids([99, 1]), {99: None, 1: None})
+        self.assertEqual(service.requests, [
+            ("/graph/node_info", {"node_id": 1, "ott_id": None, "include_lineage": False})])
+        # an id that could not be looked up is not taken to be missing
+        self.assertEqual(service.ott_ids_to_node_ids([503]), {503: None})
+        self.assertFalse(503 in service.id_index.missing["ott_id"])
+
+    def test_save_and_load(self):
+        index = IdIndex()
+        index.add(1, 10)
+        index.add(2, 20)
+        path = os.path.join(self.tempdir, "ids.bin")
+        index.save(path)
+        self.assertEqual(os.path.getsize(path), 16)
+        loaded = IdIndex.load(path)
+        self.assertEqual(loaded.node_id_to_ott_id, {1: 10, 2: 20})
+        self.assertEqual(loaded.ott_id_to_node_id, {10: 1, 20: 2})
+
+class NodeInfoManyTest(unittest.TestCase):
+
+    def test_shared_lineage(self):
+        service = CannedOpenTreeService(node_info_responses)
+        batch = service.gol_node_info_many(node_ids=[3, 404], ott_ids=[40, 503])
+        self.assertEqual(len(batch), 4)
+        self.assertEqual(batch[0].ott_id, 30)
+        self.assertEqual(batch[1], None)
+        self.assertEqual(batch[3], None)
+        self.assertEqual(sorted(batch.errors), [1, 3])
+        self.assertEqual(batch.errors[1], "not found")
+        self.assertTrue("connection refused" in batch.errors[3])
+        self.assertEqual(batch[2].node_id, 4)
+        self.assertEqual([node.node_id for node in batch.lineage(batch[0])], [2, 1])
+        self.assertEqual(batch.lineage(batch[2]), [])
+        self.assertEqual(sorted(batch.nodes), [1, 2])
+
+    def test_shared_strings(self):
+        response = {"node_id": 3, "rank": "".join(["spe", "cies"]), "lineage": [
+            {"node_id": 2, "rank": "".join(["gen", "us"])}]}
+        first = NodeInfoBatch(2)
+        first.add_response(0, response)
+        first.add_response(1, {"node_id": 4, "rank": "".join(["spe", "cies"]), "lineage": [{"node_id": 2}]})
+        self.assertTrue(first[0].rank is first[1].rank)
+        second = NodeInfoBatch(1)
+        second.add_response(0, {"node_id": 4, "rank": "".join(["spe", "cies"])})
+        # the strings of a batch are not kept beyond its lifetime
+        self.assertFalse(second[0].rank is first[0].rank)
+
+def source_tree_responses(sub_url, payload):
+    if sub_url == "/tree_of_life/about":
+        return {"study_list": [
+            {"study_id": "pg_1", "tree_id": "t1", "git_sha": "abc"},
+            {"study_id": "pg_2", "tree_id": "t2", "git_sha": "abc"},
+            {"study_id": "pg_3", "tree_id": "t3", "git_sha": "def"},
+            {"study_id": "pg_4", "tree_id": "t4", "git_sha": "def"},
+            ]}
+    if sub_url == "/graph/source_tree":
+        if payload["study_id"] == "pg_3":
+            return {"error": "no such tree"}
+        if payload["study_id"] == "pg_4":
+            raise URLError("connection reset")
+        return {"newick": "(A,B);"}
+    raise AssertionError(sub_url)
+
+class SourceTreeCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_cached_by_git_sha(self):
+        service = CannedOpenTreeService(source_tree_responses)
+        service.use_source_tree_cache(self.tempdir)
+        service.gol_source_tree("pg_1", "t1", "abc")
+        self.assertEqual(service.gol_source_tree("pg_1", "t1", "abc"), {"newick": "(A,B);"})
+        self.assertEqual(len(service.requests), 1)
+        reopened = SourceTreeCache(self.tempdir)
+        self.assertEqual(reopened.get("pg_1", "t1", "abc"), {"newick": "(A,B);"})
+
+    def test_prefetch(self):
+        service = CannedOpenTreeService(source_tree_responses)
+        service.use_source_tree_cache(self.tempdir)
+        service.gol_source_tree("pg_1", "t1", "abc")
+        report = service.prefetch_source_trees()
+        self.assertEqual(report["num_source_trees"], 4)
+        self.assertEqual(report["num_cached"], 1)
+        self.assertEqual(report["num_fetched"], 1)
+        self.assertEqual([s["study_id"] for s in report["failed"]], ["pg_3", "pg_4"])
+        self.assertEqual(len(service.source_tree_cache), 2)
+        self.assertEqual(len(os.listdir(os.path.join(self.tempdir, "blobs"))), 1)
+
+STUDY_LISTING = [
+        {"ot:studyId": "pg_1", "ot:studyPublication": "http://dx.doi.org/10.1/abc", "ot:focalCladeOTTTaxonName": "Garcinia"},
+        {"ot:studyId": "pg_2", "ot:studyPublication": "http://dx.doi.org/10.1/def", "ot:tag": ["ITS", "rbcL"]},
+        ]
+
+def study_responses(sub_url, payload, listing=STUDY_LISTING, tree_types=None):
+    if sub_url == "/studies/properties":
+        return {"study_properties": ["ot:studyId", "ot:studyPublication", "ot:tag"], "tree_properties": ["ot:ottTaxonName", "ot:curatedType"]}
+    if sub_url == "/studies/find_studies":
+        return {"matched_studies": listing}
+    if sub_url.startswith("/study/"):
+        study_id = sub_url.split("/")[2]
+        tree_type = (tree_types or {}).get(study_id, "Bayesian")
+        return {"nexml": {
+            "otusById": {"otus1": {"otuById": {
+                "otu1": {"^ot:ottTaxonName": "Garcinia mangostana", "^ot:ottId": 1},
+                "otu2": {"^ot:ottTaxonName": "Homo sapiens", "^ot:ottId": 2}}}},
+            "treesById": {"trees1": {"treeById": {
+                "tree1": {"^ot:curatedType": "ML", "nodeById": {"n1": {}, "n2": {"@otu": "otu1"}}},
+                "tree2": {"^ot:curatedType": tree_type, "nodeById": {"n1": {"@otu": "otu2"}}},
+                }}}}}
+    raise AssertionError(sub_url)
+
+class IterStudiesTest(unittest.TestCase):
+
+    def test_iter_find_studies(self):
+        service = CannedOpenTreeService(study_responses)
+        studies = list(service.iter_studies_find_studies(verbose=True, fields=["ot:tag"], start=1, limit=5))
+        self.assertEqual(studies, [{"ot:studyId": "pg_2", "ot:tag": ["ITS", "rbcL"]}])
+        self.assertEqual(service.requests, [("/studies/find_studies", {"exact": False, "verbose": True})])
+
+    def test_iter_find_trees(self):
+        def responses(sub_url, payload):
+            return {"matched_studies": [
+                {"ot:studyId": "pg_1", "ot:studyYear": 2001, "matched_trees": [
+                    {"nexson_id": "tree1", "oti_tree_id": "pg_1_tree1", "ot:curatedType": "ML", "ot:branchLengthMode": "x"}]},
+                {"ot:studyId": "pg_2", "matched_trees": []}]}
+        service = CannedOpenTreeService(responses)
+        studies = list(service.iter_studies_find_trees("ot:ottTaxonName", "Garcinia", fields=["ot:curatedType"], limit=1))
+        self.assertEqual(studies, [{"ot:studyId": "pg_1", "matched_trees": [
+            {"nexson_id": "tree1", "oti_tree_id": "pg_1_tree1", "ot:curatedType": "ML"}]}])
+
+    def test_error(self):
+        service = CannedOpenTreeService(lambda sub_url, payload: {"error": "bad property"})
+        self.assertRaises(OpenTreeService.OpenTreeError, list, service.iter_studies_find_trees("x", "y"))
+
+class StudyMirrorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.service = ValidatingOpenTreeService(study_responses)
+        self.mirror = self.service.use_study_mirror(
+                os.path.join(self.tempdir, "mirror.sqlite"),
+                sync=True,
+                include_otus=True)
+
+    def tearDown(self):
+        self.mirror.close()
+        shutil.rmtree(self.tempdir)
+
+    def test_find_studies(self):
+        self.assertEqual(len(self.service.studies_find_studies()["matched_studies"]), 2)
+        self.assertEqual(
+                self.service.studies_find_studies("ot:tag", "rbcL", exact=True),
+                {"matched_studies": [{"ot:studyId": "pg_2"}]})
+        result = self.service.studies_find_studies("ot:studyPublication", "10.1/abc", verbose=True)
+        self.assertEqual(result["matched_studies"], [STUDY_LISTING[0]])
+        self.assertEqual(self.mirror.search("garcinia"), ["pg_1", "pg_2"])
+
+    def test_searchable_properties(self):
+        del self.service.requests[:]
+        self.assertEqual(self.service.studies_properties(), {
+            "study_properties": ["ot:studyId", "ot:studyPublication", "ot:tag"],
+            "tree_properties": ["ot:curatedType", "ot:ottTaxonName"]})
+        self.assertEqual(self.service.requests, [])
+        self.assertRaises(ValueError, self.service.studies_find_studies, "ot:focalCladeOTTTaxonName", "Garcinia")
+        self.assertRaises(ValueError, self.service.studies_find_trees, "ot:studyId", "pg_1")
+
+    def test_find_trees(self):
+        result = self.service.studies_find_trees("ot:ottTaxonName", "Garcinia")
+        self.assertEqual(result["matched_studies"], [
+            {"ot:studyId": "pg_1", "matched_trees": [{"nexson_id": "tree1", "oti_tree_id": "pg_1_tree1"}]},
+            {"ot:studyId": "pg_2", "matched_trees": [{"nexson_id": "tree1", "oti_tree_id": "pg_2_tree1"}]},
+            ])
+        result = self.service.studies_find_trees("ot:curatedType", "Bayesian", exact=True, verbose=True)
+        self.assertEqual(result["matched_studies"][0]["matched_trees"][0]["ot:curatedType"], "Bayesian")
+        self.assertEqual(result["matched_studies"][0]["ot:studyPublication"], "http://dx.doi.org/10.1/abc")
+
+    def test_incremental_sync(self):
+        del self.service.requests[:]
+        self.service.responses = lambda sub_url, payload: study_responses(
+                sub_url,
+                payload,
+                listing=STUDY_LISTING + [{"ot:studyId": "pg_3"}])
+        report = self.mirror.sync(self.service, include_otus=True)
+        self.assertEqual(report, {"added": 1, "changed": 0, "removed": 0, "unchanged": 2})
+        # every study is revalidated, and only the new one is sent in full
+        self.assertEqual(sorted(r[0] for r in self.service.requests), [
+            "/studies/find_studies", "/studies/properties", "/study/pg_1", "/study/pg_2", "/study/pg_3"])
+        self.assertEqual(sorted(self.service.not_modified), ["/study/pg_1", "/study/pg_2"])
+        self.service.responses = study_responses
+        report = self.mirror.sync(self.service, include_otus=True)
+        self.assertEqual(report["removed"], 1)
+        self.assertEqual(len(self.mirror), 2)
+
+    def test_tree_change(self):
+        # only a tree of pg_1 changes: its listing record stays the same
+        self.service.responses = lambda sub_url, payload: study_responses(
+                sub_url,
+                payload,
+                tree_types={"pg_1": "ML"})
+        report = self.mirror.sync(self.service, include_otus=True)
+        self.assertEqual(report, {"added": 0, "changed": 1, "removed": 0, "unchanged": 1})
+        result = self.service.studies_find_trees("ot:curatedType", "Bayesian", exact=True)
+        self.assertEqual([s["ot:studyId"] for s in result["matched_studies"]], ["pg_2"])
+
+    def test_search_syntax(self):
+        self.assertEqual(self.mirror.search('garcinia"'), ["pg_1", "pg_2"])
+        self.assertEqual(self.mirror.search("AND"), [])
+        self.assertEqual(self.mirror.search("garcinia mangostana"), ["pg_1", "pg_2"])
+
+    def test_never_synced(self):
+        mirror = self.service.use_study_mirror(os.path.join(self.tempdir, "empty.sqlite"))
+        try:
+            self.assertEqual(mirror.last_synced, None)
+            self.assertRaises(ValueError, mirror.search, "garcinia")
+            self.assertRaises(ValueError, self.service.studies_find_studies)
+            self.assertRaises(ValueError, self.service.studies_find_trees, "ot:ottTaxonName", "Garcinia")
+        finally:
+            mirror.close()
+        self.assertNotEqual(self.mirror.last_synced, None)
+
+if __name__ == "__main__":
+    unittest.main()
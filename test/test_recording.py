@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+if sys.hexversion < 0x03000000:
+    from urllib2 import HTTPError
+else:
+    from urllib.error import HTTPError
+
+from pyopentree.mockserver import MockOpenTreeServer
+from pyopentree import OpenTreeService
+from pyopentree import RecordedResponse
+from pyopentree import RecordingStore
+from pyopentree import canonical_request_key
+
+class RecordingStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, "recordings")
+        self.server = MockOpenTreeServer().start()
+        self.server.add_response("/tnrs/contexts", {"PLANTS": ["Plants"]})
+        self.server.add_response("/study/pg_1", {"nexml": {}}, method="GET", headers={"ETag": "\"v1\""})
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.tempdir)
+
+    def service(self, mode):
+        service = OpenTreeService(base_url=self.server.base_url)
+        service.use_recording_store(self.path, mode=mode)
+        return service
+
+    def test_record_then_replay(self):
+        service = self.service("record")
+        self.assertEqual(service.tnrs_contexts(), {"PLANTS": ["Plants"]})
+        self.assertEqual(service.request_conditionally("/study/pg_1")[1:], ("\"v1\"", None))
+        with self.assertRaises(HTTPError):
+            service.taxonomy_about()
+        self.assertEqual(len(service.recording_store), 3)
+        self.server.stop()
+
+        service = self.service("replay")
+        self.assertEqual(service.tnrs_contexts(), {"PLANTS": ["Plants"]})
+        self.assertEqual(service.request_conditionally("/study/pg_1"), (b'{"nexml": {}}', "\"v1\"", None))
+        with self.assertRaises(HTTPError) as cm:
+            service.taxonomy_about()
+        self.assertEqual(cm.exception.code, 404)
+        with self.assertRaises(IOError):
+            service.tnrs_infer_context(["Aster"])
+
+    def test_not_modified_round_trip(self):
+        service = self.service("record")
+        self.assertEqual(service.request_conditionally("/study/pg_1")[1], "\"v1\"")
+        # the server now answers the conditional request with a 304
+        key = list(self.server.responses.keys())[-1]
+        self.server.responses[key] = (304, {"ETag": "\"v1\""}, b"")
+        self.assertEqual(service.request_conditionally("/study/pg_1", etag="\"v1\""), (None, "\"v1\"", None))
+        self.assertEqual(service.recording_store.get(key)[0], 200)
+        self.server.stop()
+
+        service = self.service("replay")
+        self.assertEqual(service.request_conditionally("/study/pg_1", etag="\"v1\""), (None, "\"v1\"", None))
+        self.assertEqual(service.request_conditionally("/study/pg_1", etag="\"v0\"")[0], b'{"nexml": {}}')
+        self.assertEqual(service.request_conditionally("/study/pg_1")[0], b'{"nexml": {}}')
+        # e.g., recorded by an earlier version of the store
+        service.recording_store.put(key, 304, {}, b"")
+        with self.assertRaises(HTTPError) as cm:
+            service.request("/study/pg_1", protocol="GET")
+        self.assertEqual(cm.exception.code, 304)
+
+    def test_query_string_in_key(self):
+        self.assertEqual(canonical_request_key("GET", "/study/pg_1/tree/tree1.tre?z=1&subtree_id=node1"),
+                "GET /study/pg_1/tree/tree1.tre?subtree_id=node1&z=1")
+        store = RecordingStore(self.path)
+        def urlopen(request):
+            subtree_id = request.get_full_url().rsplit("=", 1)[1]
+            return RecordedResponse(request.get_full_url(), 200, {}, "({});".format(subtree_id).encode("utf-8"))
+        class SubtreeService(OpenTreeService):
+            def open_url(self, request):
+                return store.open_url(request, self.base_url, urlopen, mode="auto")
+        service = SubtreeService(base_url="http://localhost/v2")
+        self.assertEqual(service.get_study_subtree("pg_1", "tree1", "node1", schema="newick"), "(node1);")
+        self.assertEqual(service.get_study_subtree("pg_1", "tree1", "node2", schema="newick"), "(node2);")
+        self.assertEqual(len(store), 2)
+
+    def test_auto_records_once(self):
+        service = self.service("auto")
+        service.tnrs_contexts()
+        service.tnrs_contexts()
+        self.assertEqual(self.server.stats["requests"], 1)
+        with open(os.path.join(self.path, "requests.jsonl")) as src:
+            self.assertEqual(len(src.readlines()), 1)
+
+    def test_mock_server_serves_recordings(self):
+        self.service("record").tnrs_contexts()
+        with MockOpenTreeServer() as server:
+            self.assertEqual(server.load_recording_store(RecordingStore(self.path)), 1)
+            service = OpenTreeService(base_url=server.base_url)
+            self.assertEqual(service.tnrs_contexts(), {"PLANTS": ["Plants"]})
+
+if __name__ == "__main__":
+    unittest.main()
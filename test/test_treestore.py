@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from pyopentree import OpenTreeService
+from pyopentree import TreeStore
+
+class TreeService(OpenTreeService):
+
+    def __init__(self):
+        OpenTreeService.__init__(self, base_url="http://localhost/v2")
+        self.requests = []
+
+    def get_study_tree(self, study_id, tree_id, schema="nexson"):
+        self.requests.append((study_id, tree_id))
+        if tree_id == "missing":
+            raise OpenTreeService.OpenTreeError("no such tree")
+        return "({},{});".format(study_id, tree_id)
+
+class TreeStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_put_and_get(self):
+        store = TreeStore(self.tempdir)
+        self.assertEqual(store.get("pg_1", "tree1"), None)
+        store.put("pg_1", "tree1", "((A,B),C);")
+        store.put("pg_1", "tree1", "#NEXUS\n", schema="nexus")
+        self.assertEqual(store.get("pg_1", "tree1"), "((A,B),C);")
+        store.put("pg_2", "tree1", "(('Garcínia',B),C);")
+        self.assertEqual(store.get("pg_2", "tree1"), "(('Garcínia',B),C);")
+        store.put("pg_1", "tree1", "((A,C),B);")
+        self.assertEqual(store.get("pg_1", "tree1"), "((A,C),B);")
+        self.assertEqual(store.get("pg_1", "tree1", schema="NEXUS"), "#NEXUS\n")
+        tree = store.get_compact_tree("pg_1", "tree1")
+        self.assertEqual(tree.as_newick(), "((A,C),B);")
+        store.close()
+        store = TreeStore(self.tempdir)
+        self.assertEqual(len(store), 3)
+        self.assertEqual(store.get("pg_1", "tree1"), "((A,C),B);")
+        store.close()
+
+    def test_empty_tree_in_empty_store(self):
+        store = TreeStore(self.tempdir)
+        store.put("pg_1", "tree1", "")
+        self.assertEqual(store.get("pg_1", "tree1"), "")
+        store.close()
+
+    def test_fetch(self):
+        store = TreeStore(self.tempdir)
+        store.put("pg_1", "tree1", "(A,B);")
+        service = TreeService()
+        report = store.fetch(service, [("pg_1", "tree1"), ("pg_1", "missing"), ("pg_2", "tree1")])
+        self.assertEqual(report, {"num_fetched": 1, "failed": [("pg_1", "missing")]})
+        self.assertEqual(sorted(service.requests), [("pg_1", "missing"), ("pg_2", "tree1")])
+        self.assertEqual(store.get("pg_2", "tree1"), "(pg_2,tree1);")
+        self.assertEqual(store.get("pg_1", "missing"), None)
+        store.close()
+
+    def test_interrupted_write_ignored(self):
+        store = TreeStore(self.tempdir)
+        store.put("pg_1", "tree1", "((A,B),C);")
+        store.put("pg_1", "tree2", "((A,C),B);")
+        store.close()
+        with open(store.data_path, "r+b") as dest:
+            dest.truncate(12)
+        store = TreeStore(self.tempdir)
+        self.assertEqual(store.keys(), [("pg_1", "tree1", "newick")])
+        store.close()
+
+    def test_torn_index_line_ignored(self):
+        store = TreeStore(self.tempdir)
+        store.put("pg_1", "tree1", "((A,B),C);")
+        store.put("pg_1", "tree2", "((A,C),B);")
+        store.close()
+        with open(store.index_path, "r+b") as dest:
+            dest.truncate(os.path.getsize(store.index_path) - 10)
+        store = TreeStore(self.tempdir)
+        self.assertEqual(store.keys(), [("pg_1", "tree1", "newick")])
+        store.put("pg_1", "tree3", "(A,(B,C));")
+        store.close()
+        store = TreeStore(self.tempdir)
+        self.assertEqual(sorted(store.keys()), [("pg_1", "tree1", "newick"), ("pg_1", "tree3", "newick")])
+        self.assertEqual(store.get("pg_1", "tree3"), "(A,(B,C));")
+        store.close()
+
+if __name__ == "__main__":
+    unittest.main()